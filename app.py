@@ -1,26 +1,106 @@
-# import json
+import asyncio
+import hashlib
 import os
 import secrets
+import stat
+import time
 from pathlib import Path
 
+from aiohttp import ClientError
 from dotenv import load_dotenv
 
 # from fhir.resources.patient import Patient
-from fhirpy import SyncFHIRClient
-from flask import Flask, flash, redirect, render_template, request, url_for
+from fhirpy.base.exceptions import OperationOutcome, ResourceNotFound
+from flask import (
+    Flask,
+    Response,
+    flash,
+    jsonify,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
+from jinja2 import FileSystemBytecodeCache
+from lxml import etree
 
+import fhir_json
+from cda_cache import cda_cache, get_cda_document, iter_cached_cda
+from cda_sections import narrative_html, section_cache
 from create_patient_record import create_sample_patient_record
+from fhir_async import async_pool_stats, async_to_sync, get_async_fhir_client
+from fhir_paging import (
+    check_page_cursor,
+    page_prefetcher,
+    parse_patient_page,
+    parse_search_page,
+    patient_page_params,
+    search_page_params,
+)
+from fhir_pool import get_fhir_client, pool_stats
+from fhir_validation import get_validation_level, validate_resource
+from patient_cache import patient_cache
+from patient_projection import project_patient
+from search_registry import get_search_params
+from summary_cache import summary_fragment_cache
+from summary_loader import load_patient_summary
+from terminology import get_language_code, get_relationship_code
 
 dotenv_path = Path(".env")
 load_dotenv()
 
 DEVELOPMENT = os.getenv("DEVELOPMENT")
+# the forms build Patient dicts by hand; "schema" or "full" checks them before saving
+PATIENT_FORM_VALIDATION = get_validation_level("PATIENT_FORM_VALIDATION", "none")
+
+# Compiled templates are shared by every worker through a bytecode cache, and
+# each worker compiles and renders them all once before it takes traffic;
+# unset uses Jinja's private per-user directory in the system temp directory
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR")
+TEMPLATE_WARMUP = os.getenv("TEMPLATE_WARMUP", "True") == "True"
 
 app = Flask(__name__)
 
 app.config["SECRET_KEY"] = secrets.token_hex(16)
 
 
+def get_bytecode_cache(directory):
+    """Returns the Jinja bytecode cache in directory, or None if it is empty
+
+    Cached bytecode is executed when it is loaded, so the directory must
+    belong to this user and be closed to everyone else; ValueError is
+    raised otherwise. None uses Jinja's per-user directory, which Jinja
+    creates and checks the same way.
+    """
+    if directory is None:
+        return FileSystemBytecodeCache()
+    if not directory:
+        return None
+    os.makedirs(directory, mode=stat.S_IRWXU, exist_ok=True)
+    info = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or stat.S_IMODE(info.st_mode) & (stat.S_IRWXG | stat.S_IRWXO)
+    ):
+        raise ValueError(
+            f"JINJA_CACHE_DIR {directory} must be a directory owned by this "
+            "user with mode 0700"
+        )
+    return FileSystemBytecodeCache(directory)
+
+
+bytecode_cache = get_bytecode_cache(JINJA_CACHE_DIR)
+if bytecode_cache is not None:
+    app.jinja_options = {**app.jinja_options, "bytecode_cache": bytecode_cache}
+
+# Run async views on the worker's shared event loop so upstream calls from
+# every request thread are multiplexed over one aiohttp connection pool
+app.async_to_sync = async_to_sync
+
+
 # welcome page
 @app.route("/", methods=["GET"])
 def index():
@@ -46,129 +126,110 @@ def get_patient_summary():
 def fhir_patient_list():
     """Get a list of patients from the HAPI FHIR server and display them to the user"""
 
-    client = SyncFHIRClient(FHIR_SERVER_URL)
+    client = get_fhir_client(FHIR_SERVER_URL)
+    cursor = request.args.get("page")
     try:
-        patients = client.resources("Patient").sort("-_lastUpdated").limit(100).fetch()
-
-        patient_list = []
-        for patient in patients:
-            patient_list.append(
-                {
-                    "id": patient.id,
-                }
-            )
-
-        return render_template("fhir_patient_list.html", patients=patient_list)
-    except (ConnectionError, TimeoutError, ValueError) as e:
+        # Only ids are listed, so ask for ids and follow the Bundle paging links
+        if cursor:
+            bundle = page_prefetcher.get(cursor, client.get_bundle, FHIR_SERVER_URL)
+        else:
+            bundle = client.get_bundle("Patient", patient_page_params())
+        patient_list, next_page, previous_page = parse_patient_page(bundle)
+        page_prefetcher.prefetch(next_page, client.get_bundle, FHIR_SERVER_URL)
+
+        return render_template(
+            "fhir_patient_list.html",
+            patients=patient_list,
+            next_page=next_page,
+            previous_page=previous_page,
+        )
+    except ResourceNotFound as e:
+        if cursor:
+            return expired_page("fhir_patient_list")
+        flash("Error fetching patient list: " + str(e), "alert-danger")
+        return render_template("fhir_patient_list.html")
+    except (ConnectionError, TimeoutError, ValueError, OperationOutcome) as e:
         flash("Error fetching patient list: " + str(e), "alert-danger")
         return render_template("fhir_patient_list.html")
 
 
+def expired_page(endpoint):
+    """Paging links expire on the server (410 Gone), so start again at page 1"""
+    flash(
+        "That page of results has expired, so you are back at the start.",
+        "alert-warning",
+    )
+    return redirect(url_for(endpoint))
+
+
 @app.route("/hl7/patient_summary/fhir/patient/search", methods=["GET", "POST"])
 def fhir_patient_search():
     """Search for a patient record in the HAPI FHIR server"""
     if request.method == "POST":
         form_data = request.form
         resource_type = form_data.get("resource_type")
-        search_detail = {
-            "_id: Patient": form_data.get("id"),
-            "given: Patient": form_data.get("given"),
-            "family: Patient": form_data.get("family"),
-            "birthdate: Patient": form_data.get("birthdate"),
-            "_id: Practitioner": form_data.get("practitioner_id"),
-            "given: Practitioner": form_data.get("practitioner_given"),
-            "family: Practitioner": form_data.get("practitioner_family"),
-            "address-city: Practitioner": form_data.get("practitioner_city"),
-            "_id: Observation": form_data.get("observation_id"),
-            "code: Observation": form_data.get("observation_code"),
-            "performer: Observation": form_data.get("observation_performer"),
-            "_id: Medication": form_data.get("medication_id"),
-            "lot-number: Medication": form_data.get("lot_number"),
-            "ingredient-code: Medication": form_data.get("ingredient_code"),
-            "identifier: Medication": form_data.get("medication_name"),
-            "form: Medication": form_data.get("dose_form"),
-            "_id: MedicationRequest": form_data.get("medication_request_id"),
-            "status: MedicationRequest": form_data.get("medication_request_status"),
-            "medication: MedicationRequest": form_data.get(
-                "medication_request_medication"
-            ),
-            "patient: MedicationRequest": form_data.get("medication_request_patient"),
-            "_id: MedicationDispense": form_data.get("medication_dispense_id"),
-            "status: MedicationDispense": form_data.get("medication_dispense_status"),
-            "medication: MedicationDispense": form_data.get(
-                "medication_dispense_medication"
-            ),
-            "patient: MedicationDispense": form_data.get("medication_dispense_patient"),
-            "_id: MessageHeader": form_data.get("message_header_id"),
-            "destination: MessageHeader": form_data.get("message_header_destination"),
-            "source: MessageHeader": form_data.get("message_header_source"),
-            "author: MessageHeader": form_data.get("message_header_author"),
-            "event: MessageHeader": form_data.get("message_header_event"),
-            "_id: ImagingStudy": form_data.get("imaging_study_id"),
-            "patient: ImagingStudy": form_data.get("imaging_study_patient"),
-            "modality: ImagingStudy": form_data.get("imaging_study_modality"),
-            "series: ImagingStudy": form_data.get("imaging_study_series"),
-            "started: ImagingStudy": form_data.get("imaging_study_started"),
-        }
+        search_params = get_search_params(resource_type, form_data)
+        if search_params is None:
+            flash(f"Unsupported resource type: {resource_type}", "alert-danger")
+            return redirect(url_for("fhir_patient_search"))
 
-        client = SyncFHIRClient(FHIR_SERVER_URL)
+        client = get_fhir_client(FHIR_SERVER_URL)
 
         try:
-            if resource_type == "Patient":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
-                )
-            elif resource_type == "Practitioner":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
+            if form_data.get("paged") == "True":
+                bundle = client.get_bundle(
+                    resource_type, search_page_params(search_params)
                 )
-            elif resource_type == "Observation":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
-                )
-            elif resource_type == "Medication":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
-                )
-            elif resource_type == "MedicationRequest":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
-                )
-            elif resource_type == "MedicationDispense":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
-                )
-            elif resource_type == "MessageHeader":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
-                )
-            elif resource_type == "ImagingStudy":
-                search_params = filter_search_params(search_detail)
-                resources = (
-                    client.resources(resource_type).search(**search_params).fetch()
-                )
-            else:
-                flash(f"Unsupported resource type: {resource_type}", "alert-danger")
-                return redirect(url_for("fhir_patient_search"))
+                return render_search_page(client, bundle)
 
-            bundle_json = [resource.serialize() for resource in resources[:1]]
+            # Only the top hit is shown, so only the top hit is requested
+            resources = (
+                client.resources(resource_type).search(**search_params).limit(1).fetch()
+            )
+            bundle_json = [resource.serialize() for resource in resources]
 
             return render_template("fhir_patient_bundles.html", bundle_json=bundle_json)
 
-        except (ConnectionError, TimeoutError, ValueError) as e:
+        except (
+            ConnectionError,
+            TimeoutError,
+            ValueError,
+            ResourceNotFound,
+            OperationOutcome,
+        ) as e:
             flash("Error fetching patient list: " + str(e), "alert-danger")
             return redirect(url_for("fhir_patient_list"))
 
+    cursor = request.args.get("page")
+    if cursor:
+        client = get_fhir_client(FHIR_SERVER_URL)
+        try:
+            return render_search_page(
+                client,
+                page_prefetcher.get(cursor, client.get_bundle, FHIR_SERVER_URL),
+            )
+        except ResourceNotFound:
+            return expired_page("fhir_patient_search")
+        except (ConnectionError, TimeoutError, ValueError, OperationOutcome) as e:
+            flash("Error fetching search results: " + str(e), "alert-danger")
+            return redirect(url_for("fhir_patient_search"))
+
     return render_template("fhir_patient_search.html")
 
 
+def render_search_page(client, bundle):
+    """Render one page of search results and prefetch the page after it"""
+    bundle_json, next_page, previous_page = parse_search_page(bundle)
+    if client is not None:
+        page_prefetcher.prefetch(next_page, client.get_bundle, FHIR_SERVER_URL)
+    return render_template(
+        "fhir_patient_bundles.html",
+        bundle_json=bundle_json,
+        next_page=next_page,
+        previous_page=previous_page,
+    )
+
+
 @app.route(
     "/hl7/patient_summary/fhir/patient",
     defaults={"patient_id": None},
@@ -182,257 +243,93 @@ def fhir_patient_summary(patient_id):
         patient_id = request.form.get("patient_id")
         return redirect(url_for("fhir_patient_summary", patient_id=patient_id))
 
-    client = SyncFHIRClient(FHIR_SERVER_URL)
+    client = get_fhir_client(FHIR_SERVER_URL)
 
     try:
-        patient = client.resources("Patient").search(_id=patient_id).get()
-        patient_json = patient.serialize()
-
-        # Convert FHIR resources to JSON
-        patient_info = []
-        for key, value in patient_json.items():
-            patient_info.append({"key": key, "value": value})
+        patient_json = patient_cache.get_patient(client, patient_id)
 
-    except (ConnectionError, TimeoutError, ValueError) as e:
+    except (ConnectionError, TimeoutError, ValueError, ResourceNotFound) as e:
         flash("The patient ID was not found: " + str(e), "alert-danger")
         return redirect(url_for("fhir_patient_list"))
 
-    # Extract common patient information with fault tolerance
-    profile_urls = patient_json.get("meta", {}).get("profile", [])
-    profile_links = " ".join(
-        [f'<a href="{url}" target="_blank">{url}</a>' for url in profile_urls]
-    )
+    return render_summary_page(patient_id, patient_json)
 
-    patient_data = {
-        "id": patient_id,
-        "name": extract_patient_name(patient_json),
-        "identifier": extract_patient_identifier(patient_json),
-        "birth_date": patient_json.get("birthDate", "N/A"),
-        "gender": patient_json.get("gender", "N/A"),
-        "address": extract_patient_address(patient_json),
-        "phone": extract_patient_telecom(patient_json, "phone"),
-        "email": extract_patient_telecom(patient_json, "email"),
-        "source": patient_json.get("meta", {}).get("source", "N/A"),
-        "versionId": patient_json.get("meta", {}).get("versionId", "N/A"),
-        "last_updated": patient_json.get("meta", {}).get("lastUpdated", "N/A"),
-        "profile": profile_links,
-        "active": patient_json.get("active", "N/A"),
-        "marital_status": extract_patient_marital_status(patient_json, "maritalStatus"),
-        "deceased": patient_json.get("deceasedDateTime", "N/A"),
-        "deceased_age": patient_json.get("deceasedAge", "N/A"),
-        "multiple_birth": patient_json.get("multipleBirthBoolean", "N/A"),
-        "multiple_birth_integer": patient_json.get("multipleBirthInteger", "N/A"),
-        "communication": extract_patient_languages(patient_json, "language"),
-        "contact": extract_patient_contact(patient_json, "contact"),
-        "contact_relationship": extract_patient_contact_relationship(
-            patient_json, "relationship"
-        ),
-        "contact_address": extract_patient_contact_address(
-            patient_json, "contact_address"
-        ),
-        "contact_phone": extract_patient_contact_phone(patient_json, "contact_phone"),
-        "contact_email": extract_patient_contact_email(patient_json, "contact_email"),
-        "general_practitioner": extract_general_practitioner(
-            patient_json, "generalPractitioner"
-        ),
-        "managing_organization": extract_managing_organization(
-            patient_json,
-            "managingOrganization",
-        ),
-        "link": patient_json.get("link", "N/A"),
-        "photo": patient_json.get("photo", "N/A"),
-        "text": extract_patient_text(patient_json, "text"),
-    }
 
+def render_summary_fragment(patient_id, patient_json):
+    """Render the body of the patient summary page"""
     return render_template(
-        "fhir_patient_summary.html", patient=patient_data, patient_json=patient_info
+        "fhir_patient_summary_fragment.html",
+        patient=project_patient(patient_id, patient_json),
+        patient_json=build_patient_info(patient_json),
     )
 
 
-# Helper functions to extract information with fault tolerance
-def extract_patient_name(patient_json):
-    """Extracts a readable name from patient data"""
-    names = patient_json.get("name", [])
-    if names:
-        first_name = names[0].get("given", [""])[0]
-        last_name = names[0].get("family", "")
-        official_name = names[0].get("use", "")
-        if official_name:
-            return f"{first_name} {last_name} ({official_name})".strip()
-        return f"{first_name} {last_name}".strip()
-
-
-def extract_patient_identifier(patient_json):
-    """Extracts identifier information based on type"""
-    identifiers = patient_json.get("identifier", [])
-    identifier_list = []
-    for identifier in identifiers:
-        identifier_system = identifier.get("system", "")
-        identifier_value = identifier.get("value", "")
-        identifier_list.append(f"{identifier_system} - {identifier_value}")
-    return ", ".join(identifier_list) if identifier_list else "N/A"
-
-
-def extract_patient_address(patient_json):
-    """Extracts the first line of address information if available"""
-    addresses = patient_json.get("address", [])
-    if addresses:
-        line = addresses[0].get("line", [""])[0]
-        city = addresses[0].get("city", "")
-        state = addresses[0].get("state", "")
-        postal = addresses[0].get("postalCode", "")
-        address_use = addresses[0].get("use", "")
-        if address_use:
-            return f"{line}, {city}, {state} {postal} ({address_use})".strip(", ")
-        return f"{line}, {city}, {state} {postal}".strip(", ")
-    return "N/A"
-
-
-def extract_patient_telecom(patient_json, telecom_type):
-    """Extracts telecom information based on type"""
-    telecoms = patient_json.get("telecom", [])
-    if telecoms:
-        phone_type = telecoms[0].get("use", "")
-        email_type = telecoms[1].get("use", "") if len(telecoms) > 1 else "N/A"
-        if telecom_type == "phone":
-            return telecoms[0].get("value", "N/A") + f" ({phone_type})"
-        if telecom_type == "email" and len(telecoms) > 1:
-            return telecoms[1].get("value", "N/A") + f" ({email_type})"
-    return "N/A"
-
-
-def extract_patient_marital_status(patient_json, marital_status_type):
-    """Extracts marital status information based on type"""
-    marital_status = patient_json.get("maritalStatus", {})
-    if marital_status_type == "maritalStatus":
-        return marital_status.get("coding", [{}])[0].get("display", "N/A")
-    return "N/A"
-
-
-def extract_patient_contact(patient_json, contact_type):
-    """Extracts contact information based on type"""
-    contact = patient_json.get("contact", [])
-    if contact:
-        contact_name = contact[0].get("name", {})
-        family_name = contact_name.get("family", "")
-        given_name = contact_name.get("given", [""])[0]
-        prefix_extension = contact_name.get("_family", {}).get("extension", [])
-        value_string = next(
-            (
-                ext.get("valueString", "")
-                for ext in prefix_extension
-                if ext.get("url")
-                == "http://hl7.org/fhir/StructureDefinition/humanname-own-prefix"
-            ),
-            "",
-        )
-        return f"{value_string} {given_name} {family_name}".strip()
-    return "N/A"
-
-
-def extract_patient_contact_relationship(patient_json, contact_relationship_type):
-    """Extracts contact relationship information based on type"""
-    contact = patient_json.get("contact", [])
-    if contact:
-        contact_relationship = (
-            contact[0]
-            .get("relationship", [{}])[0]
-            .get("coding", [{}])[0]
-            .get("display", "N/A")
-        )
-        return contact_relationship
-    return "N/A"
-
-
-def extract_patient_contact_address(patient_json, contact_address_type):
-    """Extracts contact address information based on type"""
-    contact = patient_json.get("contact", [])
-    if contact:
-        contact_address = contact[0].get("address", {})
-        contact_address_use = contact_address.get("use", "")
-        contact_address_line = contact_address.get("line", [""])[0]
-        contact_city = contact_address.get("city", "")
-        contact_state = contact_address.get("state", "")
-        contact_postal_code = contact_address.get("postalCode", "")
-        return f"{contact_address_line}, {contact_city}, {contact_state} {contact_postal_code} ({contact_address_use})".strip(
-            ", "
-        )
-    return "N/A"
-
-
-def extract_patient_contact_phone(patient_json, contact_phone_type):
-    """Extracts contact phone information based on type"""
-    contact = patient_json.get("contact", [])
-    if contact:
-        contact_phone = contact[0].get("telecom", [])
-        contact_phone_use = contact_phone[0].get("use", "")
-        contact_phone_value = contact_phone[0].get("value", "")
-        return f"{contact_phone_value} ({contact_phone_use})"
-    return "N/A"
-
-
-def extract_patient_contact_email(patient_json, contact_email_type):
-    """Extracts contact email information based on type"""
-    contact = patient_json.get("contact", [])
-    if contact:
-        contact_email = contact[0].get("telecom", [])
-        contact_email_use = contact_email[1].get("use", "")
-        contact_email_value = contact_email[1].get("value", "")
-        return f"{contact_email_value} ({contact_email_use})"
-    return "N/A"
-
-
-def extract_general_practitioner(patient_json, general_practitioner_type):
-    """Extracts general practitioner information based on type"""
-    general_practitioner = patient_json.get("generalPractitioner", {})
-    if general_practitioner_type == "generalPractitioner":
-        return (
-            general_practitioner[0].get("reference", "N/A")
-            if general_practitioner
-            else "N/A"
-        )
-    return "N/A"
-
-
-def extract_managing_organization(patient_json, managing_organization_type):
-    """Extracts managing organization information based on type"""
-    managing_organization = patient_json.get("managingOrganization", {})
-    if managing_organization_type == "managingOrganization":
-        return (
-            managing_organization.get("reference", "N/A")
-            if managing_organization
-            else "N/A"
+_summary_page_version = None
+
+
+def summary_page_version():
+    """Digest of the templates around the summary fragment
+
+    It is part of every fragment key and ETag, so a deploy that changes the
+    page layout is not answered from copies of the old page.
+    """
+    global _summary_page_version
+    if _summary_page_version is None or app.debug:
+        digest = hashlib.sha256()
+        for name in (
+            "base.html",
+            "fhir_patient_summary.html",
+            "fhir_patient_summary_fragment.html",
+        ):
+            source, _, _ = app.jinja_env.loader.get_source(app.jinja_env, name)
+            digest.update(source.encode("utf-8"))
+        _summary_page_version = digest.hexdigest()[:16]
+    return _summary_page_version
+
+
+def render_summary_page(patient_id, patient_json):
+    """Serve the summary page from the fragment cache with a strong ETag
+
+    A browser or proxy that already holds the current version gets 304
+    Not Modified without the page being rendered. If-None-Match is compared
+    weakly, as HTTP requires, so a copy a compressing proxy marked W/ still
+    matches. Pages that carry flashed messages are one-off and sent without
+    an ETag.
+    """
+    summary_html, etag = summary_fragment_cache.get_fragment(
+        patient_id, patient_json, summary_page_version(), render_summary_fragment
+    )
+    if session.get("_flashes"):
+        response = make_response(
+            render_template("fhir_patient_summary.html", summary_html=summary_html)
         )
-    return "N/A"
+        response.headers["Cache-Control"] = "no-store"
+        return response
 
-
-def extract_patient_languages(patient_json, language_type):
-    """Extracts language information based on type"""
-    languages = patient_json.get("communication", [])
-    language_list = []
-    for language in languages:
-        language_code = (
-            language.get("language", {}).get("coding", [{}])[0].get("display", "N/A")
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(
+            render_template("fhir_patient_summary.html", summary_html=summary_html)
         )
-        preferred = language.get("preferred", False)
-        preferred_text = " (preferred)" if preferred else ""
-        language_list.append(f"{language_code}{preferred_text}")
-    return ", ".join(language_list) if language_list else "N/A"
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
-def extract_patient_text(patient_json, text_type):
-    """Extracts text information based on type"""
-    text = patient_json.get("text", {})
-    if text_type == "text":
-        return text.get("div", "N/A")
-    return "N/A"
+def build_patient_info(patient_json):
+    """Convert FHIR resources to JSON key/value pairs for the payload view"""
+    patient_info = []
+    for key, value in patient_json.items():
+        patient_info.append({"key": key, "value": value})
+    return patient_info
 
 
 @app.route("/hl7/patient_summary/fhir/patient/edit", methods=["GET", "POST"])
 def edit_fhir_patient():
     """Edit a patient record in the HAPI FHIR server."""
 
-    client = SyncFHIRClient(FHIR_SERVER_URL)
+    client = get_fhir_client(FHIR_SERVER_URL)
     patient_id = request.args.get("patient_id")
 
     if request.method == "POST":
@@ -563,73 +460,49 @@ def edit_fhir_patient():
                     ],
                 }
             ],
-            "generalPractitioner": {
-                "reference": [
-                    {
-                        "reference": form_data.get("general_practitioner", ""),
-                        "type": "Practitioner",
-                        "identifier": [
-                            {
-                                "system": "http://hl7.org/fhir/sid/us-npi",
-                                "value": form_data.get("general_practitioner", ""),
-                            },
-                        ],
-                        "display": form_data.get("general_practitioner", ""),
-                    }
-                ]
-            },
+            "generalPractitioner": [
+                {
+                    "reference": form_data.get("general_practitioner", ""),
+                    "type": "Practitioner",
+                    "identifier": {
+                        "system": "http://hl7.org/fhir/sid/us-npi",
+                        "value": form_data.get("general_practitioner", ""),
+                    },
+                    "display": form_data.get("general_practitioner", ""),
+                }
+            ],
             "managingOrganization": {
-                "reference": [
-                    {
-                        "reference": form_data.get("managing_organization", ""),
-                        "type": "Organization",
-                        "identifier": [
-                            {
-                                "system": "http://hl7.org/fhir/sid/us-npi",
-                                "value": form_data.get("managing_organization", ""),
-                            },
-                        ],
-                        "display": form_data.get("managing_organization", ""),
-                    }
-                ]
+                "reference": form_data.get("managing_organization", ""),
+                "type": "Organization",
+                "identifier": {
+                    "system": "http://hl7.org/fhir/sid/us-npi",
+                    "value": form_data.get("managing_organization", ""),
+                },
+                "display": form_data.get("managing_organization", ""),
             },
-            "link": {
-                "reference": [
-                    {
+            "link": [
+                {
+                    "other": {
                         "reference": form_data.get("link", ""),
                         "type": "Patient",
-                        "identifier": [
-                            {
-                                "system": "http://hl7.org/fhir/sid/us-npi",
-                                "value": form_data.get("link", ""),
-                            },
-                        ],
                         "display": form_data.get("link", ""),
-                    }
-                ],
-            },
-            "photo": {
-                "reference": [
-                    {
-                        "reference": form_data.get("photo", ""),
-                        "type": "Photo",
-                        "identifier": [
-                            {
-                                "system": "http://hl7.org/fhir/sid/us-npi",
-                                "value": form_data.get("photo", ""),
-                            },
-                        ],
-                        "display": form_data.get("photo", ""),
-                    }
-                ],
-            },
+                    },
+                    "type": "seealso",
+                }
+            ],
+            "photo": [{"url": form_data.get("photo", "")}],
         }
 
         try:
+            validate_resource(
+                {"resourceType": "Patient", **updated_patient}, PATIENT_FORM_VALIDATION
+            )
             # Update patient on the HAPI FHIR server
             patient_resource = client.resource("Patient", **updated_patient)
             patient_resource.id = patient_id  # Set ID for updating
             patient_resource.save()
+            # Keep the saved version so the summary redirect is served from cache
+            patient_cache.store(patient_resource.serialize())
             flash("Patient information updated successfully.", "alert-success")
             return redirect(url_for("fhir_patient_summary", patient_id=patient_id))
         except (ConnectionError, TimeoutError, ValueError) as e:
@@ -638,8 +511,7 @@ def edit_fhir_patient():
 
     # If GET, render edit form with existing patient data
     try:
-        patient = client.resources("Patient").get(id=patient_id)
-        patient_json = patient.serialize()
+        patient_json = patient_cache.get_patient(client, patient_id)
     except Exception as e:
         flash("The patient ID was not found: " + str(e), "alert-danger")
         return redirect(url_for("fhir_patient_list"))
@@ -787,71 +659,52 @@ def new_fhir_patient():
             ],
             "generalPractitioner": [
                 {
-                    "resource_type": "GeneralPractitioner",
-                    "id": form_data.get("general_practitioner_id", ""),
                     "reference": form_data.get("general_practitioner", ""),
                     "type": "Practitioner",
-                    "identifier": [
-                        {
-                            "system": "http://hl7.org/fhir/sid/us-npi",
-                            "value": form_data.get("general_practitioner", ""),
-                        },
-                    ],
+                    "identifier": {
+                        "system": "http://hl7.org/fhir/sid/us-npi",
+                        "value": form_data.get("general_practitioner", ""),
+                    },
                     "display": form_data.get("general_practitioner_display", ""),
                 }
             ],
-            "managingOrganization": [
-                {
-                    "resource_type": "managingOrganization",
-                    "id": form_data.get("managing_organization_id", ""),
-                    "reference": form_data.get("managing_organization", ""),
-                    "type": "Organization",
-                    "identifier": [
-                        {
-                            "system": "http://hl7.org/fhir/sid/us-npi",
-                            "value": form_data.get("managing_organization", ""),
-                        },
-                    ],
-                    "display": form_data.get("managing_organization_display", ""),
+            "managingOrganization": {
+                "reference": form_data.get("managing_organization", ""),
+                "type": "Organization",
+                "identifier": {
+                    "system": "http://hl7.org/fhir/sid/us-npi",
+                    "value": form_data.get("managing_organization", ""),
                 },
-            ],
+                "display": form_data.get("managing_organization_display", ""),
+            },
             "link": [
                 {
-                    "resource_type": "Link",
-                    "id": form_data.get("link_id", ""),
-                    "reference": form_data.get("link", ""),
-                    "identifier": [
-                        {
-                            "system": "http://hl7.org/fhir/sid/us-npi",
-                            "value": form_data.get("link", ""),
-                        },
-                    ],
-                    "display": form_data.get("link_display", ""),
+                    "other": {
+                        "reference": form_data.get("link", ""),
+                        "type": "Patient",
+                        "display": form_data.get("link_display", ""),
+                    },
+                    "type": "seealso",
                 }
             ],
             "photo": [
                 {
-                    "resource_type": "Photo",
-                    "id": form_data.get("photo_id", ""),
-                    "reference": form_data.get("photo", ""),
-                    "type": "Photo",
-                    "identifier": [
-                        {
-                            "system": "http://hl7.org/fhir/sid/us-npi",
-                            "value": form_data.get("photo", ""),
-                        },
-                    ],
-                    "display": form_data.get("photo_display", ""),
+                    "url": form_data.get("photo", ""),
+                    "title": form_data.get("photo_display", ""),
                 }
             ],
         }
 
         print("New Patient Data:", new_patient)
-        client = SyncFHIRClient(FHIR_SERVER_URL)
+        client = get_fhir_client(FHIR_SERVER_URL)
         try:
+            validate_resource(
+                {"resourceType": "Patient", **new_patient}, PATIENT_FORM_VALIDATION
+            )
             # Create a new patient on the HAPI FHIR server
             patient_resource = client.resource("Patient", **new_patient)
             patient_resource.save()
+            patient_cache.store(patient_resource.serialize())
             flash("New patient record created successfully.", "alert-success")
             # print("Form data: ", form_data)
             return redirect(url_for("fhir_patient_list"))
@@ -862,69 +715,19 @@ def new_fhir_patient():
     return render_template("new_fhir_patient.html")
 
 
-def get_language_code(language_display):
-    """Returns the language code for a given language display name"""
-    language_map = {
-        "english": "en",
-        "french": "fr",
-        "german": "de",
-        "spanish": "es",
-        "italian": "it",
-        "portuguese": "pt",
-        "romanian": "ro",
-        "dutch": "nl",
-        "swedish": "sv",
-        "danish": "da",
-        "norwegian": "no",
-        "russian": "ru",
-        "polish": "pl",
-        "czech": "cs",
-        "slovak": "sk",
-        "bulgarian": "bg",
-        "serbian": "sr",
-        "croatian": "hr",
-        "slovenian": "sl",
-        "latvian": "lv",
-        "lithuanian": "lt",
-        "greek": "el",
-        "finnish": "fi",
-        "hungarian": "hu",
-        "estonian": "et",
-    }
-    return language_map.get(language_display.lower(), "en")
-
-
-def get_relationship_code(contact_relationship):
-    """Returns the relationship code for a given relationship display name"""
-    relationship_map = {
-        "Billing contact person": "BP",
-        "Contact person": "CP",
-        "Emergency contact person": "EP",
-        "Person preparing referral": "PR",
-        "Employer": "E",
-        "Emergency Contact": "C",
-        "Federal Agency": "F",
-        "Insurance Company": "I",
-        "Next-of-Kin": "N",
-        "State Agency": "S",
-        "Unknown": "U",
-    }
-    return relationship_map.get(contact_relationship, "U")
-
-
 # Delete patient record
 @app.route("/hl7/patient_summary/fhir/patient/delete", methods=["GET", "POST"])
 def delete_fhir_patient():
     """Delete a patient record from the HAPI FHIR server."""
 
-    client = SyncFHIRClient(os.getenv("FHIR_SERVER_URL"))
+    client = get_fhir_client(FHIR_SERVER_URL)
     patient_id = request.args.get("patient_id")
 
     if request.method == "POST":
         try:
             # Delete patient record from the HAPI FHIR server
-            patient = client.resources("Patient").get(id=patient_id)
-            patient.delete()
+            client.reference("Patient", patient_id).delete()
+            patient_cache.invalidate(patient_id)
             flash("Patient record deleted successfully.", "alert-success")
             return redirect(url_for("fhir_patient_list"))
         except (ConnectionError, TimeoutError, ValueError) as e:
@@ -932,13 +735,212 @@ def delete_fhir_patient():
             return redirect(url_for("fhir_patient_list"))
 
     try:
-        patient = client.resources("Patient").get(id=patient_id)
+        patient = patient_cache.get_patient(client, patient_id)
         return render_template("delete_fhir_patient.html", patient=patient)
-    except (ConnectionError, TimeoutError, ValueError) as e:
+    except (ConnectionError, TimeoutError, ValueError, ResourceNotFound) as e:
         flash("Error fetching patient record: " + str(e), "alert-danger")
         return redirect(url_for("fhir_patient_list"))
 
 
+@app.route("/hl7/patient_summary/fhir/pool/stats", methods=["GET"])
+def fhir_pool_stats():
+    """Report connection pool statistics for this worker process"""
+
+    stats = pool_stats()
+    stats["async_clients"] = async_pool_stats()
+    stats["patient_cache"] = patient_cache.stats()
+    stats["page_prefetch"] = page_prefetcher.stats()
+    stats["cda_cache"] = cda_cache.stats()
+    stats["cda_section_cache"] = section_cache.stats()
+    stats["summary_fragment_cache"] = summary_fragment_cache.stats()
+    return jsonify(stats)
+
+
+# Async variants of the read-only views. They share templates and helpers
+# with the views above but await the FHIR server instead of blocking on it.
+@app.route("/hl7/patient_summary/fhir/async/select", methods=["GET", "POST"])
+async def fhir_patient_list_async():
+    """Get a list of patients from the HAPI FHIR server without blocking"""
+
+    client = get_async_fhir_client(FHIR_SERVER_URL)
+    cursor = request.args.get("page")
+    try:
+        if cursor:
+            bundle = await client.get_bundle(
+                check_page_cursor(cursor, FHIR_SERVER_URL)
+            )
+        else:
+            bundle = await client.get_bundle("Patient", patient_page_params())
+        patient_list, next_page, previous_page = parse_patient_page(bundle)
+        return render_template(
+            "fhir_patient_list.html",
+            patients=patient_list,
+            next_page=next_page,
+            previous_page=previous_page,
+        )
+    except ResourceNotFound as e:
+        if cursor:
+            return expired_page("fhir_patient_list_async")
+        flash("Error fetching patient list: " + str(e), "alert-danger")
+        return render_template("fhir_patient_list.html")
+    except (
+        ConnectionError,
+        TimeoutError,
+        ValueError,
+        ClientError,
+        OperationOutcome,
+    ) as e:
+        flash("Error fetching patient list: " + str(e), "alert-danger")
+        return render_template("fhir_patient_list.html")
+
+
+@app.route("/hl7/patient_summary/fhir/async/patient/search", methods=["GET", "POST"])
+async def fhir_patient_search_async():
+    """Search for a resource in the HAPI FHIR server without blocking"""
+    if request.method == "POST":
+        form_data = request.form
+        resource_type = form_data.get("resource_type")
+        search_params = get_search_params(resource_type, form_data)
+        if search_params is None:
+            flash(f"Unsupported resource type: {resource_type}", "alert-danger")
+            return redirect(url_for("fhir_patient_search_async"))
+
+        client = get_async_fhir_client(FHIR_SERVER_URL)
+        try:
+            if form_data.get("paged") == "True":
+                bundle = await client.get_bundle(
+                    resource_type, search_page_params(search_params)
+                )
+                return render_search_page(None, bundle)
+
+            resources = (
+                await client.resources(resource_type)
+                .search(**search_params)
+                .limit(1)
+                .fetch()
+            )
+            bundle_json = [resource.serialize() for resource in resources]
+            return render_template("fhir_patient_bundles.html", bundle_json=bundle_json)
+        except (
+            ConnectionError,
+            TimeoutError,
+            ValueError,
+            ClientError,
+            ResourceNotFound,
+            OperationOutcome,
+        ) as e:
+            flash("Error fetching patient list: " + str(e), "alert-danger")
+            return redirect(url_for("fhir_patient_list"))
+
+    cursor = request.args.get("page")
+    if cursor:
+        client = get_async_fhir_client(FHIR_SERVER_URL)
+        try:
+            bundle = await client.get_bundle(check_page_cursor(cursor, FHIR_SERVER_URL))
+            return render_search_page(None, bundle)
+        except ResourceNotFound:
+            return expired_page("fhir_patient_search_async")
+        except (
+            ConnectionError,
+            TimeoutError,
+            ValueError,
+            ClientError,
+            OperationOutcome,
+        ) as e:
+            flash("Error fetching search results: " + str(e), "alert-danger")
+            return redirect(url_for("fhir_patient_search_async"))
+
+    return render_template("fhir_patient_search.html")
+
+
+@app.route("/hl7/patient_summary/fhir/async/<patient_id>", methods=["GET"])
+async def fhir_patient_summary_async(patient_id):
+    """Display a detailed patient summary without blocking on the FHIR server
+
+    The caches may be SQLite files shared between workers, so every call
+    into them runs in a thread instead of on the shared event loop.
+    """
+
+    patient_json = await asyncio.to_thread(patient_cache.lookup, patient_id)
+    if patient_json is None:
+        client = get_async_fhir_client(FHIR_SERVER_URL)
+        try:
+            patient = await client.resources("Patient").search(_id=patient_id).get()
+            patient_json = patient.serialize()
+            await asyncio.to_thread(patient_cache.store, patient_json)
+        except (
+            ConnectionError,
+            TimeoutError,
+            ValueError,
+            ClientError,
+            ResourceNotFound,
+        ) as e:
+            flash("The patient ID was not found: " + str(e), "alert-danger")
+            return redirect(url_for("fhir_patient_list"))
+
+    return await asyncio.to_thread(render_summary_page, patient_id, patient_json)
+
+
+@app.route("/hl7/patient_summary/fhir/<patient_id>/clinical", methods=["GET"])
+async def fhir_patient_clinical_summary(patient_id):
+    """Load the patient with allergies, medications, conditions and procedures"""
+
+    client = get_async_fhir_client(FHIR_SERVER_URL)
+    bundle = await load_patient_summary(client, patient_id)
+    if not bundle["entry"]:
+        flash("The patient ID was not found: " + patient_id, "alert-danger")
+        return redirect(url_for("fhir_patient_list"))
+    if "incomplete" in bundle:
+        flash(
+            "Some resources could not be loaded: " + ", ".join(bundle["incomplete"]),
+            "alert-warning",
+        )
+
+    return render_template("fhir_template.html", patient_json=fhir_json.dumps(bundle))
+
+
+@app.route("/hl7/patient_summary/fhir/<patient_id>/cda", methods=["GET"])
+async def fhir_patient_cda(patient_id):
+    """Stream the patient's clinical summary as a CDA document"""
+
+    client = get_async_fhir_client(FHIR_SERVER_URL)
+    bundle = await load_patient_summary(client, patient_id)
+    if not any(
+        entry["resource"]["resourceType"] == "Patient" for entry in bundle["entry"]
+    ):
+        flash("The patient ID was not found: " + patient_id, "alert-danger")
+        return redirect(url_for("fhir_patient_list"))
+
+    # An unchanged patient is served from the document cache; a new document
+    # is sent section by section while it is still being written
+    return Response(iter_cached_cda(bundle), mimetype="application/xml")
+
+
+@app.route("/hl7/patient_summary/fhir/<patient_id>/cda/view", methods=["GET"])
+async def fhir_patient_cda_view(patient_id):
+    """Show the narrative tables of the patient's CDA document"""
+
+    client = get_async_fhir_client(FHIR_SERVER_URL)
+    bundle = await load_patient_summary(client, patient_id)
+    if not any(
+        entry["resource"]["resourceType"] == "Patient" for entry in bundle["entry"]
+    ):
+        flash("The patient ID was not found: " + patient_id, "alert-danger")
+        return redirect(url_for("fhir_patient_list"))
+
+    # Converting a large bundle takes tens of milliseconds of CPU, which must
+    # not stall the other requests waiting on the shared event loop
+    sections = await asyncio.to_thread(cda_narrative_sections, bundle)
+    return render_template(
+        "cda_template.html", sections=sections, patient_id=patient_id
+    )
+
+
+def cda_narrative_sections(bundle):
+    """Returns the narrative tables of the bundle's (cached) CDA document"""
+    return narrative_html(etree.fromstring(get_cda_document(bundle)))
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Page not found error handler"""
@@ -955,18 +957,56 @@ def internal_server_error(e):
     return render_template("500.html"), 500
 
 
+def warm_templates():
+    """Compile and render every template once, returning seconds per template
+
+    Templates are rendered with the sample patient so the first request to
+    a worker does not pay for compiling them. A template that fails to
+    render is logged and skipped; it is still compiled.
+    """
+    with open(os.path.join(app.root_path, "sample.json"), "rb") as file:
+        sample_patient = fhir_json.loads(file.read())["entry"][0]["resource"]
+    contexts = {
+        "edit_fhir_patient.html": {"patient": sample_patient},
+        "delete_fhir_patient.html": {"patient": sample_patient},
+        "fhir_patient_summary_fragment.html": {
+            "patient": project_patient(sample_patient["id"], sample_patient),
+            "patient_json": build_patient_info(sample_patient),
+        },
+        "fhir_patient_bundles.html": {"bundle_json": [sample_patient]},
+    }
+
+    timings = {}
+    with app.test_request_context():
+        for name in app.jinja_env.list_templates():
+            started = time.perf_counter()
+            try:
+                render_template(name, **contexts.get(name, {}))
+            except Exception as e:  # warm-up must never stop the worker
+                app.logger.warning("Template warm-up failed for %s: %s", name, e)
+            timings[name] = time.perf_counter() - started
+    return timings
+
+
+@app.cli.command("warm-templates")
+def warm_templates_command():
+    """Fill the Jinja bytecode cache, e.g. while building a release"""
+    timings = warm_templates()
+    for name, elapsed in sorted(timings.items()):
+        print(f"{name:32} {elapsed * 1e3:8.2f} ms")
+    print(f"Warmed {len(timings)} templates in {sum(timings.values()) * 1e3:.0f} ms")
+
+
 if DEVELOPMENT:
     FHIR_SERVER_URL = os.getenv("FHIR_SERVER_URL")
 else:
     FHIR_SERVER_URL = "https://hapi.fhir.org/baseR4"
 
 
-def filter_search_params(search_detail):
-    """Filter search parameters to remove empty values"""
-    return {k: v for k, v in search_detail.items() if v}
-
-
 if __name__ == "__main__":
+    # gunicorn workers are warmed by post_worker_init in gunicorn.conf.py
+    if TEMPLATE_WARMUP:
+        warm_templates()
     if DEVELOPMENT:
         app.run(
             host=os.getenv("IP"),
@@ -0,0 +1,137 @@
+"""Convert many FHIR Bundles to CDA documents in parallel.
+
+Bundles are read from .json files (one Bundle each), .ndjson files (one
+Bundle per line) or directories of either, and each one is written to its
+own CDA file. Bundles that were converted before are served from the CDA
+document cache; set CDA_CACHE_DIR to share it between the worker processes
+and across runs. Run from the repository root:
+
+    python batch_cda.py exports/ more.ndjson --out cda_output --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import fhir_json
+from cda_cache import iter_cached_cda
+from fhir_validation import get_validation_level, validate_bundle
+
+# files can come from anywhere, so check the fields the conversion reads
+BATCH_CDA_VALIDATION = get_validation_level("BATCH_CDA_VALIDATION", "schema")
+
+
+def available_cpus():
+    """Cores this process may run on, which can be fewer than os.cpu_count()"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def iter_bundle_sources(paths):
+    """Yields (name, raw Bundle bytes) for every Bundle under the given paths"""
+    for path in map(Path, paths):
+        if path.is_dir():
+            files = sorted(
+                child
+                for child in path.iterdir()
+                if child.suffix in (".json", ".ndjson")
+            )
+        else:
+            files = [path]
+        for file in files:
+            if file.suffix == ".ndjson":
+                with open(file, "rb") as lines:
+                    for line_number, line in enumerate(lines, 1):
+                        if line.strip():
+                            yield f"{file.stem}-{line_number}", line
+            else:
+                yield file.stem, file.read_bytes()
+
+
+def convert_bundle(name, raw_bundle, out_dir):
+    """Converts one Bundle in a worker process
+
+    Returns (name, input bytes, output bytes, error). Errors are returned as
+    text rather than raised so one bad Bundle does not stop the run.
+    """
+    in_bytes = len(raw_bundle)
+    output = Path(out_dir) / f"{name}.xml"
+    try:
+        fhir_bundle = fhir_json.loads(raw_bundle)
+        validate_bundle(fhir_bundle, BATCH_CDA_VALIDATION)
+        with open(output, "wb") as file:
+            for chunk in iter_cached_cda(fhir_bundle):
+                file.write(chunk)
+    except Exception as e:
+        output.unlink(missing_ok=True)
+        return name, in_bytes, 0, f"{type(e).__name__}: {e}"
+    return name, in_bytes, output.stat().st_size, None
+
+
+def convert_bundles(sources, out_dir, workers=None, max_in_flight=None):
+    """Spreads the conversions over a process pool and returns the results
+
+    At most max_in_flight Bundles are read ahead of the workers, so memory
+    stays bounded however large the input is.
+    """
+    workers = workers or available_cpus()
+    max_in_flight = max_in_flight or workers * 2
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    results = []
+    with ProcessPoolExecutor(workers) as executor:
+        in_flight = set()
+        for name, raw_bundle in sources:
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+            in_flight.add(executor.submit(convert_bundle, name, raw_bundle, out_dir))
+        results.extend(future.result() for future in in_flight)
+    return results
+
+
+def print_report(results, elapsed):
+    """Prints failures and throughput for a finished run"""
+    failures = [result for result in results if result[3] is not None]
+    for name, _, _, error in failures:
+        print(f"FAILED {name}: {error}", file=sys.stderr)
+
+    converted = len(results) - len(failures)
+    megabytes = sum(result[1] for result in results) / 1_000_000
+    elapsed = max(elapsed, 1e-9)
+    print(
+        f"Converted {converted} of {len(results)} bundles in {elapsed:.2f}s "
+        f"({len(results) / elapsed:.1f} bundles/sec, {megabytes / elapsed:.2f} MB/sec)"
+    )
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help=".json/.ndjson files or directories")
+    parser.add_argument("--out", default="cda_output", help="directory for the CDA files")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="processes (default: available cores)"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=None,
+        help="Bundles read ahead of the workers (default: twice the workers)",
+    )
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    results = convert_bundles(
+        iter_bundle_sources(args.inputs), args.out, args.workers, args.max_in_flight
+    )
+    failures = print_report(results, time.perf_counter() - started)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
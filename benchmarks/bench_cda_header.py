@@ -0,0 +1,48 @@
+"""Microbenchmark: CDA header rebuilt from CDAData vs cloned from a template.
+
+Run from the repository root:
+
+    python benchmarks/bench_cda_header.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from convert_fhir_to_cda import (  # noqa: E402
+    CDA_NAMESPACE,
+    CDA_XSI,
+    add_header_elements,
+    create_root_element,
+)
+
+
+def legacy_create_root_element():
+    """The header as it was built before, element by element per document"""
+    root = etree.Element('ClinicalDocument', xmlns=CDA_NAMESPACE, xsi=CDA_XSI)
+    add_header_elements(root)
+    return root
+
+
+def main(number=20000):
+    """Checks both paths agree, then times them"""
+    effective_time = "20240101120000"
+    expected = etree.Element('ClinicalDocument', xmlns=CDA_NAMESPACE, xsi=CDA_XSI)
+    add_header_elements(expected, effective_time)
+    assert etree.tostring(create_root_element(effective_time)) == etree.tostring(
+        expected
+    )
+
+    legacy = timeit.timeit(legacy_create_root_element, number=number)
+    cloned = timeit.timeit(create_root_element, number=number)
+    print(f"rebuilt header : {legacy / number * 1e6:8.2f} us per document")
+    print(f"cloned header  : {cloned / number * 1e6:8.2f} us per document")
+    print(f"speedup        : {legacy / cloned:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
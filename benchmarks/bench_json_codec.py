@@ -0,0 +1,45 @@
+"""Microbenchmark: stdlib json vs the fhir_json codec on a FHIR Bundle.
+
+Decoding starts from response bytes, as the FHIR clients receive them.
+Install orjson to see the fast backend; without it both paths use the
+standard library. Run from the repository root:
+
+    python benchmarks/bench_json_codec.py
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fhir_json  # noqa: E402
+from synthetic_bundles import generate_bundle  # noqa: E402
+
+
+def main(number=50):
+    """Checks both paths round trip the same Bundle, then times them"""
+    bundle = generate_bundle(random.Random(0), conditions=200, observations=300)
+    payload = json.dumps(bundle).encode("utf-8")
+    assert fhir_json.loads(payload) == json.loads(payload.decode("utf-8")) == bundle
+    assert json.loads(fhir_json.dumps_bytes(bundle)) == bundle
+
+    timings = {
+        "decode stdlib": lambda: json.loads(payload.decode("utf-8")),
+        "decode codec ": lambda: fhir_json.loads(payload),
+        "encode stdlib": lambda: json.dumps(bundle).encode("utf-8"),
+        "encode codec ": lambda: fhir_json.dumps_bytes(bundle),
+    }
+    results = {name: timeit.timeit(call, number=number) for name, call in timings.items()}
+    print(f"backend        : {fhir_json.BACKEND}, {len(payload) / 1000:.0f} kB bundle")
+    for name, elapsed in results.items():
+        print(f"{name}  : {elapsed / number * 1e3:8.2f} ms per bundle")
+    for step in ("decode", "encode"):
+        speedup = results[f"{step} stdlib"] / results[f"{step} codec "]
+        print(f"{step} speedup : {speedup:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
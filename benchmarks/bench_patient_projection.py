@@ -0,0 +1,336 @@
+"""Microbenchmark: single pass patient projection vs the extract_* helpers.
+
+Run from the repository root:
+
+    python benchmarks/bench_patient_projection.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from patient_projection import project_patient  # noqa: E402
+
+SAMPLE_PATIENT = {
+    "resourceType": "Patient",
+    "id": "bench-1",
+    "meta": {
+        "versionId": "3",
+        "lastUpdated": "2024-10-30T18:07:28.000+00:00",
+        "source": "#bench",
+        "profile": [
+            "http://hl7.org/fhir/us/core/StructureDefinition/us-core-patient"
+        ],
+    },
+    "text": {"status": "generated", "div": "<div>Jane Doe</div>"},
+    "identifier": [
+        {"system": "urn:oid:2.16.840.1.113883.2.4.6.3", "value": "738472983"},
+        {"system": "http://hospital.example/mrn", "value": "MRN-1234"},
+    ],
+    "active": True,
+    "name": [{"use": "official", "family": "Doe", "given": ["Jane", "Q"]}],
+    "telecom": [
+        {"system": "phone", "value": "555-555-5555", "use": "home"},
+        {"system": "email", "value": "jane@example.org", "use": "work"},
+    ],
+    "gender": "female",
+    "birthDate": "1980-05-12",
+    "address": [
+        {
+            "use": "home",
+            "line": ["123 Main St"],
+            "city": "Springfield",
+            "state": "IL",
+            "postalCode": "62701",
+        }
+    ],
+    "maritalStatus": {"coding": [{"code": "M", "display": "Married"}]},
+    "multipleBirthBoolean": False,
+    "communication": [
+        {"language": {"coding": [{"code": "en", "display": "English"}]}, "preferred": True},
+        {"language": {"coding": [{"code": "fr", "display": "French"}]}},
+    ],
+    "contact": [
+        {
+            "relationship": [{"coding": [{"code": "N", "display": "Next-of-Kin"}]}],
+            "name": {
+                "family": "Doe",
+                "_family": {
+                    "extension": [
+                        {
+                            "url": "http://hl7.org/fhir/StructureDefinition/humanname-own-prefix",
+                            "valueString": "Mr",
+                        }
+                    ]
+                },
+                "given": ["John"],
+            },
+            "telecom": [
+                {"system": "phone", "value": "555-555-0000", "use": "mobile"},
+                {"system": "email", "value": "john@example.org", "use": "home"},
+            ],
+            "address": {
+                "use": "home",
+                "line": ["123 Main St"],
+                "city": "Springfield",
+                "state": "IL",
+                "postalCode": "62701",
+            },
+        }
+    ],
+    "generalPractitioner": [{"reference": "Practitioner/gp-1"}],
+    "managingOrganization": {"reference": "Organization/org-1"},
+}
+
+
+def extract_patient_name(patient_json):
+    """Extracts a readable name from patient data"""
+    names = patient_json.get("name", [])
+    if names:
+        first_name = names[0].get("given", [""])[0]
+        last_name = names[0].get("family", "")
+        official_name = names[0].get("use", "")
+        if official_name:
+            return f"{first_name} {last_name} ({official_name})".strip()
+        return f"{first_name} {last_name}".strip()
+
+
+def extract_patient_identifier(patient_json):
+    """Extracts identifier information based on type"""
+    identifiers = patient_json.get("identifier", [])
+    identifier_list = []
+    for identifier in identifiers:
+        identifier_system = identifier.get("system", "")
+        identifier_value = identifier.get("value", "")
+        identifier_list.append(f"{identifier_system} - {identifier_value}")
+    return ", ".join(identifier_list) if identifier_list else "N/A"
+
+
+def extract_patient_address(patient_json):
+    """Extracts the first line of address information if available"""
+    addresses = patient_json.get("address", [])
+    if addresses:
+        line = addresses[0].get("line", [""])[0]
+        city = addresses[0].get("city", "")
+        state = addresses[0].get("state", "")
+        postal = addresses[0].get("postalCode", "")
+        address_use = addresses[0].get("use", "")
+        if address_use:
+            return f"{line}, {city}, {state} {postal} ({address_use})".strip(", ")
+        return f"{line}, {city}, {state} {postal}".strip(", ")
+    return "N/A"
+
+
+def extract_patient_telecom(patient_json, telecom_type):
+    """Extracts telecom information based on type"""
+    telecoms = patient_json.get("telecom", [])
+    if telecoms:
+        phone_type = telecoms[0].get("use", "")
+        email_type = telecoms[1].get("use", "") if len(telecoms) > 1 else "N/A"
+        if telecom_type == "phone":
+            return telecoms[0].get("value", "N/A") + f" ({phone_type})"
+        if telecom_type == "email" and len(telecoms) > 1:
+            return telecoms[1].get("value", "N/A") + f" ({email_type})"
+    return "N/A"
+
+
+def extract_patient_marital_status(patient_json, marital_status_type):
+    """Extracts marital status information based on type"""
+    marital_status = patient_json.get("maritalStatus", {})
+    if marital_status_type == "maritalStatus":
+        return marital_status.get("coding", [{}])[0].get("display", "N/A")
+    return "N/A"
+
+
+def extract_patient_contact(patient_json, contact_type):
+    """Extracts contact information based on type"""
+    contact = patient_json.get("contact", [])
+    if contact:
+        contact_name = contact[0].get("name", {})
+        family_name = contact_name.get("family", "")
+        given_name = contact_name.get("given", [""])[0]
+        prefix_extension = contact_name.get("_family", {}).get("extension", [])
+        value_string = next(
+            (
+                ext.get("valueString", "")
+                for ext in prefix_extension
+                if ext.get("url")
+                == "http://hl7.org/fhir/StructureDefinition/humanname-own-prefix"
+            ),
+            "",
+        )
+        return f"{value_string} {given_name} {family_name}".strip()
+    return "N/A"
+
+
+def extract_patient_contact_relationship(patient_json, contact_relationship_type):
+    """Extracts contact relationship information based on type"""
+    contact = patient_json.get("contact", [])
+    if contact:
+        contact_relationship = (
+            contact[0]
+            .get("relationship", [{}])[0]
+            .get("coding", [{}])[0]
+            .get("display", "N/A")
+        )
+        return contact_relationship
+    return "N/A"
+
+
+def extract_patient_contact_address(patient_json, contact_address_type):
+    """Extracts contact address information based on type"""
+    contact = patient_json.get("contact", [])
+    if contact:
+        contact_address = contact[0].get("address", {})
+        contact_address_use = contact_address.get("use", "")
+        contact_address_line = contact_address.get("line", [""])[0]
+        contact_city = contact_address.get("city", "")
+        contact_state = contact_address.get("state", "")
+        contact_postal_code = contact_address.get("postalCode", "")
+        return f"{contact_address_line}, {contact_city}, {contact_state} {contact_postal_code} ({contact_address_use})".strip(
+            ", "
+        )
+    return "N/A"
+
+
+def extract_patient_contact_phone(patient_json, contact_phone_type):
+    """Extracts contact phone information based on type"""
+    contact = patient_json.get("contact", [])
+    if contact:
+        contact_phone = contact[0].get("telecom", [])
+        contact_phone_use = contact_phone[0].get("use", "")
+        contact_phone_value = contact_phone[0].get("value", "")
+        return f"{contact_phone_value} ({contact_phone_use})"
+    return "N/A"
+
+
+def extract_patient_contact_email(patient_json, contact_email_type):
+    """Extracts contact email information based on type"""
+    contact = patient_json.get("contact", [])
+    if contact:
+        contact_email = contact[0].get("telecom", [])
+        contact_email_use = contact_email[1].get("use", "")
+        contact_email_value = contact_email[1].get("value", "")
+        return f"{contact_email_value} ({contact_email_use})"
+    return "N/A"
+
+
+def extract_general_practitioner(patient_json, general_practitioner_type):
+    """Extracts general practitioner information based on type"""
+    general_practitioner = patient_json.get("generalPractitioner", {})
+    if general_practitioner_type == "generalPractitioner":
+        return (
+            general_practitioner[0].get("reference", "N/A")
+            if general_practitioner
+            else "N/A"
+        )
+    return "N/A"
+
+
+def extract_managing_organization(patient_json, managing_organization_type):
+    """Extracts managing organization information based on type"""
+    managing_organization = patient_json.get("managingOrganization", {})
+    if managing_organization_type == "managingOrganization":
+        return (
+            managing_organization.get("reference", "N/A")
+            if managing_organization
+            else "N/A"
+        )
+    return "N/A"
+
+
+def extract_patient_languages(patient_json, language_type):
+    """Extracts language information based on type"""
+    languages = patient_json.get("communication", [])
+    language_list = []
+    for language in languages:
+        language_code = (
+            language.get("language", {}).get("coding", [{}])[0].get("display", "N/A")
+        )
+        preferred = language.get("preferred", False)
+        preferred_text = " (preferred)" if preferred else ""
+        language_list.append(f"{language_code}{preferred_text}")
+    return ", ".join(language_list) if language_list else "N/A"
+
+
+def extract_patient_text(patient_json, text_type):
+    """Extracts text information based on type"""
+    text = patient_json.get("text", {})
+    if text_type == "text":
+        return text.get("div", "N/A")
+    return "N/A"
+
+
+
+
+def legacy_build_patient_data(patient_id, patient_json):
+    """The per-field extract_* chain used before patient_projection"""
+    profile_urls = patient_json.get("meta", {}).get("profile", [])
+    profile_links = " ".join(
+        [f'<a href="{url}" target="_blank">{url}</a>' for url in profile_urls]
+    )
+
+    return {
+        "id": patient_id,
+        "name": extract_patient_name(patient_json),
+        "identifier": extract_patient_identifier(patient_json),
+        "birth_date": patient_json.get("birthDate", "N/A"),
+        "gender": patient_json.get("gender", "N/A"),
+        "address": extract_patient_address(patient_json),
+        "phone": extract_patient_telecom(patient_json, "phone"),
+        "email": extract_patient_telecom(patient_json, "email"),
+        "source": patient_json.get("meta", {}).get("source", "N/A"),
+        "versionId": patient_json.get("meta", {}).get("versionId", "N/A"),
+        "last_updated": patient_json.get("meta", {}).get("lastUpdated", "N/A"),
+        "profile": profile_links,
+        "active": patient_json.get("active", "N/A"),
+        "marital_status": extract_patient_marital_status(patient_json, "maritalStatus"),
+        "deceased": patient_json.get("deceasedDateTime", "N/A"),
+        "deceased_age": patient_json.get("deceasedAge", "N/A"),
+        "multiple_birth": patient_json.get("multipleBirthBoolean", "N/A"),
+        "multiple_birth_integer": patient_json.get("multipleBirthInteger", "N/A"),
+        "communication": extract_patient_languages(patient_json, "language"),
+        "contact": extract_patient_contact(patient_json, "contact"),
+        "contact_relationship": extract_patient_contact_relationship(
+            patient_json, "relationship"
+        ),
+        "contact_address": extract_patient_contact_address(
+            patient_json, "contact_address"
+        ),
+        "contact_phone": extract_patient_contact_phone(patient_json, "contact_phone"),
+        "contact_email": extract_patient_contact_email(patient_json, "contact_email"),
+        "general_practitioner": extract_general_practitioner(
+            patient_json, "generalPractitioner"
+        ),
+        "managing_organization": extract_managing_organization(
+            patient_json,
+            "managingOrganization",
+        ),
+        "link": patient_json.get("link", "N/A"),
+        "photo": patient_json.get("photo", "N/A"),
+        "text": extract_patient_text(patient_json, "text"),
+    }
+
+
+def main(number=20000):
+    """Checks both paths agree, then times them"""
+    sparse_patient = {"resourceType": "Patient", "id": "bench-2"}
+    for patient in (SAMPLE_PATIENT, sparse_patient):
+        expected = legacy_build_patient_data(patient["id"], patient)
+        assert project_patient(patient["id"], patient) == expected
+
+    legacy = timeit.timeit(
+        lambda: legacy_build_patient_data("bench-1", SAMPLE_PATIENT), number=number
+    )
+    projected = timeit.timeit(
+        lambda: project_patient("bench-1", SAMPLE_PATIENT), number=number
+    )
+    print(f"extract_* helpers : {legacy / number * 1e6:8.2f} us per patient")
+    print(f"project_patient   : {projected / number * 1e6:8.2f} us per patient")
+    print(f"speedup           : {legacy / projected:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Microbenchmark: CDA document built cold vs with one section changed.
+
+The bundle has 300 resources in each of four sections. The warm case adds
+one Condition before every document, so only the problems section is
+rebuilt and the others are copied from the section cache. Run from the
+repository root:
+
+    python benchmarks/bench_section_cache.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cda_sections  # noqa: E402
+from convert_fhir_to_cda import fhir_to_cda  # noqa: E402
+from synthetic_bundles import generate_bundle, make_condition  # noqa: E402
+
+COUNTS = {
+    "allergies": 300,
+    "medications": 300,
+    "conditions": 300,
+    "procedures": 300,
+    "observations": 0,
+}
+
+
+def main(number=5, repeat=3):
+    """Checks every section is present, then times both paths"""
+    rng = random.Random(0)
+    bundle = generate_bundle(rng, **COUNTS)
+    subject = f"Patient/{bundle['id']}"
+
+    def cold():
+        cda_sections.section_cache = cda_sections.SectionCache()
+        return fhir_to_cda(bundle)
+
+    def one_section_changed():
+        condition = make_condition(rng, f"new-{rng.getrandbits(32)}", subject)
+        return fhir_to_cda({**bundle, "entry": bundle["entry"] + [{"resource": condition}]})
+
+    sections = cold().getroot().findall("component/structuredBody/component/section")
+    assert len(sections) == len(cda_sections.get_sections())
+    one_section_changed()
+
+    rebuilt = min(timeit.repeat(cold, number=number, repeat=repeat)) / number
+    cached = min(timeit.repeat(one_section_changed, number=number, repeat=repeat)) / number
+    print(f"sections       : {len(sections)}, 1,200 resources")
+    print(f"cold build     : {rebuilt * 1e3:8.2f} ms per document")
+    print(f"one changed    : {cached * 1e3:8.2f} ms per document")
+    print(f"speedup        : {rebuilt / cached:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Microbenchmark: sample bundle via fhir.resources models vs plain dicts.
+
+Run from the repository root:
+
+    python benchmarks/bench_synthetic_bundles.py
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_patient_record import create_sample_patient_record  # noqa: E402
+from synthetic_bundles import generate_bundle  # noqa: E402
+
+
+def main(number=2000):
+    """Checks both paths give the same shape of bundle, then times them"""
+    rng = random.Random(0)
+    modeled = json.loads(create_sample_patient_record())
+    synthetic = generate_bundle(rng, observations=0, validate=True)
+    assert [entry["resource"]["resourceType"] for entry in modeled["entry"]] == [
+        entry["resource"]["resourceType"] for entry in synthetic["entry"]
+    ]
+
+    models = timeit.timeit(
+        lambda: json.loads(create_sample_patient_record()), number=number
+    )
+    dicts = timeit.timeit(lambda: generate_bundle(rng, observations=0), number=number)
+    resources = len(synthetic["entry"])
+    print(f"pydantic models: {models / number * 1e6:8.2f} us per bundle")
+    print(f"plain dicts    : {dicts / number * 1e6:8.2f} us per bundle")
+    print(f"plain dicts    : {number * resources / dicts * 60 / 1e6:8.2f} M resources/min")
+    print(f"speedup        : {models / dicts:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
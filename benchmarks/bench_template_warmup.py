@@ -0,0 +1,71 @@
+"""Benchmark: first request to a fresh worker, cold vs bytecode cache vs warmed.
+
+Each case imports the app in a new process, as a newly started or recycled
+gunicorn worker would, then times the first and second GET of the new
+patient form (new_fhir_patient.html, 612 lines). Run from the repository
+root:
+
+    python benchmarks/bench_template_warmup.py
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import time
+import app
+if app.TEMPLATE_WARMUP:
+    app.warm_templates()  # as gunicorn's post_worker_init hook does
+client = app.app.test_client()
+timings = []
+for _ in range(2):
+    started = time.perf_counter()
+    response = client.get("/hl7/patient_summary/fhir/patient/new")
+    assert response.status_code == 200, response.status_code
+    timings.append(time.perf_counter() - started)
+print(*timings)
+"""
+
+
+def first_requests(cache_dir, warmup, runs=5):
+    """Returns the best (first, second) request seconds over several workers"""
+    env = {
+        **os.environ,
+        "JINJA_CACHE_DIR": cache_dir,
+        "TEMPLATE_WARMUP": "True" if warmup else "False",
+    }
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", WORKER],
+            cwd=ROOT,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(tuple(map(float, output.split()[-2:])))
+    return min(results)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cases = {"cold (no cache, no warm-up)": first_requests("", warmup=False)}
+        # the first worker fills the cache, the timed ones load from it
+        first_requests(cache_dir, warmup=False, runs=1)
+        cases["bytecode cache"] = first_requests(cache_dir, warmup=False)
+        cases["warmed at startup"] = first_requests(cache_dir, warmup=True)
+    cold = cases["cold (no cache, no warm-up)"][0]
+    for name, (first, second) in cases.items():
+        print(
+            f"{name:28}: first {first * 1e3:7.2f} ms, second {second * 1e3:6.2f} ms, "
+            f"first-request speedup {cold / first:6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Microbenchmark: full model vs schema check vs no validation of a bundle.
+
+Run from the repository root:
+
+    python benchmarks/bench_validation_tiers.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fhir_validation import validate_bundle  # noqa: E402
+from synthetic_bundles import generate_bundle  # noqa: E402
+
+
+def main(number=200):
+    """Checks every tier accepts the same bundle, then times them"""
+    bundle = generate_bundle(
+        random.Random(0),
+        allergies=5,
+        medications=5,
+        conditions=10,
+        procedures=5,
+        observations=25,
+    )
+    for level in ("full", "schema", "none"):
+        validate_bundle(bundle, level)
+
+    resources = len(bundle["entry"])
+    timings = {
+        level: timeit.timeit(lambda: validate_bundle(bundle, level), number=number)
+        for level in ("full", "schema", "none")
+    }
+    for level, elapsed in timings.items():
+        print(
+            f"{level:6} : {elapsed / number * 1e6:10.2f} us per bundle "
+            f"({elapsed / number / resources * 1e6:8.2f} us per resource)"
+        )
+    print(f"schema speedup over full: {timings['full'] / timings['schema']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Client for the FHIR Bulk Data $export operation.
+
+The export is kicked off asynchronously, its status URL is polled at the
+pace the server asks for with Retry-After, and the NDJSON output files are
+downloaded in parallel, streamed to disk in blocks. Progress lives in the
+output directory: the status URL and the manifest are saved there, and a
+file interrupted mid-download continues from its last byte with a Range
+request. Running the same command again therefore resumes the export.
+
+    python bulk_export.py --server https://hapi.fhir.org/baseR4 \\
+        --type Patient,Condition --out export
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+
+import fhir_json
+from fhir_pool import CONNECT_TIMEOUT, READ_TIMEOUT, env_float, env_int, get_fhir_client
+
+BULK_EXPORT_DOWNLOADS = env_int("BULK_EXPORT_DOWNLOADS", 4)  # files at once
+BULK_EXPORT_POLL_INTERVAL = env_float("BULK_EXPORT_POLL_INTERVAL", 5.0)  # seconds
+BULK_EXPORT_TIMEOUT = env_float("BULK_EXPORT_TIMEOUT", 3600.0)  # seconds
+BULK_EXPORT_RETRIES = env_int("BULK_EXPORT_RETRIES", 5)  # per file
+BLOCK_SIZE = 64 * 1024
+
+STATUS_FILE = "status.json"
+MANIFEST_FILE = "manifest.json"
+# output types become file names, so only plain resource type names pass
+RESOURCE_TYPE = re.compile(r"[A-Za-z]+")
+
+
+class BulkExportError(Exception):
+    """The server refused or failed the export"""
+
+
+def kick_off(session, base_url, resource_types=None, since=None, level="system"):
+    """Starts an export and returns its absolute status URL
+
+    level is "system" for [base]/$export, "patient" for
+    [base]/Patient/$export, or "group/<id>" for [base]/Group/<id>/$export.
+    """
+    path = {"system": "$export", "patient": "Patient/$export"}.get(level)
+    if path is None and level.startswith("group/"):
+        path = f"Group/{level.split('/', 1)[1]}/$export"
+    if path is None:
+        raise ValueError(f"Unknown export level: {level}")
+
+    params = {}
+    if resource_types:
+        params["_type"] = ",".join(resource_types)
+    if since:
+        params["_since"] = since
+    response = session.get(
+        urljoin(base_url.rstrip("/") + "/", path),
+        params=params,
+        headers={"Accept": "application/fhir+json", "Prefer": "respond-async"},
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    )
+    if response.status_code != 202 or "Content-Location" not in response.headers:
+        raise BulkExportError(
+            f"Kick-off failed with HTTP {response.status_code}: {response.text[:500]}"
+        )
+    # a relative Content-Location is relative to the kick-off request URL
+    return urljoin(response.url, response.headers["Content-Location"])
+
+
+def get_retry_after(response, default):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:  # an HTTP date; fall back to the default pace
+        return default
+
+
+def wait_for_manifest(
+    session, status_url, poll_interval=BULK_EXPORT_POLL_INTERVAL, timeout=BULK_EXPORT_TIMEOUT
+):
+    """Polls the status URL until the export completes and returns its manifest
+
+    Output URLs in the manifest are made absolute.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        response = session.get(
+            status_url,
+            headers={"Accept": "application/json"},
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        )
+        if response.status_code == 200:
+            manifest = fhir_json.loads(response.content)
+            for output in manifest.get("output", []):
+                output["url"] = urljoin(response.url, output["url"])
+            return manifest
+        if response.status_code not in (202, 429, 503):
+            raise BulkExportError(
+                f"Export failed with HTTP {response.status_code}: {response.text[:500]}"
+            )
+        delay = get_retry_after(response, poll_interval)
+        if time.monotonic() + delay > deadline:
+            raise BulkExportError(f"Export did not finish within {timeout:.0f}s")
+        progress = response.headers.get("X-Progress")
+        if progress:
+            print(f"Export in progress: {progress}")
+        time.sleep(delay)
+
+
+def output_file_names(manifest):
+    """Names each output file <type>-<n>.ndjson, numbered per resource type
+
+    The type comes from the server and becomes part of a path, so anything
+    but a plain resource type name raises BulkExportError.
+    """
+    counters = {}
+    names = []
+    for output in manifest.get("output", []):
+        resource_type = output.get("type")
+        if not isinstance(resource_type, str) or not RESOURCE_TYPE.fullmatch(
+            resource_type
+        ):
+            raise BulkExportError(
+                f"Invalid resource type in manifest: {resource_type!r}"
+            )
+        counters[resource_type] = counters.get(resource_type, 0) + 1
+        names.append((output, f"{resource_type}-{counters[resource_type]}.ndjson"))
+    return names
+
+
+def download_file(session, url, path, headers=None, retries=BULK_EXPORT_RETRIES):
+    """Streams one output file to disk, resuming a partial download
+
+    Data goes to <path>.part and is renamed when complete, so a finished
+    file is never half written. Returns the number of bytes downloaded.
+    """
+    path = Path(path)
+    if path.exists():
+        return 0
+    part_path = path.with_name(path.name + ".part")
+    downloaded = 0
+    for attempt in range(retries + 1):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        request_headers = {"Accept": "application/fhir+ndjson", **(headers or {})}
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+        try:
+            with session.get(
+                url,
+                headers=request_headers,
+                stream=True,
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            ) as response:
+                if response.status_code == 416:  # nothing left after offset
+                    break
+                if response.status_code not in (200, 206):
+                    raise BulkExportError(
+                        f"Download of {url} failed with HTTP {response.status_code}"
+                    )
+                # 200 means the server ignored the Range header: start over
+                mode = "ab" if response.status_code == 206 else "wb"
+                with open(part_path, mode) as file:
+                    for block in response.iter_content(BLOCK_SIZE):
+                        file.write(block)
+                        downloaded += len(block)
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,  # body cut short
+        ):
+            if attempt == retries:
+                raise
+            time.sleep(min(2**attempt, 30))
+    os.replace(part_path, path)
+    return downloaded
+
+
+def run_export(
+    base_url,
+    out_dir,
+    resource_types=None,
+    since=None,
+    level="system",
+    downloads=BULK_EXPORT_DOWNLOADS,
+):
+    """Runs or resumes an export into out_dir and returns the manifest"""
+    session = get_fhir_client(base_url).session
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    status_path = out_dir / STATUS_FILE
+    manifest_path = out_dir / MANIFEST_FILE
+
+    if manifest_path.exists():
+        manifest = fhir_json.loads(manifest_path.read_bytes())
+    else:
+        if status_path.exists():
+            status_url = fhir_json.loads(status_path.read_bytes())["status_url"]
+        else:
+            status_url = kick_off(session, base_url, resource_types, since, level)
+            status_path.write_bytes(fhir_json.dumps_bytes({"status_url": status_url}))
+        manifest = wait_for_manifest(session, status_url)
+        manifest_path.write_bytes(fhir_json.dumps_bytes(manifest, indent=True))
+
+    headers = {}
+    if os.getenv("BULK_EXPORT_TOKEN") and manifest.get("requiresAccessToken"):
+        headers["Authorization"] = f"Bearer {os.getenv('BULK_EXPORT_TOKEN')}"
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(downloads, thread_name_prefix="bulk-export") as pool:
+        futures = {
+            pool.submit(download_file, session, output["url"], out_dir / name, headers): name
+            for output, name in output_file_names(manifest)
+        }
+        failures = []
+        downloaded = 0
+        for future, name in futures.items():
+            try:
+                downloaded += future.result()
+            except Exception as e:  # report every file, not just the first failure
+                failures.append((name, e))
+    elapsed = max(time.perf_counter() - started, 1e-9)
+
+    for name, error in failures:
+        print(f"FAILED {name}: {error}", file=sys.stderr)
+    print(
+        f"Downloaded {len(futures) - len(failures)} of {len(futures)} files, "
+        f"{downloaded / 1_000_000:.1f} MB in {elapsed:.2f}s"
+    )
+    if failures:
+        raise BulkExportError(f"{len(failures)} files failed; run again to resume")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--server",
+        default=os.getenv("FHIR_SERVER_URL"),
+        help="FHIR base URL (default: FHIR_SERVER_URL)",
+    )
+    parser.add_argument("--type", help="comma separated resource types to export")
+    parser.add_argument("--since", help="only resources changed after this instant")
+    parser.add_argument(
+        "--level",
+        default="system",
+        help='"system", "patient" or "group/<id>" (default: system)',
+    )
+    parser.add_argument("--out", default="export", help="directory for the NDJSON files")
+    args = parser.parse_args(argv)
+    if not args.server:
+        parser.error("--server or FHIR_SERVER_URL is required")
+
+    resource_types = args.type.split(",") if args.type else None
+    try:
+        run_export(args.server, args.out, resource_types, args.since, args.level)
+    except BulkExportError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except requests.RequestException as e:  # server unreachable or connection lost
+        print(f"Export failed: {e}; run again to resume", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
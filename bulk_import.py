@@ -0,0 +1,353 @@
+"""Import FHIR resources from bulk export NDJSON files.
+
+Lines are read as a stream and grouped into chunks. Each chunk is parsed
+and validated on a process pool, then written as a batch Bundle of PUTs by
+a pool of upload threads. PUT keeps the exported ids, so references
+between files stay valid and a chunk can safely be sent twice. At most
+BULK_IMPORT_MAX_IN_FLIGHT chunks are between reading and a finished
+upload; reading waits when that many are pending. Uploads answered with
+429 or 5xx are retried with jittered exponential backoff.
+
+Progress is saved to a checkpoint file as, per input file, the last line
+up to which every chunk has finished, so an interrupted import resumes
+there. A chunk only finishes once the server has answered it; lines that
+fail validation or are rejected by the server are appended to
+<checkpoint>.rejects.ndjson with the reason. When the server still cannot
+be reached after the retries, the import stops without advancing the
+checkpoint past the unanswered chunk, and running it again resumes there.
+
+    python bulk_import.py Patient.ndjson Condition.ndjson \\
+        --server https://hapi.fhir.org/baseR4
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+
+import fhir_json
+import fhir_validation
+from batch_cda import available_cpus
+from bundle_writer import build_bundle, summarize_response
+from fhir_pool import env_float, env_int, get_fhir_client
+
+BULK_IMPORT_BATCH_SIZE = env_int("BULK_IMPORT_BATCH_SIZE", 100)  # lines per Bundle
+BULK_IMPORT_UPLOADS = env_int("BULK_IMPORT_UPLOADS", 4)  # concurrent Bundles
+# chunks between reading and a finished upload
+BULK_IMPORT_MAX_IN_FLIGHT = env_int(
+    "BULK_IMPORT_MAX_IN_FLIGHT", BULK_IMPORT_UPLOADS * 2
+)
+BULK_IMPORT_RETRIES = env_int("BULK_IMPORT_RETRIES", 5)
+BULK_IMPORT_BACKOFF = env_float("BULK_IMPORT_BACKOFF", 0.5)  # seconds, doubled per try
+BULK_IMPORT_BACKOFF_MAX = env_float("BULK_IMPORT_BACKOFF_MAX", 30.0)
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# wrong credentials or endpoint: no chunk can succeed, so stop rather than reject
+STOP_STATUSES = frozenset((401, 403, 404, 405))
+# exports are usually R4, so "schema" by default; "full" parses with the
+# R5 fhir.resources models and rejects R4-only fields
+BULK_IMPORT_VALIDATION = fhir_validation.get_validation_level(
+    "BULK_IMPORT_VALIDATION", "schema"
+)
+
+
+class BulkImportError(Exception):
+    """The server did not answer or accept a chunk, so the import cannot continue"""
+
+
+def validate_resource(resource, level=BULK_IMPORT_VALIDATION):
+    """Raises ValueError if the resource is not valid for its type"""
+    if not isinstance(resource, dict) or not resource.get("resourceType"):
+        raise ValueError("not a FHIR resource")
+    if not resource.get("id"):
+        raise ValueError("resource has no id")
+    fhir_validation.validate_resource(resource, level)
+
+
+def validate_lines(lines):
+    """Parses and validates (line number, text) pairs in a worker process
+
+    Returns (line number, resource or None, error or None) for each line.
+    """
+    results = []
+    for line_number, line in lines:
+        try:
+            resource = fhir_json.loads(line)
+            validate_resource(resource)
+        except Exception as e:  # any failure rejects just this line
+            results.append((line_number, None, f"{type(e).__name__}: {e}"))
+        else:
+            results.append((line_number, resource, None))
+    return results
+
+
+def get_retry_delay(attempt, retry_after=None):
+    """Full jitter backoff, never shorter than the server's Retry-After"""
+    delay = random.uniform(
+        0, min(BULK_IMPORT_BACKOFF_MAX, BULK_IMPORT_BACKOFF * 2**attempt)
+    )
+    try:
+        return max(delay, float(retry_after))
+    except (TypeError, ValueError):  # absent, or an HTTP date
+        return delay
+
+
+def send_with_retry(client, bundle, retries=BULK_IMPORT_RETRIES):
+    """Posts a Bundle, retrying throttled, failed and dropped requests
+
+    Returns the response Bundle. Raises RuntimeError if the server rejects
+    the whole Bundle's content, and BulkImportError for STOP_STATUSES or
+    once retries are exhausted.
+    """
+    for attempt in range(retries + 1):
+        retry_after = None
+        try:
+            response = client.send_bundle(bundle)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if 200 <= response.status_code < 300:
+                return fhir_json.loads(response.content)
+            error = f"HTTP {response.status_code}: {response.text[:500]}"
+            if response.status_code in STOP_STATUSES:
+                raise BulkImportError(error)
+            if response.status_code not in RETRY_STATUSES:
+                raise RuntimeError(error)
+            retry_after = response.headers.get("Retry-After")
+        if attempt < retries:
+            time.sleep(get_retry_delay(attempt, retry_after))
+    raise BulkImportError(error)
+
+
+class Checkpoint:
+    """Tracks, per file, the last line up to which every chunk has finished
+
+    Chunks finish out of order, so a finished chunk only moves the mark
+    once every chunk before it has finished too.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.marks = {}
+        self._finished = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "rb") as file:
+                self.marks = fhir_json.loads(file.read())
+
+    def resume_line(self, file_name):
+        """Returns the last line of file_name already imported"""
+        return self.marks.get(file_name, 0)
+
+    def finish(self, file_name, first_line, last_line):
+        """Records a finished chunk and saves the checkpoint if the mark moved"""
+        with self._lock:
+            finished = self._finished.setdefault(file_name, {})
+            finished[first_line] = last_line
+            mark = self.marks.get(file_name, 0)
+            moved = False
+            while mark + 1 in finished:
+                mark = finished.pop(mark + 1)
+                moved = True
+            if moved:
+                self.marks[file_name] = mark
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(fhir_json.dumps_bytes(self.marks))
+        os.replace(temp_path, self.path)
+
+
+class BulkImporter:
+    """Streams NDJSON files through validation and upload pools"""
+
+    def __init__(
+        self,
+        client,
+        checkpoint_path=None,
+        batch_size=BULK_IMPORT_BATCH_SIZE,
+        uploads=BULK_IMPORT_UPLOADS,
+        validators=None,
+        max_in_flight=BULK_IMPORT_MAX_IN_FLIGHT,
+    ):
+        self.client = client
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.rejects_path = (
+            f"{checkpoint_path}.rejects.ndjson" if checkpoint_path else None
+        )
+        self.batch_size = batch_size
+        self.uploads = uploads
+        self.validators = validators or available_cpus()
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self.counts = {"lines": 0, "imported": 0, "rejected": 0}
+        self.rejects = []
+        self.error = None  # the failure that stopped the import
+
+    def iter_chunks(self, paths):
+        """Yields (file name, first line, [(line number, text)]) not yet imported
+
+        A chunk covers every line from first_line to its last resource, blank
+        lines included, so finished chunks tile the file without gaps.
+        """
+        for path in paths:
+            file_name = os.path.abspath(path)
+            first_line = self.checkpoint.resume_line(file_name) + 1
+            chunk = []
+            with open(path, encoding="utf-8") as lines:
+                for line_number, line in enumerate(lines, 1):
+                    if line_number < first_line or not line.strip():
+                        continue
+                    chunk.append((line_number, line))
+                    if len(chunk) == self.batch_size:
+                        yield file_name, first_line, chunk
+                        first_line = line_number + 1
+                        chunk = []
+            if chunk:
+                yield file_name, first_line, chunk
+
+    def run(self, paths):
+        """Imports every file and returns the counters
+
+        Raises BulkImportError once in-flight chunks have settled if a chunk
+        could not be uploaded; no chunk after it is read.
+        """
+        with ProcessPoolExecutor(self.validators) as validate_pool, ThreadPoolExecutor(
+            self.uploads, thread_name_prefix="bulk-upload"
+        ) as upload_pool:
+
+            def upload_when_validated(file_name, first_line, chunk, validated):
+                validated.add_done_callback(
+                    lambda validated: upload_pool.submit(
+                        self._upload, file_name, first_line, chunk, validated
+                    )
+                )
+
+            for file_name, first_line, chunk in self.iter_chunks(paths):
+                # backpressure: wait for an earlier chunk to finish uploading
+                self._slots.acquire()
+                if self.error is not None:
+                    self._slots.release()
+                    break
+                validated = validate_pool.submit(validate_lines, chunk)
+                upload_when_validated(file_name, first_line, chunk, validated)
+            # wait for every chunk to finish before the pools shut down
+            for _ in range(self.max_in_flight):
+                self._slots.acquire()
+        if self.error is not None:
+            raise self.error
+        return dict(self.counts)
+
+    def _upload(self, file_name, first_line, chunk, validated):
+        try:
+            if self.error is not None:  # stopping: leave the chunk for the next run
+                return
+            try:
+                rejected = self._send_chunk(chunk, validated)
+            except Exception as e:  # unanswered: never checkpoint the chunk
+                self._stop(e)
+                return
+            self._record(file_name, chunk, rejected)
+            self.checkpoint.finish(file_name, first_line, chunk[-1][0])
+        finally:
+            self._slots.release()
+
+    def _stop(self, error):
+        """Keeps the first failure; run() raises it once uploads settle"""
+        if not isinstance(error, BulkImportError):
+            error = BulkImportError(f"{type(error).__name__}: {error}")
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def _send_chunk(self, chunk, validated):
+        """Uploads the valid resources of a chunk; returns rejected lines"""
+        valid = []
+        rejected = []
+        for number, resource, error in validated.result():
+            if error:
+                rejected.append((number, error))
+            else:
+                valid.append((number, resource))
+        if not valid:
+            return rejected
+
+        bundle = build_bundle([resource for _, resource in valid], "batch", "PUT")
+        try:
+            response = send_with_retry(self.client, bundle)
+        except RuntimeError as e:  # the server answered, rejecting every entry
+            return rejected + [(number, str(e)) for number, _ in valid]
+        results = summarize_response(bundle, response)
+        for (number, _), result in zip(valid, results):
+            if not str(result["status"]).startswith("2"):
+                outcome = fhir_json.dumps(result["outcome"]) if result["outcome"] else ""
+                rejected.append((number, f"{result['status']} {outcome}".strip()))
+        return rejected
+
+    def _record(self, file_name, chunk, rejected):
+        lines = dict(chunk)
+        with self._lock:
+            self.counts["lines"] += len(chunk)
+            self.counts["rejected"] += len(rejected)
+            self.counts["imported"] += len(chunk) - len(rejected)
+            self.rejects.extend((file_name, number, error) for number, error in rejected)
+            if self.rejects_path and rejected:
+                with open(self.rejects_path, "a", encoding="utf-8") as file:
+                    for number, error in rejected:
+                        record = {
+                            "file": file_name,
+                            "line": number,
+                            "error": error,
+                            "resource": lines[number].strip(),
+                        }
+                        file.write(fhir_json.dumps(record) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="NDJSON files, one resource per line")
+    parser.add_argument(
+        "--server",
+        default=os.getenv("FHIR_SERVER_URL"),
+        help="FHIR base URL (default: FHIR_SERVER_URL)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="bulk_import.checkpoint.json",
+        help="progress file used to resume an interrupted import",
+    )
+    args = parser.parse_args(argv)
+    if not args.server:
+        parser.error("--server or FHIR_SERVER_URL is required")
+
+    importer = BulkImporter(get_fhir_client(args.server), args.checkpoint)
+    started = time.perf_counter()
+    try:
+        counts = importer.run(args.inputs)
+    except BulkImportError as e:
+        counts = importer.counts
+        print(
+            f"Import stopped: {e}. Run the same command again to resume.",
+            file=sys.stderr,
+        )
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    for file_name, number, error in importer.rejects:
+        print(f"REJECTED {file_name}:{number}: {error}", file=sys.stderr)
+    print(
+        f"Imported {counts['imported']} of {counts['lines']} resources in {elapsed:.2f}s "
+        f"({counts['lines'] / elapsed:.1f} resources/sec), {counts['rejected']} rejected"
+    )
+    return 1 if counts["rejected"] or importer.error else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
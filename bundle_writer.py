@@ -0,0 +1,148 @@
+import uuid
+
+from fhir_pool import env_int
+
+BUNDLE_BATCH_SIZE = env_int("BUNDLE_BATCH_SIZE", 100)  # entries per Bundle
+
+
+def iter_references(value):
+    """Yields every Reference dict nested anywhere in a resource"""
+    if isinstance(value, dict):
+        if isinstance(value.get("reference"), str):
+            yield value
+        for item in value.values():
+            yield from iter_references(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from iter_references(item)
+
+
+def build_bundle(resources, bundle_type="transaction", method="POST"):
+    """Packages resources into one batch or transaction Bundle
+
+    With POST the server assigns ids, so each resource gets a urn:uuid
+    fullUrl and references between resources in the Bundle ("Patient/123")
+    are rewritten to it. With PUT the resources keep their own ids and are
+    written to "Type/id"; a resource without an id raises ValueError.
+    References in the "Type-id" form are rewritten as well when they name a
+    resource in the Bundle (see resolve_reference). Resources are copied,
+    never modified in place.
+    """
+    entries = []
+    full_urls = {}
+    for resource in resources:
+        resource = _copy_json(resource)
+        resource_type = resource["resourceType"]
+        local_ref = f"{resource_type}/{resource.get('id')}"
+        if method == "POST":
+            full_url = f"urn:uuid:{uuid.uuid4()}"
+            resource.pop("id", None)
+            request = {"method": "POST", "url": resource_type}
+        else:
+            if not resource.get("id"):
+                raise ValueError(f"{resource_type} has no id, which PUT requires")
+            full_url = local_ref
+            request = {"method": "PUT", "url": local_ref}
+        full_urls.setdefault(resource_type, {})[local_ref] = full_url
+        entries.append({"fullUrl": full_url, "resource": resource, "request": request})
+
+    for entry in entries:
+        for reference in iter_references(entry["resource"]):
+            full_url = resolve_reference(reference["reference"], full_urls)
+            if full_url:
+                reference["reference"] = full_url
+
+    return {"resourceType": "Bundle", "type": bundle_type, "entry": entries}
+
+
+def resolve_reference(reference, full_urls):
+    """Returns the fullUrl a reference to a resource in the Bundle maps to
+
+    full_urls maps resource type -> {"Type/id": fullUrl}. Both "Type/id"
+    and the "Type-id" form must name a resource in the Bundle exactly.
+    Returns None for references to resources outside the Bundle.
+    """
+    resource_type, slash, _ = reference.partition("/")
+    if slash:
+        return full_urls.get(resource_type, {}).get(reference)
+    resource_type, dash, resource_id = reference.partition("-")
+    if not dash or not resource_type.isalpha():
+        return None
+    return full_urls.get(resource_type, {}).get(f"{resource_type}/{resource_id}")
+
+
+def _copy_json(value):
+    """Copies nested dicts and lists of a JSON value"""
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+
+
+def pack_groups(groups, batch_size=BUNDLE_BATCH_SIZE):
+    """Packs groups of related resources into batches of about batch_size
+
+    A group (for example a Patient and its clinical resources) is never split,
+    so references inside it can always be resolved within one Bundle.
+    """
+    batch = []
+    for group in groups:
+        if batch and len(batch) + len(group) > batch_size:
+            yield batch
+            batch = []
+        batch.extend(group)
+    if batch:
+        yield batch
+
+
+def summarize_response(sent_bundle, response_bundle):
+    """Pairs each sent entry with its status from the response Bundle"""
+    results = []
+    responses = (response_bundle or {}).get("entry", [])
+    for index, entry in enumerate(sent_bundle["entry"]):
+        response = responses[index].get("response", {}) if index < len(responses) else {}
+        results.append(
+            {
+                "resourceType": entry["resource"]["resourceType"],
+                "fullUrl": entry["fullUrl"],
+                "status": response.get("status", "unknown"),
+                "location": response.get("location"),
+                "outcome": response.get("outcome"),
+            }
+        )
+    return results
+
+
+def write_bundles(
+    client,
+    groups,
+    batch_size=BUNDLE_BATCH_SIZE,
+    bundle_type="transaction",
+    method="POST",
+):
+    """Writes groups of resources in as few batch/transaction requests as possible
+
+    Returns one result per resource with the server's status, location and
+    any OperationOutcome. A failed transaction marks every entry in it with
+    the error instead of stopping the remaining Bundles.
+    """
+    results = []
+    for resources in pack_groups(groups, batch_size):
+        bundle = build_bundle(resources, bundle_type, method)
+        try:
+            response = client.execute("", method="post", data=bundle)
+        except Exception as e:  # keep going so one bad Bundle does not stop a load
+            results.extend(
+                {
+                    "resourceType": entry["resource"]["resourceType"],
+                    "fullUrl": entry["fullUrl"],
+                    "status": "error",
+                    "location": None,
+                    "outcome": str(e),
+                }
+                for entry in bundle["entry"]
+            )
+            continue
+        results.extend(summarize_response(bundle, response))
+    return results
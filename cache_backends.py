@@ -0,0 +1,283 @@
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import fhir_json
+from fhir_pool import env_float
+
+# seconds a worker batches lookup recency and hit counters before writing them
+SQLITE_CACHE_FLUSH_INTERVAL = env_float("SQLITE_CACHE_FLUSH_INTERVAL", 1.0)
+
+
+class MemoryCache:
+    """Thread safe LRU cache held by a single worker process"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns (value, fresh) for a key, or (None, False) if it is not held"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._data.move_to_end(key)
+            value, stored_at = entry
+            fresh = time.monotonic() - stored_at < self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value, fresh
+
+    def set(self, key, value):
+        """Stores a value and evicts the least recently used entries"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def touch(self, key):
+        """Marks an entry as fresh again without replacing its value"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0], time.monotonic())
+
+    def delete(self, key):
+        """Removes a key if it is held"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        """Returns size and hit counters"""
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class SQLiteCache:
+    """LRU cache in a local SQLite file shared by every worker on the host
+
+    Values are stored as JSON, so only JSON serializable data can be cached.
+    Hit counters live in the same file and cover all workers.
+
+    Lookups are plain reads and never wait for the write lock. The recency
+    and hit counts they produce are batched per worker and written in one
+    transaction at most every flush_interval seconds, and before each set()
+    or stats(), so eviction order and counters lag by at most that much.
+
+    The file must be private to this user, see check_private_file().
+    """
+
+    def __init__(self, maxsize, ttl, path, flush_interval=SQLITE_CACHE_FLUSH_INTERVAL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        check_private_file(path)
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset_pending()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT, stored_at REAL, used_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used_at)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, n INTEGER)"
+            )
+            db.execute(
+                "INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)"
+            )
+
+    def _db(self):
+        """Returns this thread's connection, reopening it after a fork"""
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _connect(self):
+        """Returns this thread's connection wrapped in a write transaction"""
+        return _Transaction(self._db())
+
+    def _reset_pending(self):
+        self._pid = os.getpid()
+        self._used = {}  # key -> last lookup time, not yet written
+        self._counts = {"hits": 0, "misses": 0}
+        self._flushed_at = time.time()
+
+    def get(self, key):
+        """Returns (value, fresh) for a key, or (None, False) if it is not held"""
+        now = time.time()
+        # autocommit read: WAL lets it run alongside another worker's write
+        row = self._db().execute(
+            "SELECT value, stored_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        fresh = row is not None and now - row[1] < self.ttl
+        with self._lock:
+            if self._pid != os.getpid():  # forked: the parent writes its own
+                self._reset_pending()
+            if row is not None:
+                self._used[key] = now
+            self._counts["hits" if fresh else "misses"] += 1
+            due = now - self._flushed_at >= self.flush_interval
+        if due:
+            with self._connect() as db:
+                self._flush(db)
+        if row is None:
+            return None, False
+        return fhir_json.loads(row[0]), fresh
+
+    def _flush(self, db):
+        """Writes this worker's batched recency and counters in db's transaction"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset_pending()
+            used, counts = self._used, self._counts
+            self._reset_pending()
+        db.executemany(
+            "UPDATE cache SET used_at = MAX(used_at, ?) WHERE key = ?",
+            [(used_at, key) for key, used_at in used.items()],
+        )
+        db.executemany(
+            "UPDATE counters SET n = n + ? WHERE name = ?",
+            [(n, name) for name, n in counts.items() if n],
+        )
+
+    def set(self, key, value):
+        """Stores a value and evicts the least recently used entries"""
+        now = time.time()
+        with self._connect() as db:
+            self._flush(db)  # so eviction sees this worker's recent lookups
+            db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (key, fhir_json.dumps(value), now, now),
+            )
+            db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                "ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def touch(self, key):
+        """Marks an entry as fresh again without replacing its value"""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "UPDATE cache SET stored_at = ?, used_at = ? WHERE key = ?",
+                (now, now, key),
+            )
+
+    def delete(self, key):
+        """Removes a key if it is held"""
+        with self._connect() as db:
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def stats(self):
+        """Returns size and hit counters for all workers sharing the file"""
+        with self._connect() as db:
+            self._flush(db)
+            size = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            counters = dict(db.execute("SELECT name, n FROM counters").fetchall())
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+        }
+
+
+class _Transaction:
+    """Runs the statements of a with block in one immediate transaction"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def is_private(info):
+    """Tells if stat info belongs to this user and is closed to everyone else"""
+    return info.st_uid == os.getuid() and not stat.S_IMODE(info.st_mode) & (
+        stat.S_IRWXG | stat.S_IRWXO
+    )
+
+
+def check_private_file(path):
+    """Creates path with mode 0600 if needed, and checks no one else can reach it
+
+    Cached entries hold patient data and HTML that is rendered unescaped, so
+    the file and its directory must belong to this user and be closed to
+    everyone else; ValueError is raised otherwise. SQLite creates its -wal
+    and -shm files next to the file with the same mode.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or not is_private(info):
+        raise ValueError(
+            f"Cache directory {directory} must be a directory owned by this "
+            "user with mode 0700"
+        )
+    fd = os.open(
+        path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, stat.S_IRUSR | stat.S_IWUSR
+    )
+    try:
+        info = os.fstat(fd)
+    finally:
+        os.close(fd)
+    if not stat.S_ISREG(info.st_mode) or not is_private(info):
+        raise ValueError(
+            f"Cache file {path} must be a file owned by this user with mode 0600"
+        )
+
+
+def private_cache_dir():
+    """Returns this user's cache directory in the temp directory, mode 0700"""
+    directory = os.path.join(tempfile.gettempdir(), f"fhir-cache-{os.getuid()}")
+    os.makedirs(directory, mode=stat.S_IRWXU, exist_ok=True)
+    return directory
+
+
+def create_cache(backend, maxsize, ttl, path=None, filename="fhir_patient_cache.db"):
+    """Builds a cache backend by name, either "memory" or "sqlite"
+
+    Without a path the SQLite file is filename in private_cache_dir().
+    """
+    if backend == "memory":
+        return MemoryCache(maxsize, ttl)
+    if backend == "sqlite":
+        path = path or os.path.join(private_cache_dir(), filename)
+        return SQLiteCache(maxsize, ttl, path)
+    raise ValueError(f"Unknown cache backend: {backend}")
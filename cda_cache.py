@@ -0,0 +1,300 @@
+"""Content addressed cache of converted CDA documents.
+
+A document is stored under a digest of what it was built from: the
+(resourceType, id, meta.versionId) of every resource when the server
+versions them all, otherwise the canonical JSON of the whole bundle, plus
+the code tables in use and the version of the conversion code. An
+unchanged patient therefore maps to the same key and is served as bytes
+without running the conversion again. The memory tier is bounded by bytes
+per worker; an optional disk tier, shared by every worker on the host,
+keeps documents across restarts.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import fhir_json
+from convert_fhir_to_cda import iter_cda
+from fhir_pool import env_int
+from terminology import terminology
+
+CDA_CACHE_MAX_BYTES = env_int("CDA_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+CDA_CACHE_DIR = os.getenv("CDA_CACHE_DIR")  # unset keeps documents in memory only
+CDA_CACHE_DISK_MAX_BYTES = env_int("CDA_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)
+
+# modules whose code decides the document built from a bundle
+CONVERTER_MODULES = ("convert_fhir_to_cda", "cda_sections", "terminology")
+
+_terminology_digest = (None, None)
+_converter_version = None
+
+
+def get_terminology_digest():
+    """Digest of the code tables, recomputed only after they are reloaded"""
+    global _terminology_digest
+    tables = terminology.tables
+    if _terminology_digest[0] != tables.version:
+        snapshot = fhir_json.dumps_bytes(
+            [
+                tables.head,
+                tables.head_type_id,
+                tables.confidentiality,
+                [dict(section) for section in tables.sections.values()],
+            ]
+        )
+        _terminology_digest = (
+            tables.version,
+            hashlib.sha256(snapshot).hexdigest(),
+        )
+    return _terminology_digest[1]
+
+
+def get_converter_version():
+    """Digest of the conversion code
+
+    It is part of every key, so after a deploy that changes the output the
+    disk tier is not answered from documents built by the old code.
+    """
+    global _converter_version
+    if _converter_version is None:
+        digest = hashlib.sha256()
+        for name in CONVERTER_MODULES:
+            digest.update(Path(sys.modules[name].__file__).read_bytes())
+        _converter_version = digest.hexdigest()[:16]
+    return _converter_version
+
+
+def bundle_digest(fhir_bundle):
+    """Returns a stable key for the CDA document a bundle converts to"""
+    digest = hashlib.sha256(get_terminology_digest().encode("ascii"))
+    digest.update(get_converter_version().encode("ascii"))
+    resources = [
+        entry["resource"]
+        for entry in fhir_bundle.get("entry", [])
+        if "resource" in entry
+    ]
+    versions = [
+        (
+            resource.get("resourceType"),
+            resource.get("id"),
+            resource.get("meta", {}).get("versionId"),
+        )
+        for resource in resources
+    ]
+    if all(resource_id and version_id for _, resource_id, version_id in versions):
+        digest.update(b"versions")
+        digest.update(fhir_json.dumps_bytes(versions))
+    else:
+        digest.update(b"content")
+        digest.update(fhir_json.dumps_bytes(resources, sort_keys=True))
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """LRU cache of document bytes bounded by total size, with a disk tier"""
+
+    def __init__(
+        self,
+        max_bytes=CDA_CACHE_MAX_BYTES,
+        disk_dir=CDA_CACHE_DIR,
+        disk_max_bytes=CDA_CACHE_DISK_MAX_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._documents = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key):
+        """Returns the cached bytes for key, or None"""
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return document
+        document = self._read_disk(key)
+        with self._lock:
+            if document is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._store_memory(key, document)
+        return document
+
+    def set(self, key, document):
+        """Stores document bytes in memory and, if configured, on disk"""
+        self._store_memory(key, document)
+        self._write_disk(key, document)
+
+    def _store_memory(self, key, document):
+        if len(document) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._documents.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._documents[key] = document
+            self._size += len(document)
+            while self._size > self.max_bytes:
+                self._size -= len(self._documents.popitem(last=False)[1])
+
+    def open_writer(self, key):
+        """Returns a DocumentWriter that stores a streamed document under key"""
+        return DocumentWriter(self, key)
+
+    def _disk_path(self, key):
+        return self.disk_dir / f"{key}.xml"
+
+    def _temp_path(self, key):
+        """A file of this worker and thread, renamed into place when complete"""
+        return self._disk_path(key).with_suffix(
+            f".{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            document = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # the file's mtime records its last use for eviction
+        except OSError:
+            pass  # another worker evicted it after the read
+        return document
+
+    def _write_disk(self, key, document):
+        """Writes atomically, so other workers never read a partial file"""
+        if not self.disk_dir or len(document) > self.disk_max_bytes:
+            return
+        temp_path = self._temp_path(key)
+        temp_path.write_bytes(document)
+        self._publish_disk(key, temp_path)
+
+    def _publish_disk(self, key, temp_path):
+        os.replace(temp_path, self._disk_path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """Removes the least recently used files beyond disk_max_bytes"""
+        files = []
+        for path in self.disk_dir.glob("*.xml"):
+            try:
+                stat = path.stat()
+            except OSError:  # removed by another worker
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self):
+        """Returns size and hit counters for this worker"""
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "disk_dir": str(self.disk_dir) if self.disk_dir else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+class DocumentWriter:
+    """Collects a document while it is streamed, within each tier's limit
+
+    Chunks are kept in memory only while the document fits the memory
+    tier, and written to a temporary file in the disk tier while it fits
+    there, so no more than max_bytes of a document is ever buffered.
+    Nothing is stored until commit(); discard() drops a partial document.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self.chunks = []
+        self.temp_path = None
+        self.file = None
+        if cache.disk_dir:
+            self.temp_path = cache._temp_path(key)
+            self.file = open(self.temp_path, "wb")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.chunks is not None:
+            if self.size <= self.cache.max_bytes:
+                self.chunks.append(chunk)
+            else:
+                self.chunks = None
+        if self.file is not None:
+            if self.size <= self.cache.disk_max_bytes:
+                self.file.write(chunk)
+            else:
+                self.discard()
+
+    def commit(self):
+        """Stores the complete document in every tier it fits"""
+        if self.chunks is not None:
+            self.cache._store_memory(self.key, b"".join(self.chunks))
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.cache._publish_disk(self.key, self.temp_path)
+
+    def discard(self):
+        """Removes the temporary file of a document that is not stored"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.temp_path.unlink(missing_ok=True)
+
+
+cda_cache = DocumentCache()
+
+
+def iter_cached_cda(fhir_bundle, cache=None):
+    """Yields the CDA document from cache, or streams and caches a new one
+
+    A document is only stored once it has been written completely, and one
+    too large for either tier is streamed without being kept. Documents
+    bound for the disk tier are spilled to a file as they are streamed
+    rather than buffered in memory.
+    """
+    cache = cache or cda_cache
+    key = bundle_digest(fhir_bundle)
+    document = cache.get(key)
+    if document is not None:
+        yield document
+        return
+    writer = cache.open_writer(key)
+    try:
+        for chunk in iter_cda(fhir_bundle):
+            writer.write(chunk)
+            yield chunk
+        writer.commit()
+    finally:
+        writer.discard()
+
+
+def get_cda_document(fhir_bundle, cache=None):
+    """Returns the CDA document bytes for a bundle, using the cache"""
+    return b"".join(iter_cached_cda(fhir_bundle, cache))
@@ -0,0 +1,453 @@
+"""IHE/eHDSI structured body sections for CDA documents.
+
+Every section listed in static/codes/ihe-sections.json becomes a
+<component><section> with its templateIds, LOINC code, title, a narrative
+table and one entry per FHIR resource. The resources of a section are
+chosen by terminology.SECTION_RESOURCE_TYPES. The narrative table is built
+once per section; the same element is written into the CDA body and
+serialized as HTML for cda_template.html.
+"""
+
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+from lxml import etree
+
+import fhir_json
+from fhir_pool import env_int
+from terminology import SECTION_RESOURCE_TYPES, terminology
+
+NO_INFORMATION = "No information provided"
+CDA_SECTION_CACHE_SIZE = env_int("CDA_SECTION_CACHE_SIZE", 1024)  # sections
+# larger sections are streamed row by row instead of being built and cached
+CDA_SECTION_CACHE_MAX_RESOURCES = env_int("CDA_SECTION_CACHE_MAX_RESOURCES", 1000)
+
+
+def get_concept_text(concept):
+    """Reads a CodeableConcept's text, or its first coding's display or code"""
+    if not concept:
+        return ""
+    if concept.get("text"):
+        return concept["text"]
+    for coding in concept.get("coding", []):
+        if coding.get("display") or coding.get("code"):
+            return coding.get("display") or coding["code"]
+    return ""
+
+
+def get_referenced_resource(resource, bundle_index):
+    """Returns the Medication or Device a statement points to, if in the bundle
+
+    MedicationStatement is read as R5 (medication.reference) or R4
+    (medicationReference).
+    """
+    if resource.get("resourceType") == "MedicationStatement":
+        return bundle_index.resolve(
+            resource.get("medication", {}).get("reference")
+            or resource.get("medicationReference")
+        )
+    if resource.get("resourceType") == "DeviceUseStatement":
+        return bundle_index.resolve(resource.get("device"))
+    return None
+
+
+def get_main_concept(resource, bundle_index):
+    """Returns the CodeableConcept that says what a resource is about"""
+    if resource.get("resourceType") == "MedicationStatement":
+        medication = resource.get("medication", {})
+        concept = (
+            medication.get("concept")
+            or medication.get("code")
+            or resource.get("medicationCodeableConcept")  # R4
+        )
+        if concept:
+            return concept
+        referenced = get_referenced_resource(resource, bundle_index)
+        return (referenced or {}).get("code", {})
+    if resource.get("resourceType") == "DeviceUseStatement":
+        referenced = get_referenced_resource(resource, bundle_index)
+        return (referenced or {}).get("type", {})
+    return resource.get("code") or resource.get("vaccineCode") or {}
+
+
+def get_code_text(resource, bundle_index):
+    """Reads the name of a resource from its main concept"""
+    return get_concept_text(get_main_concept(resource, bundle_index)) or "Unknown"
+
+
+def get_status_text(resource, bundle_index):
+    """Reads a clinical status code, falling back to the resource status"""
+    clinical_status = resource.get("clinicalStatus", {})
+    for coding in clinical_status.get("coding", []):
+        if coding.get("code"):
+            return coding["code"]
+    return resource.get("status", "")
+
+
+def date_of(*fields):
+    """Returns an extractor for the first date or period start present"""
+
+    def get_date(resource, bundle_index):
+        for field in fields:
+            value = resource.get(field)
+            if isinstance(value, dict):
+                value = value.get("start")
+            if value:
+                return value
+        return ""
+
+    return get_date
+
+
+def get_observation_value(resource, bundle_index):
+    """Formats an Observation's value, whatever its type"""
+    if "valueQuantity" in resource:
+        quantity = resource["valueQuantity"]
+        return f"{quantity.get('value', '')} {quantity.get('unit', '')}".strip()
+    if "valueCodeableConcept" in resource:
+        return get_concept_text(resource["valueCodeableConcept"])
+    for field in ("valueString", "valueBoolean", "valueInteger", "valueDateTime"):
+        if field in resource:
+            return str(resource[field])
+    return ""
+
+
+# resource type -> narrative table columns as (header, extractor)
+SECTION_COLUMNS = MappingProxyType(
+    {
+        "AllergyIntolerance": (
+            ("Allergy", get_code_text),
+            ("Status", get_status_text),
+            ("Onset", date_of("onsetDateTime", "onsetPeriod")),
+        ),
+        "MedicationStatement": (
+            ("Medication", get_code_text),
+            ("Status", get_status_text),
+            ("Start", date_of("effectiveDateTime", "effectivePeriod")),
+        ),
+        "Condition": (
+            ("Problem", get_code_text),
+            ("Status", get_status_text),
+            ("Onset", date_of("onsetDateTime", "onsetPeriod")),
+        ),
+        "Procedure": (
+            ("Procedure", get_code_text),
+            ("Status", get_status_text),
+            (
+                "Date",
+                date_of(
+                    "performedDateTime",
+                    "performedPeriod",
+                    "occurrenceDateTime",
+                    "occurrencePeriod",
+                ),
+            ),
+        ),
+        "DeviceUseStatement": (
+            ("Device", get_code_text),
+            ("Status", get_status_text),
+            ("Date", date_of("timingDateTime", "timingPeriod", "recordedOn")),
+        ),
+        "Immunization": (
+            ("Vaccine", get_code_text),
+            ("Status", get_status_text),
+            ("Date", date_of("occurrenceDateTime")),
+        ),
+        "Observation": (
+            ("Observation", get_code_text),
+            ("Value", get_observation_value),
+            ("Date", date_of("effectiveDateTime", "effectivePeriod")),
+        ),
+    }
+)
+DEFAULT_COLUMNS = (("Description", get_code_text),)
+
+# resource type -> CDA entry act and its attributes
+SUBSTANCE_ADMINISTRATION = (
+    "substanceAdministration",
+    {"classCode": "SBADM", "moodCode": "EVN"},
+)
+ENTRY_ACTS = MappingProxyType(
+    {
+        "MedicationStatement": SUBSTANCE_ADMINISTRATION,
+        "Immunization": SUBSTANCE_ADMINISTRATION,
+        "Procedure": ("procedure", {"classCode": "PROC", "moodCode": "EVN"}),
+    }
+)
+DEFAULT_ENTRY_ACT = ("observation", {"classCode": "OBS", "moodCode": "EVN"})
+
+# section_title -> FHIR resource type
+SECTION_TITLES = MappingProxyType(
+    {title: resource_type for resource_type, title in SECTION_RESOURCE_TYPES.items()}
+)
+
+
+def get_sections():
+    """Returns (section metadata, resource type or None) for every IHE section"""
+    return [
+        (section, SECTION_TITLES.get(title))
+        for title, section in terminology.tables.sections.items()
+    ]
+
+
+def get_columns(resource_type):
+    return SECTION_COLUMNS.get(resource_type, DEFAULT_COLUMNS)
+
+
+def get_row_id(resource):
+    """The narrative row ID an entry's text reference points to"""
+    return f"{resource.get('resourceType', '').lower()}-{resource.get('id', '')}"
+
+
+def section_header_elements(section):
+    """Builds the templateId, code and title elements of a section"""
+    elements = []
+    for oid in (section.get("oid1"), section.get("oid2")):
+        if oid:
+            elements.append(etree.Element("templateId", root=oid))
+    elements.append(
+        etree.Element(
+            "code",
+            code=section["code"],
+            codeSystem=section["code_system"],
+            codeSystemName=section["code_system_name"],
+            displayName=section["display_name"],
+        )
+    )
+    title = etree.Element("title")
+    title.text = section["section_title"]
+    elements.append(title)
+    return elements
+
+
+def table_head(columns):
+    thead = etree.Element("thead")
+    tr = etree.SubElement(thead, "tr")
+    for header, _ in columns:
+        etree.SubElement(tr, "th").text = header
+    return thead
+
+
+def table_row(resource, columns, bundle_index):
+    """Builds the narrative row for one resource"""
+    tr = etree.Element("tr", ID=get_row_id(resource))
+    for _, extractor in columns:
+        etree.SubElement(tr, "td").text = str(extractor(resource, bundle_index))
+    return tr
+
+
+def empty_row(columns):
+    tr = etree.Element("tr")
+    etree.SubElement(tr, "td", colspan=str(len(columns))).text = NO_INFORMATION
+    return tr
+
+
+def section_entry(resource, bundle_index):
+    """Builds the coded entry for one resource, pointing at its narrative row"""
+    act_tag, act_attrib = ENTRY_ACTS.get(resource.get("resourceType"), DEFAULT_ENTRY_ACT)
+    entry = etree.Element("entry")
+    act = etree.SubElement(entry, act_tag, act_attrib)
+    etree.SubElement(act, "id", extension=resource.get("id", ""))
+    concept = get_main_concept(resource, bundle_index)
+    codings = [coding for coding in concept.get("coding", []) if coding.get("code")]
+    if codings:
+        attrib = {"code": codings[0]["code"]}
+        if codings[0].get("system"):
+            attrib["codeSystem"] = codings[0]["system"]
+        if codings[0].get("display"):
+            attrib["displayName"] = codings[0]["display"]
+        etree.SubElement(act, "code", attrib)
+    else:
+        etree.SubElement(act, "code", nullFlavor="NI")
+    text = etree.SubElement(act, "text")
+    etree.SubElement(text, "reference", value=f"#{get_row_id(resource)}")
+    status = get_status_text(resource, bundle_index)
+    if status:
+        etree.SubElement(act, "statusCode", code=status)
+    return entry
+
+
+def build_section(section, resource_type, bundle_index):
+    """Builds one <component><section> of the structured body"""
+    resources = bundle_index.resources(resource_type) if resource_type else []
+    columns = get_columns(resource_type)
+
+    component = etree.Element("component")
+    section_element = etree.SubElement(component, "section")
+    section_element.extend(section_header_elements(section))
+    table = etree.SubElement(etree.SubElement(section_element, "text"), "table")
+    table.append(table_head(columns))
+    tbody = etree.SubElement(table, "tbody")
+    for resource in resources:
+        tbody.append(table_row(resource, columns, bundle_index))
+    if not resources:
+        tbody.append(empty_row(columns))
+    for resource in resources:
+        section_element.append(section_entry(resource, bundle_index))
+    return component
+
+
+def resource_fingerprint(resource):
+    """Identifies a resource's content as bytes: its version if known, else its JSON"""
+    version_id = resource.get("meta", {}).get("versionId")
+    if resource.get("id") and version_id:
+        return (
+            f"{resource.get('resourceType')}/{resource['id']}/_history/{version_id}"
+        ).encode("utf-8")
+    return fhir_json.dumps_bytes(resource, sort_keys=True)
+
+
+def section_digest(section, resource_type, bundle_index):
+    """Digest of everything a section is built from
+
+    That is the section's codes, its resources in order and any Medication
+    or Device they reference, so the digest changes exactly when the
+    rendered section would.
+    """
+    digest = hashlib.sha256(
+        fhir_json.dumps_bytes([dict(section), resource_type], sort_keys=True)
+    )
+    for resource in bundle_index.resources(resource_type) if resource_type else []:
+        digest.update(resource_fingerprint(resource))
+        referenced = get_referenced_resource(resource, bundle_index)
+        if referenced is not None:
+            digest.update(b"->" + resource_fingerprint(referenced))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class SectionCache:
+    """LRU cache of built section elements keyed by their section_digest
+
+    Cached elements are shared: copy one before attaching it to a document.
+    """
+
+    def __init__(self, maxsize=CDA_SECTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._sections = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_section(self, section, resource_type, bundle_index):
+        """Returns the section element, building it only if its inputs changed"""
+        key = section_digest(section, resource_type, bundle_index)
+        with self._lock:
+            component = self._sections.get(key)
+            if component is not None:
+                self._sections.move_to_end(key)
+                self.hits += 1
+                return component
+            self.misses += 1
+        component = build_section(section, resource_type, bundle_index)
+        with self._lock:
+            self._sections[key] = component
+            while len(self._sections) > self.maxsize:
+                self._sections.popitem(last=False)
+        return component
+
+    def stats(self):
+        """Returns size and hit counters for this worker"""
+        with self._lock:
+            return {
+                "size": len(self._sections),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+section_cache = SectionCache()
+
+
+def build_structured_body(bundle_index):
+    """Builds <component><structuredBody> with every IHE section
+
+    Sections whose inputs are unchanged since they were last built are
+    copied from the section cache instead of being rebuilt.
+    """
+    component = etree.Element("component")
+    structured_body = etree.SubElement(component, "structuredBody")
+    for section, resource_type in get_sections():
+        section_component = section_cache.get_section(section, resource_type, bundle_index)
+        structured_body.append(copy.deepcopy(section_component))
+    return component
+
+
+def write_structured_body(xf, bundle_index, flush_every):
+    """Streams the structured body to an lxml xmlfile writer
+
+    Sections up to CDA_SECTION_CACHE_MAX_RESOURCES resources come from the
+    section cache; larger ones are written row by row so memory stays flat.
+    Yields every flush_every rows or entries and after each section, so the
+    caller can hand out what has been written so far.
+    """
+    with xf.element("component"):
+        with xf.element("structuredBody"):
+            for section, resource_type in get_sections():
+                resources = bundle_index.resources(resource_type) if resource_type else []
+                if len(resources) <= CDA_SECTION_CACHE_MAX_RESOURCES:
+                    xf.write(
+                        section_cache.get_section(section, resource_type, bundle_index)
+                    )
+                else:
+                    yield from _stream_section(
+                        xf, section, resource_type, resources, bundle_index, flush_every
+                    )
+                yield
+
+
+def _stream_section(xf, section, resource_type, resources, bundle_index, flush_every):
+    columns = get_columns(resource_type)
+    with xf.element("component"), xf.element("section"):
+        for element in section_header_elements(section):
+            xf.write(element)
+        with xf.element("text"), xf.element("table"):
+            xf.write(table_head(columns))
+            with xf.element("tbody"):
+                for count, resource in enumerate(resources, 1):
+                    xf.write(table_row(resource, columns, bundle_index))
+                    if count % flush_every == 0:
+                        yield
+        for count, resource in enumerate(resources, 1):
+            xf.write(section_entry(resource, bundle_index))
+            if count % flush_every == 0:
+                yield
+
+
+def narrative_html(cda_root):
+    """Returns (title, table HTML) for each section of a built CDA document
+
+    The tables are the ones written into the document body, serialized as
+    HTML rather than formatted a second time. cda_root may be a tree built
+    in memory or a parsed document, whose elements are in the CDA namespace.
+    """
+    namespace = etree.QName(cda_root).namespace
+    prefix = f"{{{namespace}}}" if namespace else ""
+    path = "/".join(
+        prefix + tag for tag in ("component", "structuredBody", "component", "section")
+    )
+    sections = []
+    for section in cda_root.iterfind(path):
+        table = section.find(f"{prefix}text/{prefix}table")
+        sections.append(
+            (
+                section.findtext(f"{prefix}title"),
+                etree.tostring(html_table(table), method="html", encoding="unicode"),
+            )
+        )
+    return sections
+
+
+def html_table(table):
+    """Returns the table itself, or a copy without the CDA namespace"""
+    if etree.QName(table).namespace is None:
+        return table
+    table = copy.deepcopy(table)
+    for element in table.iter(etree.Element):
+        element.tag = etree.QName(element).localname
+    etree.cleanup_namespaces(table)
+    return table
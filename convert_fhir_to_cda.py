@@ -1,17 +1,23 @@
-import json
+import copy
+import os
 from lxml import etree
 import xml.etree.ElementTree as ET
 from datetime import datetime
 from create_patient_record import create_sample_patient_record
 from flask import render_template
+import fhir_json
+from cda_sections import build_structured_body, narrative_html, write_structured_body
+from terminology import terminology
+
+# entries written between chunks when a CDA document is streamed
+CDA_STREAM_FLUSH = int(os.getenv("CDA_STREAM_FLUSH", "100"))
 
 
 def read_fhir_bundle():
 
     # Create the sample patient record as a FHIR bundle
-    patient_record = create_sample_patient_record()
-    patient_record_json = patient_record.json(indent=4)
-    fhir_bundle = json.loads(patient_record_json)
+    patient_record_json = create_sample_patient_record()
+    fhir_bundle = fhir_json.loads(patient_record_json)
     return fhir_bundle
 
 # Helper function to add sub-elements with text and attributes
@@ -22,76 +28,84 @@ def add_sub_element(parent, tag, text=None, attrib={}):
 
 
 class CDAData:
-    def __init__(self):
-        with open('static/codes/ehdsi.json', encoding='utf-8') as json_file:
-            data = json.load(json_file)
-            self.head = [
-                (
-                    p['codeElement'][0]['displayName'],
-                    p['codeElement'][0]['code'],
-                    p['codeElement'][0]['codeSystem'],
-                    p['codeElement'][0]['codeSystemName']
-                )
-                for p in data[('rootDirectory')]]
-            
-            self.head_type_id = [
-                (
-                    p['typeId'][0]['extension'],
-                    p['typeId'][0]['root']
-                )
-                for p in data['rootDirectory']]
-            
-            self.conf = [
-                (
-                    p['confidentiality'], 
-                    p['codeSystem'], 
-                    p['displayName']
-                    ) 
-                    for p in data['confidentialityCode']]
-
-            self.custodian = [
-                (
-                    p['title'], 
-                    p['oid'], 
-                    p['address'], 
-                    p['city'], 
-                    p['county'], 
-                    p['postalCode'], 
-                    p['country'], 
-                    p['phone'], 
-                    p['use'], 
-                    p['email'], 
-                    p['website']
-                    ) 
-                    for p in data['custodian']]
+    """Header codes from ehdsi.json, served by the terminology registry so
+    edits to the file are picked up without a restart"""
 
     def get_headers(self):
-        return self.head
+        return terminology.tables.head
     
     def get_header_type_id(self):
-        return self.head_type_id
+        return terminology.tables.head_type_id
 
     def get_confidentiality(self):
-        return self.conf
+        return terminology.tables.confidentiality
     
     def get_custodian(self):
-        return self.custodian
+        return terminology.tables.custodian
 
 cda_data = CDAData()
 
 
-# Create the root element for the CDA document
-def create_root_element():
-    root = etree.Element('ClinicalDocument', xmlns="urn:hl7-org:v3", xsi="schemaLocation=http://www.w3.org/2001/XMLSchema-instance")
-    add_header_elements(root)
-    return root
+class BundleIndex:
+    """Indexes a FHIR bundle in one pass for the CDA section builders
+
+    Resources are grouped by resourceType in bundle order, and every resource
+    is reachable by its fullUrl and by "Type/id", so references between
+    resources resolve without scanning the bundle again.
+    """
+
+    def __init__(self, fhir_bundle):
+        self.by_type = {}
+        self.by_reference = {}
+        for entry in fhir_bundle.get('entry', []):
+            resource = entry.get('resource')
+            if not resource:
+                continue
+            resource_type = resource.get('resourceType')
+            self.by_type.setdefault(resource_type, []).append(resource)
+            if resource.get('id'):
+                self.by_reference[f"{resource_type}/{resource['id']}"] = resource
+            if entry.get('fullUrl'):
+                self.by_reference[entry['fullUrl']] = resource
+
+    def resources(self, resource_type):
+        return self.by_type.get(resource_type, [])
+
+    def resolve(self, reference):
+        """Returns the resource a Reference points to, if it is in the bundle"""
+        if isinstance(reference, dict):
+            reference = reference.get('reference')
+        return self.by_reference.get(reference)
+
+    @property
+    def patient(self):
+        patients = self.resources('Patient')
+        return patients[0] if patients else None
+
+
+def index_bundle(fhir_bundle):
+    """Returns a BundleIndex, reusing one that was already built"""
+    if isinstance(fhir_bundle, BundleIndex):
+        return fhir_bundle
+    return BundleIndex(fhir_bundle)
+
+
+CDA_NAMESPACE = "urn:hl7-org:v3"
+CDA_XSI = "schemaLocation=http://www.w3.org/2001/XMLSchema-instance"
+
+
+def get_effective_time():
+    return datetime.now().strftime('%Y%m%d%H%M%S')
+
 
 # Add header elements required for CDA
-def add_header_elements(root):
+def add_header_elements(root, effective_time=None):
 
     head = cda_data.get_headers()
     head_type_id = cda_data.get_header_type_id()
     conf = cda_data.get_confidentiality()
+    if effective_time is None:
+        effective_time = get_effective_time()
 
     for extension, root_element in head_type_id:
         add_sub_element(root, 'typeId', attrib={'extension': extension, 'root': root_element})
@@ -100,31 +114,62 @@ def add_header_elements(root):
         add_sub_element(root, 'id', attrib={'root': '2.16.840.1.113883.19.5.99999.1'})
         add_sub_element(root, 'code', attrib={'code': code, 'codeSystem': codeSystem, 'codeSystemName': codeSystemName})
         add_sub_element(root, 'title', text=displayName)
-        add_sub_element(root, 'effectiveTime', attrib={'value': datetime.now().strftime('%Y%m%d%H%M%S')})
+        add_sub_element(root, 'effectiveTime', attrib={'value': effective_time})
         
     for confidentiality, codeSystem, displayName in conf:  
         add_sub_element(root, 'confidentialityCode', attrib={'code': confidentiality, 'codeSystem': codeSystem, 'displayName': displayName})
 
 
+def build_header_template():
+    """Builds the static document header from ehdsi.json
+
+    Returns the root element and the child positions of its effectiveTime
+    elements, the only header values that change between documents.
+    """
+    root = etree.Element('ClinicalDocument', xmlns=CDA_NAMESPACE, xsi=CDA_XSI)
+    add_header_elements(root, effective_time="")
+    positions = tuple(
+        position for position, child in enumerate(root) if child.tag == 'effectiveTime'
+    )
+    return root, positions
+
+
+# (terminology version, root, effectiveTime positions); the root is never
+# modified, every document starts from a deep copy of it
+_header_template = (None, None, ())
+
+
+def get_header_template():
+    """Returns the header template, rebuilding it after ehdsi.json changes"""
+    global _header_template
+    version = terminology.tables.version
+    if _header_template[0] != version:
+        _header_template = (version, *build_header_template())
+    return _header_template[1:]
+
+
+# Create the root element for the CDA document
+def create_root_element(effective_time=None):
+    template, effective_time_positions = get_header_template()
+    root = copy.deepcopy(template)
+    effective_time = effective_time or get_effective_time()
+    for position in effective_time_positions:
+        root[position].set('value', effective_time)
+    return root
+
 
 def fhir_to_cda(fhir_bundle):
+    # Index the bundle once for all the section builders
+    bundle_index = index_bundle(fhir_bundle)
+
     # Create CDA root element
     cda_root = create_root_element()
 
     # Add header information
-    add_header_information(cda_root, fhir_bundle)
-
-    # Add Allergies
-    add_allergies(cda_root, fhir_bundle)
-
-    # Add Medications
-    add_medications(cda_root, fhir_bundle)
+    add_header_information(cda_root, bundle_index)
 
-    # Add Conditions
-    add_conditions(cda_root, fhir_bundle)
-
-    # Add Procedures
-    add_procedures(cda_root, fhir_bundle)
+    # Add the IHE sections (allergies, medications, problems, procedures...)
+    cda_root.append(build_structured_body(bundle_index))
 
     # print(etree.tostring(cda_root, pretty_print=True, xml_declaration=True, encoding="UTF-8"))
     
@@ -132,93 +177,90 @@ def fhir_to_cda(fhir_bundle):
 
 
 def add_header_information(cda_root, fhir_bundle):
+    patient = index_bundle(fhir_bundle).patient
+    if patient is None:
+        raise ValueError("The bundle has no Patient resource")
     header = etree.SubElement(cda_root, "header")
     patient_info = etree.SubElement(header, "patient")
     patient_name = etree.SubElement(patient_info, "name")
-    patient_name.text = fhir_bundle['entry'][0]['resource']['name'][0]['given'][0] + " " + fhir_bundle['entry'][0]['resource']['name'][0]['family']
+    name = (patient.get('name') or [{}])[0]
+    patient_name.text = f"{(name.get('given') or [''])[0]} {name.get('family', '')}".strip()
 
     # Add more elements as needed from the FHIR bundle to the CDA document
     # For example, patient ID, birth date, etc.
     patient_id = etree.SubElement(patient_info, "id")
-    patient_id.text = fhir_bundle['entry'][0]['resource']['id']
+    patient_id.text = patient['id']
 
     birth_date = etree.SubElement(patient_info, "birthDate")
-    birth_date.text = fhir_bundle['entry'][0]['resource']['birthDate']
-
+    birth_date.text = patient.get('birthDate', '')
 
-def add_allergies(cda_root, fhir_bundle):
-    allergies = etree.SubElement(cda_root, "allergies")
-    for entry in fhir_bundle['entry']:
-        if entry['resource']['resourceType'] == "AllergyIntolerance":
-            allergy = etree.SubElement(allergies, "allergy")
-            allergy.text = entry['resource']['code'].get('text', 'Unknown')
 
+class _ChunkWriter:
+    """File-like sink that collects what xmlfile writes until it is drained"""
 
-def add_medications(cda_root, fhir_bundle):
-    medications = etree.SubElement(cda_root, "medications")
-    for entry in fhir_bundle['entry']:
-        if entry['resource']['resourceType'] == "MedicationStatement":
-            medication = etree.SubElement(medications, "medication")
-            medication.text = entry['resource']['medication'].get('code', {}).get('text', 'Unknown')
-
-
-def add_conditions(cda_root, fhir_bundle):
-    conditions = etree.SubElement(cda_root, "conditions")
-    for entry in fhir_bundle['entry']:
-        if entry['resource']['resourceType'] == "Condition":
-            condition = etree.SubElement(conditions, "condition")
-            condition.text = entry['resource']['code'].get('text', 'Unknown')
-            
-            
-def add_procedures(cda_root, fhir_bundle):
-    procedures = etree.SubElement(cda_root, "procedures")
-    for entry in fhir_bundle['entry']:
-        if entry['resource']['resourceType'] == "Procedure":
-            procedure = etree.SubElement(procedures, "procedure")
-            procedure.text = entry['resource']['code'].get('text', 'Unknown')
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_cda(fhir_bundle, flush_every=CDA_STREAM_FLUSH):
+    """Generates the CDA document as UTF-8 chunks while it is being written
+
+    Only the element being written is held in memory, never the whole
+    document tree, so memory stays flat however long the patient history is.
+    A chunk is produced after the header, after each section and every
+    flush_every rows or entries, which suits a streamed HTTP response.
+    """
+    bundle_index = index_bundle(fhir_bundle)
+    writer = _ChunkWriter()
+    with etree.xmlfile(writer, encoding='UTF-8', buffered=False) as xf:
+        xf.write_declaration()
+        root = create_root_element()
+        with xf.element(root.tag, root.attrib):
+            add_header_information(root, bundle_index)
+            for child in root:
+                xf.write("\n  ")
+                xf.write(child)
+            yield writer.drain()
+
+            xf.write("\n  ")
+            for _ in write_structured_body(xf, bundle_index, flush_every):
+                yield writer.drain()
+            xf.write("\n")
+    writer.write(b"\n")
+    yield writer.drain()
+
+
+def write_cda(fhir_bundle, output):
+    """Streams the CDA document to a file name or a binary file object"""
+    if isinstance(output, str):
+        with open(output, 'wb') as file:
+            write_cda(fhir_bundle, file)
+        return
+    for chunk in iter_cda(fhir_bundle):
+        output.write(chunk)
 
 
 # Add different sections
 # IHE Resource https://wiki.ihe.net/index.php/
 # Add clinical sections filtered by patient ID with table rendering
 def add_clinical_sections(cda_root, fhir_bundle):
-    clinical_sections = etree.SubElement(cda_root, "clinicalSections")
-    resource_types = [
-        "Observation",
-        "DiagnosticReport",
-        "Immunization",
-        "Procedure",
-        "MedicationStatement",
-        "Condition",
-        "AllergyIntolerance"
-    ]
-    
-    found_types = set()
-
-    for entry in fhir_bundle['entry']:
-        resource_type = entry['resource']['resourceType']
-        if resource_type in resource_types:
-            found_types.add(resource_type)
-            clinical_section = etree.SubElement(clinical_sections, "clinicalSection")
-            clinical_section.text = entry['resource']['code'].get('text', 'Unknown')
-
-    for resource_type in resource_types:
-        if resource_type not in found_types:
-            clinical_section = etree.SubElement(clinical_sections, "clinicalSection")
-            clinical_section.text = f"No information provided for {resource_type}"
-
-    return etree.tostring(clinical_sections, encoding='unicode')
-
-
-
+    """Adds the structured body and returns its narrative tables for the HTML view"""
+    cda_root.append(build_structured_body(index_bundle(fhir_bundle)))
+    return narrative_html(cda_root)
 
 
-# Save the CDA document as an XML file
-def save_cda_document(fhir_bundle):
-    cda_tree = fhir_to_cda(fhir_bundle)
-    file_name = "output.xml"
-    cda_tree.write(file_name, pretty_print=True, xml_declaration=True, encoding='UTF-8')
-    print("File saved as output.xml")
+# Save the CDA document as an XML file, streamed so the whole tree is never held
+def save_cda_document(fhir_bundle, file_name="output.xml"):
+    write_cda(fhir_bundle, file_name)
+    print(f"File saved as {file_name}")
 
 if __name__ == "__main__":
     fhir_bundle = read_fhir_bundle()
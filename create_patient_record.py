@@ -42,7 +42,7 @@ def create_sample_patient_record():
     # Allergies
     allergy = AllergyIntolerance(
         id="allergy1",
-        patient={"reference": "Patient-12345"},
+        patient={"reference": "Patient/12345036089"},
         clinicalStatus={
             "coding": [
                 {
@@ -76,7 +76,7 @@ def create_sample_patient_record():
     medication = MedicationStatement(
     id="med1",
     subject=Reference(
-        reference="Patient-12345",
+        reference="Patient/12345036089",
         display="Jane Doe"),
     medication=CodeableReference( # medication reference
         concept=CodeableConcept( # medication concept
@@ -120,7 +120,7 @@ def create_sample_patient_record():
     # Conditions (Medical History)
     condition = Condition(
         id="condition1",
-        subject=Reference(reference="Patient-12345"),
+        subject=Reference(reference="Patient/12345036089"),
         clinicalStatus=CodeableConcept(
             coding=[
                 Coding(
@@ -160,7 +160,7 @@ def create_sample_patient_record():
     # Procedures 
     procedure = Procedure(
         id="procedure1",
-        subject=Reference(reference="Patient-12345"),
+        subject=Reference(reference="Patient/12345036089"),
         status="completed",  # required field
         code=CodeableConcept(
             coding=[
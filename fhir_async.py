@@ -0,0 +1,160 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+
+import aiohttp
+from fhirpy import AsyncFHIRClient
+from fhirpy.base.utils import AttrDict
+
+import fhir_json
+from fhir_pool import CONNECT_TIMEOUT, READ_TIMEOUT, env_int, raise_for_status
+
+# Upper bound on sockets held by the shared event loop of each worker
+ASYNC_LIMIT = env_int("FHIR_ASYNC_LIMIT", 200)
+ASYNC_LIMIT_PER_HOST = env_int("FHIR_ASYNC_LIMIT_PER_HOST", 100)
+
+
+class PooledAsyncFHIRClient(AsyncFHIRClient):
+    """AsyncFHIRClient that keeps one aiohttp session open on the worker loop"""
+
+    def __init__(self, url, **kwargs):
+        super().__init__(url, **kwargs)
+        self.session = None
+
+    def _get_session(self):
+        """Creates the session lazily so it is bound to the running loop"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=ASYNC_LIMIT, limit_per_host=ASYNC_LIMIT_PER_HOST
+            )
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def _send(self, method, path, data=None, params=None):
+        """Sends one request on the shared session, returning (status, body bytes)"""
+        headers = self._build_request_headers()
+        url = self._build_request_url(path, params)
+        body = None
+        if data is not None:
+            body = fhir_json.dumps_bytes(data)
+            headers = {**headers, "Content-Type": "application/json"}
+        session = self._get_session()
+        async with session.request(
+            method, url, data=body, headers=headers, **self.aiohttp_config
+        ) as r:
+            return r.status, await r.read()
+
+    async def _do_request(
+        self, method, path, data=None, params=None, returning_status=False
+    ):
+        """Same contract as fhirpy's AsyncClient, but reuses pooled sockets"""
+        status, raw_data = await self._send(method, path, data, params)
+
+        if 200 <= status < 300:
+            r_data = (
+                fhir_json.loads(raw_data, object_hook=AttrDict) if raw_data else None
+            )
+            return (r_data, status) if returning_status else r_data
+
+        raise_for_status(status, raw_data.decode("utf-8", "replace"))
+
+    async def get_bundle(self, path, params=None):
+        """Fetches a searchset page as plain JSON; path may be a paging link"""
+        status, raw_data = await self._send("get", path, params=params)
+
+        if 200 <= status < 300:
+            return fhir_json.loads(raw_data)
+
+        raise_for_status(status, raw_data.decode("utf-8", "replace"))
+
+    def pool_stats(self):
+        """Returns connector counters for the shared aiohttp session"""
+        connector = self.session.connector if self.session else None
+        if connector is None or connector.closed:
+            return {"limit": ASYNC_LIMIT, "in_use": 0, "idle": 0}
+        return {
+            "limit": connector.limit,
+            "limit_per_host": connector.limit_per_host,
+            "in_use": len(connector._acquired),
+            "idle": sum(len(conns) for conns in connector._conns.values()),
+        }
+
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+_clients = {}
+
+
+def get_event_loop():
+    """Returns the worker's shared event loop, started on a daemon thread"""
+    global _loop, _loop_pid
+
+    with _loop_lock:
+        # gunicorn forks after import, so the parent's loop thread is gone
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _clients.clear()
+            threading.Thread(
+                target=_loop.run_forever, name="fhir-async-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    """Runs a coroutine on the shared loop and blocks the caller for its result
+
+    The caller's context is copied into the task so Flask's request, session
+    and flash helpers keep working inside async views.
+    """
+    loop = get_event_loop()
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def _copy_result(task):
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def _start():
+        task = loop.create_task(coro, context=context)
+        task.add_done_callback(_copy_result)
+
+    loop.call_soon_threadsafe(_start)
+    return future.result(timeout)
+
+
+def async_to_sync(func):
+    """Flask hook that runs async views on the shared loop instead of asgiref"""
+
+    def wrapper(*args, **kwargs):
+        return run_coroutine(func(*args, **kwargs))
+
+    return wrapper
+
+
+def get_async_fhir_client(url):
+    """Returns the shared async client for this worker process"""
+    get_event_loop()
+    with _loop_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = PooledAsyncFHIRClient(url)
+            _clients[url] = client
+        return client
+
+
+def async_pool_stats():
+    """Returns connector statistics for every async client of this worker"""
+    with _loop_lock:
+        clients = dict(_clients) if _loop_pid == os.getpid() else {}
+    return {url: client.pool_stats() for url, client in clients.items()}
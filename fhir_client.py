@@ -1,19 +1,21 @@
 import requests
-from fhirpy import SyncFHIRClient
-import json
+import fhir_json
+from bundle_writer import write_bundles
 from create_patient_record import create_sample_patient_record
+from fhir_pool import get_fhir_client
 
 
 def upload_patient_summary():
-    """Uploads a patient summary bundle to a FHIR server."""
+    """Uploads a patient summary bundle to a FHIR server in one transaction."""
     # patient_summary = create_sample_patient_record()
 
-    with open('templates/sample.json', 'r') as file:
-        patient_summary = file.read()
+    with open('sample.json', 'rb') as file:
+        patient_summary = fhir_json.loads(file.read())
 
-    client = SyncFHIRClient("https://hapi.fhir.org/baseR4")
-    patient = client.resource("Patient", **json.loads(patient_summary))
-    patient.save()
+    client = get_fhir_client("https://hapi.fhir.org/baseR4")
+    resources = [entry['resource'] for entry in patient_summary['entry']]
+    for result in write_bundles(client, [resources]):
+        print(result['resourceType'], result['status'], result['location'] or result['outcome'])
 
 
 
@@ -0,0 +1,70 @@
+"""JSON codec for FHIR payloads.
+
+orjson is used when it is installed and the standard library json module
+otherwise; FHIR_JSON_BACKEND=json forces the standard library. Both
+backends write the same text: compact separators, UTF-8 rather than \\u
+escapes, and optionally sorted keys or a two space indent. Only floats in
+exponent notation are spelled differently (1e20 against 1e+20).
+
+loads() accepts response bytes as they are, so payloads are not decoded
+to str first. A call with object_hook always uses the standard library,
+which is faster than converting the objects orjson returns afterwards.
+"""
+
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# "auto" uses orjson when it is installed, "json" always uses the stdlib
+FHIR_JSON_BACKEND = os.getenv("FHIR_JSON_BACKEND", "auto")
+if FHIR_JSON_BACKEND not in ("auto", "json"):
+    raise ValueError(f"Unknown JSON backend: {FHIR_JSON_BACKEND}")
+_orjson = orjson if FHIR_JSON_BACKEND == "auto" else None
+
+BACKEND = "orjson" if _orjson else "json"
+
+# orjson.JSONDecodeError subclasses this, so callers catch one type
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data, object_hook=None):
+    """Parses JSON from bytes, bytearray, memoryview or str"""
+    if object_hook is not None:
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data, object_hook=object_hook)
+    if _orjson:
+        return _orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def dumps_bytes(obj, sort_keys=False, indent=False):
+    """Serializes obj to UTF-8 JSON bytes"""
+    if _orjson:
+        option = _orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= _orjson.OPT_SORT_KEYS
+        if indent:
+            option |= _orjson.OPT_INDENT_2
+        try:
+            return _orjson.dumps(obj, option=option)
+        except TypeError:  # e.g. integers beyond 64 bits; the stdlib copes
+            pass
+    return json.dumps(
+        obj,
+        ensure_ascii=False,
+        sort_keys=sort_keys,
+        indent=2 if indent else None,
+        separators=(",", ": ") if indent else (",", ":"),
+    ).encode("utf-8")
+
+
+def dumps(obj, sort_keys=False, indent=False):
+    """Serializes obj to a JSON str"""
+    return dumps_bytes(obj, sort_keys, indent).decode("utf-8")
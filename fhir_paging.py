@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from fhir_pool import READ_TIMEOUT, env_int
+
+PATIENT_PAGE_SIZE = env_int("PATIENT_PAGE_SIZE", 100)
+SEARCH_PAGE_SIZE = env_int("SEARCH_PAGE_SIZE", 20)
+PREFETCH_WORKERS = env_int("FHIR_PREFETCH_WORKERS", 2)
+PREFETCH_MAXSIZE = env_int("FHIR_PREFETCH_MAXSIZE", 64)
+
+
+def patient_page_params(page_size=PATIENT_PAGE_SIZE):
+    """Search parameters for the first page of the patient list, ids only"""
+    return {"_sort": "-_lastUpdated", "_elements": "id", "_count": page_size}
+
+
+def search_page_params(search_params, page_size=SEARCH_PAGE_SIZE):
+    """Search parameters for the first page of a paged search result"""
+    return {**search_params, "_count": page_size}
+
+
+def get_link(bundle, relation):
+    """Returns the url of a Bundle link such as "next", if present"""
+    for link in bundle.get("link", []):
+        if link.get("relation") == relation:
+            return link.get("url")
+    return None
+
+
+def is_page_link(url, base_url):
+    """True if url is an absolute URL under base_url on the same server
+
+    Scheme, host, port and credentials must match exactly and the path must
+    be base_url's path or below it, without "." or ".." segments.
+    """
+    try:
+        link = urlsplit(url)
+        base = urlsplit(base_url)
+    except (TypeError, ValueError):
+        return False
+    base_path = base.path.rstrip("/")
+    segments = unquote(link.path).split("/")
+    return (
+        link.scheme in ("http", "https")
+        and link.scheme == base.scheme
+        and link.netloc == base.netloc
+        and (link.path == base_path or link.path.startswith(base_path + "/"))
+        and "." not in segments
+        and ".." not in segments
+        and not link.fragment
+    )
+
+
+def check_page_cursor(cursor, base_url):
+    """Returns a page cursor from the browser, or raises ValueError
+
+    Cursors are Bundle paging links that come back in the query string, so
+    only links on the configured FHIR server are ever fetched.
+    """
+    if not is_page_link(cursor, base_url):
+        raise ValueError("The page link does not belong to the FHIR server")
+    return cursor
+
+
+def parse_patient_page(bundle):
+    """Returns (patient ids, next cursor, previous cursor) for a Bundle page"""
+    patients = [
+        {"id": entry["resource"]["id"]}
+        for entry in bundle.get("entry", [])
+        if entry.get("resource", {}).get("id")
+    ]
+    return patients, get_link(bundle, "next"), get_link(bundle, "previous")
+
+
+def parse_search_page(bundle):
+    """Returns (resources, next cursor, previous cursor) for a Bundle page"""
+    resources = [
+        entry["resource"] for entry in bundle.get("entry", []) if "resource" in entry
+    ]
+    return resources, get_link(bundle, "next"), get_link(bundle, "previous")
+
+
+class PagePrefetcher:
+    """Fetches the next Bundle page in the background while a page renders
+
+    Prefetched pages are held per worker process and handed out once, so a
+    follow-up request served by another worker simply fetches the page itself.
+    """
+
+    def __init__(self, max_workers=PREFETCH_WORKERS, maxsize=PREFETCH_MAXSIZE):
+        self.max_workers = max_workers
+        self.maxsize = maxsize
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get_executor(self):
+        """Starts the worker threads lazily, once per forked process"""
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="fhir-prefetch"
+            )
+            self._pending.clear()
+            self._pid = os.getpid()
+        return self._executor
+
+    def prefetch(self, url, fetch, base_url):
+        """Starts fetch(url) in the background unless it is already pending
+
+        Links that are not on the FHIR server at base_url are skipped.
+        """
+        if not url or not is_page_link(url, base_url):
+            return
+        with self._lock:
+            executor = self._get_executor()
+            if url in self._pending:
+                return
+            self._pending[url] = executor.submit(fetch, url)
+            while len(self._pending) > self.maxsize:
+                self._pending.popitem(last=False)[1].cancel()
+
+    def get(self, url, fetch, base_url):
+        """Returns the prefetched page for url, or fetches it now
+
+        Raises ValueError if url is not a page link on the server at base_url.
+        """
+        check_page_cursor(url, base_url)
+        with self._lock:
+            future = self._pending.pop(url, None) if self._pid == os.getpid() else None
+        if future is not None and not future.cancelled():
+            try:
+                page = future.result(timeout=READ_TIMEOUT)
+                self.hits += 1
+                return page
+            except Exception:  # a failed prefetch is retried in the foreground
+                pass
+        self.misses += 1
+        return fetch(url)
+
+    def stats(self):
+        """Returns prefetch counters"""
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "hits": self.hits, "misses": self.misses}
+
+
+page_prefetcher = PagePrefetcher()
@@ -0,0 +1,202 @@
+import os
+import threading
+
+import requests
+from fhirpy import SyncFHIRClient
+from fhirpy.base.exceptions import (
+    MultipleResourcesFound,
+    OperationOutcome,
+    ResourceNotFound,
+)
+from fhirpy.base.utils import AttrDict
+from requests.adapters import HTTPAdapter
+
+import fhir_json
+
+
+def env_int(name, default):
+    """Reads an integer setting from the environment"""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def env_float(name, default):
+    """Reads a float setting from the environment"""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+# Pool settings, overridable per deployment through the .env file
+POOL_CONNECTIONS = env_int("FHIR_POOL_CONNECTIONS", 4)  # distinct hosts kept
+POOL_MAXSIZE = env_int("FHIR_POOL_MAXSIZE", 10)  # sockets kept per host
+POOL_BLOCK = os.getenv("FHIR_POOL_BLOCK", "False") == "True"
+CONNECT_TIMEOUT = env_float("FHIR_CONNECT_TIMEOUT", 5.0)
+READ_TIMEOUT = env_float("FHIR_READ_TIMEOUT", 30.0)
+
+
+def raise_for_status(status, raw_data):
+    """Raises the fhirpy exception matching an unsuccessful response"""
+    if status in (404, 410):
+        raise ResourceNotFound(raw_data)
+
+    if status == 412:
+        raise MultipleResourcesFound(raw_data)
+
+    try:
+        parsed_data = fhir_json.loads(raw_data)
+        if parsed_data["resourceType"] == "OperationOutcome":
+            raise OperationOutcome(resource=parsed_data)
+        raise OperationOutcome(reason=raw_data)
+    except (KeyError, fhir_json.JSONDecodeError) as exc:
+        raise OperationOutcome(reason=raw_data) from exc
+
+
+class PooledFHIRClient(SyncFHIRClient):
+    """SyncFHIRClient that sends every request through one keep-alive session"""
+
+    def __init__(self, url, pool_connections=None, pool_maxsize=None, **kwargs):
+        kwargs.setdefault(
+            "requests_config", {"timeout": (CONNECT_TIMEOUT, READ_TIMEOUT)}
+        )
+        super().__init__(url, **kwargs)
+        self.pool_maxsize = pool_maxsize or POOL_MAXSIZE
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections or POOL_CONNECTIONS,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=POOL_BLOCK,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def _send(self, method, url, headers, data=None):
+        """Sends one request on the shared session, counting it while in flight"""
+        with self._lock:
+            self._in_flight += 1
+        body = None
+        if data is not None:
+            body = fhir_json.dumps_bytes(data)
+            headers = {**headers, "Content-Type": "application/json"}
+        try:
+            return self.session.request(
+                method, url, data=body, headers=headers, **self.requests_config
+            )
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _do_request(
+        self, method, path, data=None, params=None, returning_status=False
+    ):
+        """Same contract as fhirpy's SyncClient, but reuses pooled sockets"""
+        headers = self._build_request_headers()
+        url = self._build_request_url(path, params)
+
+        r = self._send(method, url, headers, data)
+
+        if 200 <= r.status_code < 300:
+            r_data = (
+                fhir_json.loads(r.content, object_hook=AttrDict)
+                if r.content
+                else None
+            )
+            return (r_data, r.status_code) if returning_status else r_data
+
+        raise_for_status(r.status_code, r.content.decode())
+
+    def get_bundle(self, path, params=None):
+        """Fetches a searchset page as plain JSON; path may be a paging link"""
+        headers = self._build_request_headers()
+        url = self._build_request_url(path, params)
+        r = self._send("get", url, headers)
+
+        if 200 <= r.status_code < 300:
+            return fhir_json.loads(r.content)
+
+        raise_for_status(r.status_code, r.content.decode())
+
+    def send_bundle(self, bundle):
+        """Posts a batch/transaction Bundle and returns the raw response
+
+        Unlike execute() no exception is raised for an error status, so the
+        caller can decide which statuses to retry.
+        """
+        headers = self._build_request_headers()
+        return self._send("post", self._build_request_url("", None), headers, bundle)
+
+    def conditional_read(self, resource_type, resource_id, version_id=None):
+        """Reads a resource by id, returning None if version_id is still current"""
+        headers = self._build_request_headers()
+        if version_id:
+            headers["If-None-Match"] = f'W/"{version_id}"'
+        url = self._build_request_url(f"{resource_type}/{resource_id}", None)
+        r = self._send("get", url, headers)
+
+        if r.status_code == 304:
+            return None
+        if 200 <= r.status_code < 300:
+            return fhir_json.loads(r.content)
+
+        raise_for_status(r.status_code, r.content.decode())
+
+    def pool_stats(self):
+        """Returns connection counters for every host pool held by the session"""
+        hosts = []
+        for key, pool in list(self.adapter.poolmanager.pools._container.items()):
+            opened = pool.num_connections
+            requests_sent = pool.num_requests
+            hosts.append(
+                {
+                    "host": f"{key.key_scheme}://{key.key_host}:{key.key_port}",
+                    "opened": opened,
+                    "requests": requests_sent,
+                    "reused": max(requests_sent - opened, 0),
+                    "idle": sum(1 for conn in list(pool.pool.queue) if conn)
+                    if pool.pool
+                    else 0,
+                }
+            )
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "pool_maxsize": self.pool_maxsize,
+            "pool_block": POOL_BLOCK,
+            "in_flight": in_flight,
+            "waiting": max(in_flight - self.pool_maxsize, 0),
+            "opened": sum(h["opened"] for h in hosts),
+            "reused": sum(h["reused"] for h in hosts),
+            "hosts": hosts,
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = None
+
+
+def get_fhir_client(url):
+    """Returns the shared pooled client for this worker process"""
+    global _clients_pid
+
+    with _clients_lock:
+        # gunicorn forks after import, so never share sockets with the parent
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(url)
+        if client is None:
+            client = PooledFHIRClient(url)
+            _clients[url] = client
+        return client
+
+
+def pool_stats():
+    """Returns pool statistics for every client created by this worker"""
+    with _clients_lock:
+        clients = dict(_clients) if _clients_pid == os.getpid() else {}
+    return {
+        "pid": os.getpid(),
+        "clients": {url: client.pool_stats() for url, client in clients.items()},
+    }
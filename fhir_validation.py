@@ -0,0 +1,154 @@
+"""Validation tiers for FHIR resources handled as plain dicts.
+
+Building the fhir.resources model of every resource is thorough but costs
+far more than the rest of a request, and is wasted on data that came
+straight from our own FHIR server. Each call site therefore picks a tier:
+
+- "full" parses the resource with its fhir.resources model
+- "schema" checks the required fields and the JSON types of the fields
+  this application reads, without building any model
+- "none" trusts the data as it is
+
+"full" is opt-in and no call site defaults to it: fhir.resources 7 models
+FHIR R5, so resources from an R4 server fail it wherever R5 renamed a
+field (MedicationStatement.medicationCodeableConcept,
+Procedure.performedDateTime, ...). "schema" accepts both versions.
+
+Every tier raises ValueError for an invalid resource (pydantic's
+ValidationError is a ValueError too), so callers handle them alike.
+"""
+
+import os
+from types import MappingProxyType
+
+from fhir.resources import get_fhir_model_class
+
+VALIDATION_LEVELS = ("full", "schema", "none")
+
+# resource type -> {field: (JSON type, required)} for the fields read here;
+# only fields required in both R4 and R5 are marked required
+SCHEMA_FIELDS = MappingProxyType(
+    {
+        "Patient": {
+            "identifier": (list, False),
+            "active": (bool, False),
+            "name": (list, False),
+            "telecom": (list, False),
+            "gender": (str, False),
+            "birthDate": (str, False),
+            "address": (list, False),
+            "generalPractitioner": (list, False),
+            "managingOrganization": (dict, False),
+            "link": (list, False),
+            "photo": (list, False),
+        },
+        "AllergyIntolerance": {
+            "clinicalStatus": (dict, False),
+            "verificationStatus": (dict, False),
+            "code": (dict, False),
+            "patient": (dict, True),
+            "onsetDateTime": (str, False),
+            "onsetPeriod": (dict, False),
+        },
+        "MedicationStatement": {
+            "status": (str, True),
+            "medication": (dict, False),
+            "subject": (dict, True),
+            "effectiveDateTime": (str, False),
+            "effectivePeriod": (dict, False),
+            "dosage": (list, False),
+        },
+        "Condition": {
+            "clinicalStatus": (dict, False),
+            "category": (list, False),
+            "code": (dict, False),
+            "subject": (dict, True),
+            "onsetDateTime": (str, False),
+            "onsetPeriod": (dict, False),
+        },
+        "Procedure": {
+            "status": (str, True),
+            "code": (dict, False),
+            "subject": (dict, True),
+            "occurrenceDateTime": (str, False),
+            "occurrencePeriod": (dict, False),
+        },
+        "Observation": {
+            "status": (str, True),
+            "category": (list, False),
+            "code": (dict, True),
+            "subject": (dict, False),
+            "effectiveDateTime": (str, False),
+            "valueQuantity": (dict, False),
+            "valueCodeableConcept": (dict, False),
+            "valueString": (str, False),
+        },
+        "Bundle": {
+            "type": (str, True),
+            "entry": (list, False),
+        },
+    }
+)
+COMMON_FIELDS = MappingProxyType({"id": (str, False), "meta": (dict, False)})
+
+
+def get_validation_level(name, default):
+    """Reads a validation tier setting from the environment"""
+    level = os.getenv(name) or default
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"Unknown validation level for {name}: {level}")
+    return level
+
+
+def check_fields(resource, fields):
+    for field, (expected, required) in fields.items():
+        value = resource.get(field)
+        if value is None:
+            if required:
+                raise ValueError(f"{resource['resourceType']}.{field} is required")
+        elif not isinstance(value, expected):
+            raise ValueError(
+                f"{resource['resourceType']}.{field} must be a {expected.__name__}, "
+                f"not {type(value).__name__}"
+            )
+
+
+def check_schema(resource):
+    """Raises ValueError if required fields are missing or have the wrong type
+
+    Resource types without rules only get the checks common to all resources.
+    """
+    if not isinstance(resource, dict):
+        raise ValueError("not a FHIR resource")
+    resource_type = resource.get("resourceType")
+    if not isinstance(resource_type, str) or not resource_type:
+        raise ValueError("resourceType is required")
+    check_fields(resource, COMMON_FIELDS)
+    fields = SCHEMA_FIELDS.get(resource_type)
+    if fields:
+        check_fields(resource, fields)
+
+
+def validate_resource(resource, level="schema"):
+    """Validates one resource dict at the given tier"""
+    if level == "none":
+        return
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"Unknown validation level: {level}")
+    check_schema(resource)
+    if level == "full":
+        get_fhir_model_class(resource["resourceType"]).parse_obj(resource)
+
+
+def validate_bundle(bundle, level="schema"):
+    """Validates a Bundle and every resource in it at the given tier
+
+    The Bundle itself only gets the schema check, so a full validation
+    builds each resource's model once rather than again inside the Bundle.
+    """
+    if level == "none":
+        return
+    check_schema(bundle)
+    for entry in bundle.get("entry", []):
+        if "resource" in entry:
+            validate_resource(entry["resource"], level)
@@ -0,0 +1,9 @@
+"""gunicorn settings, read automatically from the working directory."""
+
+
+def post_worker_init(worker):
+    """Compile and render the templates before the worker takes traffic"""
+    import app
+
+    if app.TEMPLATE_WARMUP:
+        app.warm_templates()
@@ -0,0 +1,75 @@
+import os
+
+from cache_backends import create_cache
+from fhir_pool import env_float, env_int
+
+PATIENT_CACHE_SIZE = env_int("PATIENT_CACHE_SIZE", 1024)
+PATIENT_CACHE_TTL = env_float("PATIENT_CACHE_TTL", 60.0)  # seconds
+# "memory" keeps a copy per worker, "sqlite" shares one file between workers
+PATIENT_CACHE_BACKEND = os.getenv("PATIENT_CACHE_BACKEND", "memory")
+PATIENT_CACHE_PATH = os.getenv("PATIENT_CACHE_PATH")
+
+
+class PatientCache:
+    """Read-through cache of Patient JSON keyed by id and meta.versionId
+
+    Returned dicts are shared between requests and must be treated as
+    read-only.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.revalidated = 0
+
+    def lookup(self, patient_id, version_id=None):
+        """Returns the cached Patient if it is fresh or matches version_id"""
+        patient_json, fresh = self.entries.get(patient_id)
+        if patient_json is None:
+            return None
+        if fresh or (version_id and version_id == get_version_id(patient_json)):
+            return patient_json
+        return None
+
+    def get_patient(self, client, patient_id):
+        """Returns the Patient from cache, revalidating stale entries upstream"""
+        patient_json, fresh = self.entries.get(patient_id)
+        if patient_json is not None and fresh:
+            return patient_json
+
+        version_id = get_version_id(patient_json) if patient_json else None
+        updated_json = client.conditional_read("Patient", patient_id, version_id)
+        if updated_json is None:
+            # 304 Not Modified, the stale copy is still the current version
+            self.revalidated += 1
+            self.entries.touch(patient_id)
+            return patient_json
+
+        self.store(updated_json)
+        return updated_json
+
+    def store(self, patient_json):
+        """Caches a Patient returned by the server after a read or a write"""
+        if patient_json and patient_json.get("id"):
+            self.entries.set(patient_json["id"], patient_json)
+
+    def invalidate(self, patient_id):
+        """Drops a Patient so the next read goes upstream"""
+        self.entries.delete(patient_id)
+
+    def stats(self):
+        """Returns cache statistics"""
+        stats = self.entries.stats()
+        stats["revalidated"] = self.revalidated
+        return stats
+
+
+def get_version_id(patient_json):
+    """Returns the meta.versionId of a resource, if any"""
+    return (patient_json.get("meta") or {}).get("versionId")
+
+
+patient_cache = PatientCache(
+    create_cache(
+        PATIENT_CACHE_BACKEND, PATIENT_CACHE_SIZE, PATIENT_CACHE_TTL, PATIENT_CACHE_PATH
+    )
+)
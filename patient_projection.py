@@ -0,0 +1,257 @@
+"""Single pass projection of a FHIR Patient into the summary page fields.
+
+project_patient() reads each top level Patient element once and indexes
+shared sub-elements such as contact[0] and telecom only once, where the old
+per-field extract_* helpers re-walked the Patient for every field. A field
+whose data is missing or malformed keeps its value from PATIENT_DEFAULTS.
+"""
+
+OWN_PREFIX_URL = "http://hl7.org/fhir/StructureDefinition/humanname-own-prefix"
+
+# Value shown for each summary field when the Patient does not provide it
+PATIENT_DEFAULTS = {
+    "id": None,
+    "name": None,
+    "identifier": "N/A",
+    "birth_date": "N/A",
+    "gender": "N/A",
+    "address": "N/A",
+    "phone": "N/A",
+    "email": "N/A",
+    "source": "N/A",
+    "versionId": "N/A",
+    "last_updated": "N/A",
+    "profile": "",
+    "active": "N/A",
+    "marital_status": "N/A",
+    "deceased": "N/A",
+    "deceased_age": "N/A",
+    "multiple_birth": "N/A",
+    "multiple_birth_integer": "N/A",
+    "communication": "N/A",
+    "contact": "N/A",
+    "contact_relationship": "N/A",
+    "contact_address": "N/A",
+    "contact_phone": "N/A",
+    "contact_email": "N/A",
+    "general_practitioner": "N/A",
+    "managing_organization": "N/A",
+    "link": "N/A",
+    "photo": "N/A",
+    "text": "N/A",
+}
+
+# Raised by malformed data, e.g. a dict where FHIR has a list
+_ERRORS = (AttributeError, IndexError, KeyError, TypeError)
+_MISSING = object()
+
+
+def project_patient(patient_id, patient_json):
+    """Returns the summary page fields of a Patient in one pass over its JSON"""
+    patient_data = PATIENT_DEFAULTS.copy()
+    patient_data["id"] = patient_id
+    get = patient_json.get
+
+    names = get("name", _MISSING)
+    if names is not _MISSING:
+        try:
+            name = names[0]
+            first_name = name.get("given", [""])[0]
+            last_name = name.get("family", "")
+            official_name = name.get("use", "")
+            if official_name:
+                patient_data["name"] = (
+                    f"{first_name} {last_name} ({official_name})".strip()
+                )
+            else:
+                patient_data["name"] = f"{first_name} {last_name}".strip()
+        except _ERRORS:
+            pass
+
+    identifiers = get("identifier", _MISSING)
+    if identifiers is not _MISSING:
+        try:
+            patient_data["identifier"] = ", ".join(
+                [
+                    f"{identifier.get('system', '')} - {identifier.get('value', '')}"
+                    for identifier in identifiers
+                ]
+            ) or "N/A"
+        except _ERRORS:
+            pass
+
+    patient_data["birth_date"] = get("birthDate", "N/A")
+    patient_data["gender"] = get("gender", "N/A")
+
+    addresses = get("address", _MISSING)
+    if addresses is not _MISSING:
+        try:
+            address = addresses[0]
+            line = address.get("line", [""])[0]
+            city = address.get("city", "")
+            state = address.get("state", "")
+            postal = address.get("postalCode", "")
+            address_use = address.get("use", "")
+            if address_use:
+                patient_data["address"] = (
+                    f"{line}, {city}, {state} {postal} ({address_use})".strip(", ")
+                )
+            else:
+                patient_data["address"] = f"{line}, {city}, {state} {postal}".strip(
+                    ", "
+                )
+        except _ERRORS:
+            pass
+
+    telecoms = get("telecom", _MISSING)
+    if telecoms is not _MISSING:
+        for field, index in (("phone", 0), ("email", 1)):
+            try:
+                telecom = telecoms[index]
+                patient_data[field] = (
+                    telecom.get("value", "N/A") + f" ({telecom.get('use', '')})"
+                )
+            except _ERRORS:
+                pass
+
+    meta = get("meta", _MISSING)
+    if meta is not _MISSING:
+        try:
+            patient_data["source"] = meta.get("source", "N/A")
+            patient_data["versionId"] = meta.get("versionId", "N/A")
+            patient_data["last_updated"] = meta.get("lastUpdated", "N/A")
+            profile_urls = meta.get("profile", _MISSING)
+            if profile_urls is not _MISSING:
+                patient_data["profile"] = " ".join(
+                    [
+                        f'<a href="{url}" target="_blank">{url}</a>'
+                        for url in profile_urls
+                    ]
+                )
+        except _ERRORS:
+            pass
+
+    patient_data["active"] = get("active", "N/A")
+
+    marital_status = get("maritalStatus", _MISSING)
+    if marital_status is not _MISSING:
+        try:
+            patient_data["marital_status"] = marital_status["coding"][0]["display"]
+        except _ERRORS:
+            pass
+
+    patient_data["deceased"] = get("deceasedDateTime", "N/A")
+    patient_data["deceased_age"] = get("deceasedAge", "N/A")
+    patient_data["multiple_birth"] = get("multipleBirthBoolean", "N/A")
+    patient_data["multiple_birth_integer"] = get("multipleBirthInteger", "N/A")
+
+    languages = get("communication", _MISSING)
+    if languages is not _MISSING:
+        try:
+            language_list = []
+            for language in languages:
+                language_code = (
+                    language.get("language", {})
+                    .get("coding", [{}])[0]
+                    .get("display", "N/A")
+                )
+                preferred_text = (
+                    " (preferred)" if language.get("preferred", False) else ""
+                )
+                language_list.append(f"{language_code}{preferred_text}")
+            patient_data["communication"] = ", ".join(language_list) or "N/A"
+        except _ERRORS:
+            pass
+
+    contacts = get("contact", _MISSING)
+    if contacts is not _MISSING:
+        try:
+            contact = contacts[0]
+        except _ERRORS:
+            contact = _MISSING
+        if contact is not _MISSING:
+            _project_contact(contact, patient_data)
+
+    general_practitioners = get("generalPractitioner", _MISSING)
+    if general_practitioners is not _MISSING:
+        try:
+            patient_data["general_practitioner"] = general_practitioners[0][
+                "reference"
+            ]
+        except _ERRORS:
+            pass
+
+    managing_organization = get("managingOrganization", _MISSING)
+    if managing_organization is not _MISSING:
+        try:
+            patient_data["managing_organization"] = managing_organization[
+                "reference"
+            ]
+        except _ERRORS:
+            pass
+
+    patient_data["link"] = get("link", "N/A")
+    patient_data["photo"] = get("photo", "N/A")
+
+    text = get("text", _MISSING)
+    if text is not _MISSING:
+        try:
+            patient_data["text"] = text["div"]
+        except _ERRORS:
+            pass
+
+    return patient_data
+
+
+def _project_contact(contact, patient_data):
+    """Fills the contact_* fields from the Patient's first contact"""
+    try:
+        contact_name = contact.get("name", {})
+        family_name = contact_name.get("family", "")
+        given_name = contact_name.get("given", [""])[0]
+        value_string = ""
+        for ext in contact_name.get("_family", {}).get("extension", ()):
+            if ext.get("url") == OWN_PREFIX_URL:
+                value_string = ext.get("valueString", "")
+                break
+        patient_data["contact"] = f"{value_string} {given_name} {family_name}".strip()
+    except _ERRORS:
+        pass
+
+    try:
+        patient_data["contact_relationship"] = (
+            contact.get("relationship", [{}])[0]
+            .get("coding", [{}])[0]
+            .get("display", "N/A")
+        )
+    except _ERRORS:
+        pass
+
+    try:
+        address = contact.get("address", {})
+        # edited Patients store the contact address as a list
+        if isinstance(address, list):
+            address = address[0] if address else {}
+        line = address.get("line", [""])[0]
+        city = address.get("city", "")
+        state = address.get("state", "")
+        postal_code = address.get("postalCode", "")
+        address_use = address.get("use", "")
+        patient_data["contact_address"] = (
+            f"{line}, {city}, {state} {postal_code} ({address_use})".strip(", ")
+        )
+    except _ERRORS:
+        pass
+
+    try:
+        telecoms = contact.get("telecom", [])
+    except _ERRORS:
+        return
+    for field, index in (("contact_phone", 0), ("contact_email", 1)):
+        try:
+            telecom = telecoms[index]
+            patient_data[field] = (
+                f"{telecom.get('value', '')} ({telecom.get('use', '')})"
+            )
+        except _ERRORS:
+            pass
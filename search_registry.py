@@ -0,0 +1,75 @@
+from types import MappingProxyType
+
+# resource type -> ((FHIR search parameter, search form field), ...)
+# To support a new resource type, add its entry here and its form section
+# to fhir_patient_search.html.
+SEARCH_SCHEMAS = MappingProxyType(
+    {
+        "Patient": (
+            ("_id", "id"),
+            ("given", "given"),
+            ("family", "family"),
+            ("birthdate", "birthdate"),
+        ),
+        "Practitioner": (
+            ("_id", "practitioner_id"),
+            ("given", "practitioner_given"),
+            ("family", "practitioner_family"),
+            ("address-city", "practitioner_city"),
+        ),
+        "Observation": (
+            ("_id", "observation_id"),
+            ("code", "observation_code"),
+            ("performer", "observation_performer"),
+        ),
+        "Medication": (
+            ("_id", "medication_id"),
+            ("lot-number", "lot_number"),
+            ("ingredient-code", "ingredient_code"),
+            ("identifier", "medication_name"),
+            ("form", "dose_form"),
+        ),
+        "MedicationRequest": (
+            ("_id", "medication_request_id"),
+            ("status", "medication_request_status"),
+            ("medication", "medication_request_medication"),
+            ("patient", "medication_request_patient"),
+        ),
+        "MedicationDispense": (
+            ("_id", "medication_dispense_id"),
+            ("status", "medication_dispense_status"),
+            ("medication", "medication_dispense_medication"),
+            ("patient", "medication_dispense_patient"),
+        ),
+        "MessageHeader": (
+            ("_id", "message_header_id"),
+            ("destination", "message_header_destination"),
+            ("source", "message_header_source"),
+            ("author", "message_header_author"),
+            ("event", "message_header_event"),
+        ),
+        "ImagingStudy": (
+            ("_id", "imaging_study_id"),
+            ("patient", "imaging_study_patient"),
+            ("modality", "imaging_study_modality"),
+            ("series", "imaging_study_series"),
+            ("started", "imaging_study_started"),
+        ),
+    }
+)
+
+
+def get_search_params(resource_type, form_data):
+    """Reads the non-empty search fields of one resource type from the form
+
+    Returns None if the resource type is not supported.
+    """
+    schema = SEARCH_SCHEMAS.get(resource_type)
+    if schema is None:
+        return None
+    search_params = {}
+    for param, field in schema:
+        value = form_data.get(field)
+        if value:
+            search_params[param] = value
+    return search_params
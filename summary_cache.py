@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+from cache_backends import create_cache
+from fhir_pool import env_int
+from patient_cache import get_version_id
+
+SUMMARY_CACHE_SIZE = env_int("SUMMARY_CACHE_SIZE", 1024)
+# "memory" keeps a copy per worker, "sqlite" shares one file between workers
+SUMMARY_CACHE_BACKEND = os.getenv("SUMMARY_CACHE_BACKEND", "memory")
+# fragments are rendered unescaped, so the file must be private to this user
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH")
+# A Patient version never changes, so entries only leave the cache by eviction
+NEVER_STALE = 365 * 24 * 3600.0
+
+
+class SummaryFragmentCache:
+    """Cache of rendered patient summary HTML keyed by id and meta.versionId
+
+    Each fragment is stored with a strong ETag, a digest of the page
+    version and the fragment, so an unchanged Patient can be answered with
+    304 Not Modified before anything is rendered.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_fragment(self, patient_id, patient_json, page_version, render):
+        """Returns (html, etag) from cache, or renders and caches the fragment
+
+        render(patient_id, patient_json) builds the HTML. Patients without a
+        versionId are rendered every time, since nothing identifies their
+        content cheaply.
+        """
+        version_id = get_version_id(patient_json)
+        key = f"{patient_id}/_history/{version_id}/{page_version}"
+        if version_id:
+            fragment, _ = self.entries.get(key)
+            if fragment is not None:
+                return fragment["html"], fragment["etag"]
+
+        html = render(patient_id, patient_json)
+        etag = hashlib.sha256(f"{page_version}\n{html}".encode("utf-8")).hexdigest()
+        if version_id:
+            self.entries.set(key, {"html": html, "etag": etag})
+        return html, etag
+
+    def stats(self):
+        """Returns cache statistics"""
+        return self.entries.stats()
+
+
+summary_fragment_cache = SummaryFragmentCache(
+    create_cache(
+        SUMMARY_CACHE_BACKEND,
+        SUMMARY_CACHE_SIZE,
+        NEVER_STALE,
+        SUMMARY_CACHE_PATH,
+        filename="fhir_summary_cache.db",
+    )
+)
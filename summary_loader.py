@@ -0,0 +1,126 @@
+import asyncio
+import os
+
+from fhir_paging import check_page_cursor, get_link
+from fhir_pool import env_float, env_int
+from fhir_validation import get_validation_level, validate_resource
+
+# The clinical resources modelled by create_sample_patient_record
+SUMMARY_RESOURCE_TYPES = (
+    "AllergyIntolerance",
+    "MedicationStatement",
+    "Condition",
+    "Procedure",
+)
+SUMMARY_DEADLINE = env_float("SUMMARY_DEADLINE", 10.0)  # seconds for all calls
+SUMMARY_PAGE_SIZE = env_int("SUMMARY_PAGE_SIZE", 100)
+# "True" asks the server for Patient/$everything instead of one search per type
+SUMMARY_USE_EVERYTHING = os.getenv("SUMMARY_USE_EVERYTHING", "False") == "True"
+# resources come from our own server, so they are trusted by default
+SUMMARY_VALIDATION = get_validation_level("SUMMARY_VALIDATION", "none")
+
+
+def summary_requests(patient_id, use_everything=SUMMARY_USE_EVERYTHING):
+    """Returns {name: (path, params)} for the calls that make up a summary"""
+    if use_everything:
+        return {
+            "$everything": (
+                f"Patient/{patient_id}/$everything",
+                {"_count": SUMMARY_PAGE_SIZE},
+            )
+        }
+    calls = {"Patient": ("Patient", {"_id": patient_id})}
+    for resource_type in SUMMARY_RESOURCE_TYPES:
+        calls[resource_type] = (
+            resource_type,
+            {"patient": patient_id, "_count": SUMMARY_PAGE_SIZE},
+        )
+    return calls
+
+
+async def get_all_pages(client, path, params):
+    """Fetches a search and every page after it as one searchset Bundle
+
+    next links are only followed on the client's own server; any other
+    link raises ValueError, so the call is reported as incomplete.
+    """
+    bundle = await client.get_bundle(path, params)
+    entries = list(bundle.get("entry", []))
+    next_page = get_link(bundle, "next")
+    while next_page:
+        page = await client.get_bundle(check_page_cursor(next_page, client.url))
+        entries.extend(page.get("entry", []))
+        next_page = get_link(page, "next")
+    return {**bundle, "entry": entries}
+
+
+async def load_patient_summary(
+    client, patient_id, deadline=SUMMARY_DEADLINE, use_everything=None
+):
+    """Loads a Patient and its clinical resources concurrently as one Bundle
+
+    All calls share one deadline, so the load takes about as long as the
+    slowest call. Each call follows its search's next links, so no page
+    is left out. Calls that fail or miss the deadline are listed under
+    "incomplete" and their resources are left out.
+    """
+    if use_everything is None:
+        use_everything = SUMMARY_USE_EVERYTHING
+    calls = summary_requests(patient_id, use_everything)
+    tasks = {
+        asyncio.ensure_future(get_all_pages(client, path, params)): name
+        for name, (path, params) in calls.items()
+    }
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+
+    pages = {}
+    incomplete = [tasks[task] for task in pending]
+    for task in done:
+        if task.exception() is not None:
+            incomplete.append(tasks[task])
+        else:
+            pages[tasks[task]] = task.result()
+
+    return assemble_summary_bundle(patient_id, calls, pages, sorted(incomplete))
+
+
+def assemble_summary_bundle(
+    patient_id, calls, pages, incomplete, validation=SUMMARY_VALIDATION
+):
+    """Merges the search pages into one collection Bundle, Patient first
+
+    Resources that fail validation at the given tier are left out and
+    their call is listed under "incomplete".
+    """
+    entries = []
+    seen = set()
+    invalid = set()
+    for name in calls:
+        for entry in pages.get(name, {}).get("entry", []):
+            resource = entry.get("resource")
+            if not resource:
+                continue
+            try:
+                validate_resource(resource, validation)
+            except ValueError:
+                invalid.add(name)
+                continue
+            key = (resource.get("resourceType"), resource.get("id"))
+            if key in seen:
+                continue
+            seen.add(key)
+            entries.append({"resource": resource})
+    entries.sort(key=lambda entry: entry["resource"].get("resourceType") != "Patient")
+
+    bundle = {
+        "resourceType": "Bundle",
+        "id": patient_id,
+        "type": "collection",
+        "entry": entries,
+    }
+    incomplete = sorted(set(incomplete) | invalid)
+    if incomplete:
+        bundle["incomplete"] = incomplete
+    return bundle
@@ -0,0 +1,296 @@
+"""Seeded synthetic patient bundles for load tests and fixtures.
+
+Bundles are built as plain dicts straight from small code tables, without
+fhir.resources models or a JSON round trip, so generating them costs little
+more than allocating the dicts. The same seed always gives the same
+bundles. validate=True parses every resource with its fhir.resources model
+for correctness checks, at a large cost in speed.
+
+    python synthetic_bundles.py --count 1000 --conditions 20 --out bundles.ndjson
+    python synthetic_bundles.py --count 1000 --resources --out resources.ndjson
+
+The first form writes one Bundle per line for batch_cda.py, the second one
+resource per line for bulk_import.py.
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import fhir_json
+from fhir_validation import validate_bundle
+
+SNOMED = "http://snomed.info/sct"
+RXNORM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+LOINC = "http://loinc.org"
+UCUM = "http://unitsofmeasure.org"
+
+FAMILY_NAMES = ("Doe", "Smith", "Garcia", "Nguyen", "Müller", "Rossi", "Kowalski", "Dubois")
+GIVEN_NAMES = {
+    "female": ("Jane", "Maria", "Anna", "Sofia", "Emma", "Lucía"),
+    "male": ("John", "Luca", "Jan", "Pierre", "Noah", "Mateo"),
+}
+CITIES = (
+    ("Springfield", "IL", "62701"),
+    ("Portland", "OR", "97201"),
+    ("Austin", "TX", "73301"),
+    ("Boston", "MA", "02108"),
+)
+
+# (code, display) per resource type
+ALLERGY_CODES = (
+    ("91936005", "Allergy to penicillin"),
+    ("300913006", "Shellfish allergy"),
+    ("91934008", "Allergy to nut"),
+    ("418689008", "Allergy to grass pollen"),
+    ("294505008", "Allergy to amoxicillin"),
+)
+MEDICATION_CODES = (
+    ("313782", "Amoxicillin 500 MG Oral Tablet"),
+    ("197361", "Amlodipine 5 MG Oral Tablet"),
+    ("860975", "Metformin 500 MG Oral Tablet"),
+    ("314076", "Lisinopril 10 MG Oral Tablet"),
+    ("617311", "Atorvastatin 20 MG Oral Tablet"),
+)
+CONDITION_CODES = (
+    ("36971009", "Bacterial infection"),
+    ("38341003", "Hypertensive disorder"),
+    ("44054006", "Diabetes mellitus type 2"),
+    ("195967001", "Asthma"),
+    ("55822004", "Hyperlipidemia"),
+)
+PROCEDURE_CODES = (
+    ("233258006", "Balloon angioplasty of artery"),
+    ("80146002", "Appendectomy"),
+    ("73761001", "Colonoscopy"),
+    ("274025005", "Colonic polypectomy"),
+)
+# (code, display, unit, low, high)
+OBSERVATION_CODES = (
+    ("8867-4", "Heart rate", "/min", 50, 110),
+    ("8310-5", "Body temperature", "Cel", 36, 39),
+    ("29463-7", "Body weight", "kg", 45, 120),
+    ("2339-0", "Glucose [Mass/volume] in Blood", "mg/dL", 70, 180),
+    ("8480-6", "Systolic blood pressure", "mm[Hg]", 100, 160),
+)
+
+EPOCH = date(1940, 1, 1)
+
+
+def random_date(rng, start=EPOCH, days=30000):
+    return (start + timedelta(days=rng.randrange(days))).isoformat()
+
+
+def concept(system, code, display):
+    return {"coding": [{"system": system, "code": code, "display": display}], "text": display}
+
+
+def status_concept(system, code):
+    return {"coding": [{"system": system, "code": code}]}
+
+
+def make_patient(rng, patient_id):
+    gender = rng.choice(("female", "male"))
+    city, state, postal_code = rng.choice(CITIES)
+    return {
+        "resourceType": "Patient",
+        "id": patient_id,
+        "name": [
+            {
+                "use": "official",
+                "family": rng.choice(FAMILY_NAMES),
+                "given": [rng.choice(GIVEN_NAMES[gender])],
+            }
+        ],
+        "telecom": [
+            {"system": "phone", "value": f"555-{rng.randrange(10000):04d}", "use": "home"}
+        ],
+        "gender": gender,
+        "birthDate": random_date(rng),
+        "address": [
+            {
+                "use": "home",
+                "line": [f"{rng.randrange(1, 1000)} Main St"],
+                "city": city,
+                "state": state,
+                "postalCode": postal_code,
+            }
+        ],
+    }
+
+
+def make_allergy(rng, resource_id, subject):
+    code, display = rng.choice(ALLERGY_CODES)
+    return {
+        "resourceType": "AllergyIntolerance",
+        "id": resource_id,
+        "clinicalStatus": status_concept(
+            "http://terminology.hl7.org/CodeSystem/allergyintolerance-clinical", "active"
+        ),
+        "verificationStatus": status_concept(
+            "http://terminology.hl7.org/CodeSystem/allergyintolerance-verification",
+            "confirmed",
+        ),
+        "code": concept(SNOMED, code, display),
+        "patient": {"reference": subject},
+        "onsetDateTime": random_date(rng, date(2000, 1, 1), 9000),
+    }
+
+
+def make_medication(rng, resource_id, subject):
+    code, display = rng.choice(MEDICATION_CODES)
+    return {
+        "resourceType": "MedicationStatement",
+        "id": resource_id,
+        "status": rng.choice(("recorded", "entered-in-error", "draft")),
+        "medication": {"concept": concept(RXNORM, code, display)},
+        "subject": {"reference": subject},
+        "effectivePeriod": {"start": random_date(rng, date(2000, 1, 1), 9000)},
+        "dosage": [{"text": f"{display}, once daily"}],
+    }
+
+
+def make_condition(rng, resource_id, subject):
+    code, display = rng.choice(CONDITION_CODES)
+    return {
+        "resourceType": "Condition",
+        "id": resource_id,
+        "clinicalStatus": status_concept(
+            "http://terminology.hl7.org/CodeSystem/condition-clinical",
+            rng.choice(("active", "resolved", "inactive")),
+        ),
+        "category": [
+            status_concept(
+                "http://terminology.hl7.org/CodeSystem/condition-category",
+                "problem-list-item",
+            )
+        ],
+        "code": concept(SNOMED, code, display),
+        "subject": {"reference": subject},
+        "onsetDateTime": random_date(rng, date(2000, 1, 1), 9000),
+    }
+
+
+def make_procedure(rng, resource_id, subject):
+    code, display = rng.choice(PROCEDURE_CODES)
+    return {
+        "resourceType": "Procedure",
+        "id": resource_id,
+        "status": "completed",
+        "code": concept(SNOMED, code, display),
+        "subject": {"reference": subject},
+        "occurrenceDateTime": random_date(rng, date(2000, 1, 1), 9000),
+    }
+
+
+def make_observation(rng, resource_id, subject):
+    code, display, unit, low, high = rng.choice(OBSERVATION_CODES)
+    return {
+        "resourceType": "Observation",
+        "id": resource_id,
+        "status": "final",
+        "category": [
+            status_concept(
+                "http://terminology.hl7.org/CodeSystem/observation-category", "vital-signs"
+            )
+        ],
+        "code": concept(LOINC, code, display),
+        "subject": {"reference": subject},
+        "effectiveDateTime": random_date(rng, date(2000, 1, 1), 9000),
+        "valueQuantity": {
+            "value": round(rng.uniform(low, high), 1),
+            "unit": unit,
+            "system": UCUM,
+            "code": unit,
+        },
+    }
+
+
+# count argument -> (id prefix, factory)
+RESOURCE_FACTORIES = {
+    "allergies": ("allergy", make_allergy),
+    "medications": ("med", make_medication),
+    "conditions": ("condition", make_condition),
+    "procedures": ("procedure", make_procedure),
+    "observations": ("obs", make_observation),
+}
+
+
+def generate_bundle(rng, validate=False, **counts):
+    """Returns one collection Bundle for a new patient
+
+    counts gives the number of each resource, keyed like
+    RESOURCE_FACTORIES (allergies, medications, ...); missing keys mean 1.
+    """
+    patient_id = f"{rng.getrandbits(48):012x}"
+    subject = f"Patient/{patient_id}"
+    entry = [{"resource": make_patient(rng, patient_id)}]
+    for name, (prefix, factory) in RESOURCE_FACTORIES.items():
+        for i in range(counts.get(name, 1)):
+            resource = factory(rng, f"{patient_id}-{prefix}{i + 1}", subject)
+            entry.append({"resource": resource})
+    bundle = {
+        "resourceType": "Bundle",
+        "id": patient_id,
+        "type": "collection",
+        "entry": entry,
+    }
+    if validate:
+        validate_bundle(bundle, "full")
+    return bundle
+
+
+def iter_bundles(count, seed=0, validate=False, **counts):
+    """Yields count bundles; the same seed always yields the same bundles"""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield generate_bundle(rng, validate, **counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100, help="bundles to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    for name in RESOURCE_FACTORIES:
+        parser.add_argument(
+            f"--{name}", type=int, default=1, help=f"{name} per patient (default 1)"
+        )
+    parser.add_argument(
+        "--resources",
+        action="store_true",
+        help="write one resource per line instead of one Bundle per line",
+    )
+    parser.add_argument(
+        "--validate", action="store_true", help="check every resource with fhir.resources"
+    )
+    parser.add_argument("--out", default="-", help="NDJSON output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    counts = {name: getattr(args, name) for name in RESOURCE_FACTORIES}
+    output = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    started = time.perf_counter()
+    resources = 0
+    try:
+        for bundle in iter_bundles(args.count, args.seed, args.validate, **counts):
+            resources += len(bundle["entry"])
+            if args.resources:
+                for entry in bundle["entry"]:
+                    output.write(fhir_json.dumps(entry["resource"]) + "\n")
+            else:
+                output.write(fhir_json.dumps(bundle) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(
+        f"Generated {args.count} bundles, {resources} resources in {elapsed:.2f}s "
+        f"({resources / elapsed:.0f} resources/sec)",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
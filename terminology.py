@@ -0,0 +1,240 @@
+"""Code tables used to build FHIR resources and CDA documents.
+
+The eHDSI header codes (static/codes/ehdsi.json) and the IHE section codes
+(static/codes/ihe-sections.json) are loaded once into immutable lookup
+tables. The files are checked for changes at most every
+TERMINOLOGY_RELOAD_INTERVAL seconds, so edits are picked up by running
+workers without a restart.
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+from types import MappingProxyType
+
+import fhir_json
+from fhir_pool import env_float
+
+CODES_DIR = Path(__file__).resolve().parent / "static" / "codes"
+EHDSI_PATH = CODES_DIR / "ehdsi.json"
+IHE_SECTIONS_PATH = CODES_DIR / "ihe-sections.json"
+TERMINOLOGY_RELOAD_INTERVAL = env_float("TERMINOLOGY_RELOAD_INTERVAL", 2.0)
+
+# display name (lower case) -> ISO 639-1 code
+LANGUAGE_CODES = MappingProxyType(
+    {
+        "english": "en",
+        "french": "fr",
+        "german": "de",
+        "spanish": "es",
+        "italian": "it",
+        "portuguese": "pt",
+        "romanian": "ro",
+        "dutch": "nl",
+        "swedish": "sv",
+        "danish": "da",
+        "norwegian": "no",
+        "russian": "ru",
+        "polish": "pl",
+        "czech": "cs",
+        "slovak": "sk",
+        "bulgarian": "bg",
+        "serbian": "sr",
+        "croatian": "hr",
+        "slovenian": "sl",
+        "latvian": "lv",
+        "lithuanian": "lt",
+        "greek": "el",
+        "finnish": "fi",
+        "hungarian": "hu",
+        "estonian": "et",
+    }
+)
+LANGUAGE_DISPLAYS = MappingProxyType(
+    {code: display.capitalize() for display, code in LANGUAGE_CODES.items()}
+)
+
+# display name -> HL7 v2 contact role code (Patient.contact.relationship)
+RELATIONSHIP_CODES = MappingProxyType(
+    {
+        "Billing contact person": "BP",
+        "Contact person": "CP",
+        "Emergency contact person": "EP",
+        "Person preparing referral": "PR",
+        "Employer": "E",
+        "Emergency Contact": "C",
+        "Federal Agency": "F",
+        "Insurance Company": "I",
+        "Next-of-Kin": "N",
+        "State Agency": "S",
+        "Unknown": "U",
+    }
+)
+RELATIONSHIP_DISPLAYS = MappingProxyType(
+    {code: display for display, code in RELATIONSHIP_CODES.items()}
+)
+
+# FHIR resource type -> section_title in ihe-sections.json
+SECTION_RESOURCE_TYPES = MappingProxyType(
+    {
+        "AllergyIntolerance": "Allergies",
+        "MedicationStatement": "Medications",
+        "Condition": "Problems List",
+        "Procedure": "Procedures",
+        "DeviceUseStatement": "Devices",
+        "Immunization": "Immunizations",
+        "Observation": "Vital Signs",
+    }
+)
+
+TerminologyTables = namedtuple(
+    "TerminologyTables",
+    [
+        "version",
+        "head",
+        "head_type_id",
+        "confidentiality",
+        "custodian",
+        "sections",
+        "sections_by_code",
+        "sections_by_resource_type",
+    ],
+)
+
+
+def load_tables(version, ehdsi_path=EHDSI_PATH, sections_path=IHE_SECTIONS_PATH):
+    """Reads both code files into one immutable TerminologyTables snapshot"""
+    with open(ehdsi_path, "rb") as json_file:
+        ehdsi = fhir_json.loads(json_file.read())
+    with open(sections_path, "rb") as json_file:
+        sections = fhir_json.loads(json_file.read())["sections"]
+
+    sections_by_title = {
+        section["section_title"]: MappingProxyType(section) for section in sections
+    }
+    return TerminologyTables(
+        version=version,
+        head=tuple(
+            (
+                p["codeElement"][0]["displayName"],
+                p["codeElement"][0]["code"],
+                p["codeElement"][0]["codeSystem"],
+                p["codeElement"][0]["codeSystemName"],
+            )
+            for p in ehdsi["rootDirectory"]
+        ),
+        head_type_id=tuple(
+            (p["typeId"][0]["extension"], p["typeId"][0]["root"])
+            for p in ehdsi["rootDirectory"]
+        ),
+        confidentiality=tuple(
+            (p["confidentiality"], p["codeSystem"], p["displayName"])
+            for p in ehdsi["confidentialityCode"]
+        ),
+        custodian=tuple(
+            (
+                p["title"],
+                p["oid"],
+                p["address"],
+                p["city"],
+                p["county"],
+                p["postalCode"],
+                p["country"],
+                p["phone"],
+                p["use"],
+                p["email"],
+                p["website"],
+            )
+            for p in ehdsi["custodian"]
+        ),
+        sections=MappingProxyType(sections_by_title),
+        sections_by_code=MappingProxyType(
+            {section["code"]: section for section in sections_by_title.values()}
+        ),
+        sections_by_resource_type=MappingProxyType(
+            {
+                resource_type: sections_by_title[title]
+                for resource_type, title in SECTION_RESOURCE_TYPES.items()
+                if title in sections_by_title
+            }
+        ),
+    )
+
+
+class TerminologyRegistry:
+    """Serves the current code tables and reloads them when the files change
+
+    A reload swaps in a complete new snapshot, so readers never see a half
+    loaded table. If a changed file cannot be parsed the previous snapshot
+    stays in use and the reload is retried on the next check.
+    """
+
+    def __init__(
+        self,
+        paths=(EHDSI_PATH, IHE_SECTIONS_PATH),
+        reload_interval=TERMINOLOGY_RELOAD_INTERVAL,
+    ):
+        self.paths = tuple(paths)
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._tables = None
+        self._mtimes = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def _get_mtimes(self):
+        return tuple(os.stat(path).st_mtime_ns for path in self.paths)
+
+    @property
+    def tables(self):
+        """Returns the current TerminologyTables, reloading them if stale"""
+        now = time.monotonic()
+        if self._tables is not None and now - self._checked_at < self.reload_interval:
+            return self._tables
+        with self._lock:
+            if self._tables is None or now - self._checked_at >= self.reload_interval:
+                self._checked_at = now
+                try:
+                    mtimes = self._get_mtimes()
+                    if mtimes != self._mtimes:
+                        self._tables = load_tables(self.reloads + 1, *self.paths)
+                        self._mtimes = mtimes
+                        self.reloads += 1
+                except (OSError, ValueError, KeyError, IndexError):
+                    # a file mid-edit: keep serving the last good tables
+                    if self._tables is None:
+                        raise
+        return self._tables
+
+    def section(self, resource_type):
+        """Returns the IHE section metadata for a FHIR resource type, if any"""
+        return self.tables.sections_by_resource_type.get(resource_type)
+
+    def section_by_code(self, code):
+        """Returns the IHE section metadata for a LOINC section code, if any"""
+        return self.tables.sections_by_code.get(code)
+
+
+terminology = TerminologyRegistry()
+
+
+def get_language_code(language_display):
+    """Returns the language code for a given language display name"""
+    return LANGUAGE_CODES.get(language_display.lower(), "en")
+
+
+def get_language_display(language_code):
+    """Returns the language display name for a given language code"""
+    return LANGUAGE_DISPLAYS.get(language_code.lower(), "English")
+
+
+def get_relationship_code(contact_relationship):
+    """Returns the relationship code for a given relationship display name"""
+    return RELATIONSHIP_CODES.get(contact_relationship, "U")
+
+
+def get_relationship_display(relationship_code):
+    """Returns the relationship display name for a given relationship code"""
+    return RELATIONSHIP_DISPLAYS.get(relationship_code, "Unknown")
@@ -0,0 +1,81 @@
+import os
+import sys
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fhir_json  # noqa: E402
+
+Request = namedtuple("Request", "method path headers body")
+
+
+class FakeServer:
+    """In-process HTTP server that answers every request with a handler
+
+    handler(request) returns (status, body, headers); a dict body is sent
+    as FHIR JSON, bytes as they are. A Content-Length header larger than
+    the body simulates a dropped connection. Requests are recorded in order.
+    """
+
+    def __init__(self):
+        self.handler = lambda request: (404, {"resourceType": "OperationOutcome"}, {})
+        self.requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = Request(
+                    self.command, self.path, self.headers, self.rfile.read(length)
+                )
+                fake.requests.append(request)
+                status, body, headers = fake.handler(request)
+                if isinstance(body, dict):
+                    body = fhir_json.dumps_bytes(body)
+                body = body or b""
+                headers = {
+                    "Content-Type": "application/fhir+json",
+                    "Content-Length": str(len(body)),
+                    **headers,
+                }
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+                if int(headers["Content-Length"]) != len(body):
+                    self.close_connection = True
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/fhir"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fhir_server():
+    server = FakeServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def other_server():
+    """A second server, standing in for a host the app must never call"""
+    server = FakeServer()
+    yield server
+    server.close()
@@ -0,0 +1,274 @@
+import json
+import random
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import app as app_module
+from cda_sections import get_sections
+from fhir_validation import validate_resource
+from synthetic_bundles import generate_bundle
+
+
+def searchset(resources, **extra):
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "entry": [{"resource": resource} for resource in resources],
+        **extra,
+    }
+
+
+def serve_patients(bundle):
+    """Handler answering reads and searches from a patient Bundle"""
+    resources = [entry["resource"] for entry in bundle["entry"]]
+
+    def handler(request):
+        url = urlsplit(request.path)
+        path = url.path.split("/fhir/", 1)[1].split("/")
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        matches = [
+            resource
+            for resource in resources
+            if resource["resourceType"] == path[0]
+            and (len(path) == 1 or resource["id"] == path[1])
+            and query.get("_id", resource["id"]) == resource["id"]
+        ]
+        if len(path) > 1:
+            if not matches:
+                return 404, {"resourceType": "OperationOutcome"}, {}
+            return 200, matches[0], {}
+        return 200, searchset(matches), {}
+
+    return handler
+
+
+@pytest.fixture
+def patient_bundle():
+    return generate_bundle(random.Random(0))
+
+
+@pytest.fixture
+def client(fhir_server, patient_bundle, monkeypatch):
+    fhir_server.handler = serve_patients(patient_bundle)
+    monkeypatch.setattr(app_module, "FHIR_SERVER_URL", fhir_server.url)
+    app_module.app.config["TESTING"] = True
+    return app_module.app.test_client()
+
+
+def test_cda_view_shows_every_section(client, patient_bundle):
+    patient_id = patient_bundle["id"]
+
+    response = client.get(f"/hl7/patient_summary/fhir/{patient_id}/cda/view")
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert html.count("<h3>") == len(get_sections()) > 0
+    assert html.count("<table>") == len(get_sections())
+    assert "urn:hl7-org:v3" not in html
+
+
+
+def test_cda_view_converts_off_the_event_loop(client, patient_bundle, monkeypatch):
+    threads = []
+    get_cda_document = app_module.get_cda_document
+
+    def recording_get_cda_document(bundle):
+        threads.append(threading.current_thread().name)
+        return get_cda_document(bundle)
+
+    monkeypatch.setattr(app_module, "get_cda_document", recording_get_cda_document)
+
+    response = client.get(f"/hl7/patient_summary/fhir/{patient_bundle['id']}/cda/view")
+
+    assert response.status_code == 200
+    assert len(threads) == 1 and threads[0] != "fhir-async-loop"
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/hl7/patient_summary/fhir/select",
+        "/hl7/patient_summary/fhir/patient/search",
+        "/hl7/patient_summary/fhir/async/select",
+        "/hl7/patient_summary/fhir/async/patient/search",
+    ],
+)
+def test_paging_views_never_follow_foreign_cursors(
+    client, fhir_server, other_server, path
+):
+    cursor = f"{other_server.url}?_getpages=x&next={fhir_server.url}"
+
+    response = client.get(path, query_string={"page": cursor})
+
+    assert response.status_code in (200, 302)
+    assert other_server.requests == []
+    assert fhir_server.requests == []
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/hl7/patient_summary/fhir/select",
+        "/hl7/patient_summary/fhir/patient/search",
+        "/hl7/patient_summary/fhir/async/select",
+        "/hl7/patient_summary/fhir/async/patient/search",
+    ],
+)
+def test_expired_cursor_goes_back_to_the_first_page(client, fhir_server, path):
+    fhir_server.handler = lambda request: (410, {"resourceType": "OperationOutcome"}, {})
+    cursor = f"{fhir_server.url}?_getpages=expired&_getpagesoffset=20"
+
+    response = client.get(path, query_string={"page": cursor})
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == path
+    with client.session_transaction() as session:
+        assert session["_flashes"][0][0] == "alert-warning"
+
+
+def test_bytecode_cache_dir_is_created_private(tmp_path):
+    directory = tmp_path / "jinja"
+
+    assert app_module.get_bytecode_cache(str(directory)) is not None
+    assert directory.stat().st_mode & 0o777 == 0o700
+    assert app_module.get_bytecode_cache("") is None
+
+
+def test_shared_bytecode_cache_dir_is_refused(tmp_path):
+    directory = tmp_path / "jinja"
+    directory.mkdir()
+    directory.chmod(0o777)
+
+    with pytest.raises(ValueError, match="0700"):
+        app_module.get_bytecode_cache(str(directory))
+
+
+SUMMARY_PATHS = ["/hl7/patient_summary/fhir/{}", "/hl7/patient_summary/fhir/async/{}"]
+
+
+@pytest.fixture
+def versioned_patient(patient_bundle):
+    patient = patient_bundle["entry"][0]["resource"]
+    patient["meta"] = {"versionId": "1"}
+    return patient
+
+
+@pytest.mark.parametrize("path", SUMMARY_PATHS)
+def test_summary_is_served_with_a_strong_etag(client, versioned_patient, path):
+    response = client.get(path.format(versioned_patient["id"]))
+
+    assert response.status_code == 200
+    etag, weak = response.get_etag()
+    assert etag and not weak
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert versioned_patient["name"][0]["family"] in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize("path", SUMMARY_PATHS)
+@pytest.mark.parametrize("weak", [False, True])
+def test_unchanged_summary_is_not_modified(client, versioned_patient, path, weak):
+    url = path.format(versioned_patient["id"])
+    etag, _ = client.get(url).get_etag()
+    # compressing proxies may hand the validator back as a weak one
+    if_none_match = f'W/"{etag}"' if weak else f'"{etag}"'
+
+    response = client.get(url, headers={"If-None-Match": if_none_match})
+
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.get_etag() == (etag, False)
+
+
+@pytest.mark.parametrize("path", SUMMARY_PATHS)
+def test_summary_with_flashed_messages_is_not_stored(client, versioned_patient, path):
+    url = path.format(versioned_patient["id"])
+    etag, _ = client.get(url).get_etag()
+    with client.session_transaction() as session:
+        session["_flashes"] = [("alert-success", "Patient saved")]
+
+    response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in response.headers
+    assert "Patient saved" in response.get_data(as_text=True)
+
+
+PATIENT_FORM = {
+    "given_name": "Jane",
+    "family_name": "Doe",
+    "birth_date": "1980-05-12",
+    "gender": "female",
+    "phone": "555-555-5555",
+    "email": "jane@example.org",
+    "languages": "English",
+    "contact_given_name": "John",
+    "general_practitioner": "Practitioner/gp-1",
+    "managing_organization": "Organization/org-1",
+    "link": "Patient/p2",
+    "photo": "http://example.org/photo.png",
+}
+
+
+def save_patients(request):
+    """Handler accepting every Patient create or update"""
+    if request.method not in ("POST", "PUT"):
+        return 404, {"resourceType": "OperationOutcome"}, {}
+    patient = json.loads(request.body)
+    patient.setdefault("id", "created")
+    patient["meta"] = {"versionId": "1"}
+    return 201 if request.method == "POST" else 200, patient, {}
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/hl7/patient_summary/fhir/patient/new",
+        "/hl7/patient_summary/fhir/patient/edit?patient_id=p1",
+    ],
+)
+def test_patient_forms_pass_schema_validation(client, fhir_server, monkeypatch, path):
+    monkeypatch.setattr(app_module, "PATIENT_FORM_VALIDATION", "schema")
+    fhir_server.handler = save_patients
+
+    response = client.post(path, data=PATIENT_FORM)
+
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        flashes = session["_flashes"]
+    assert [category for category, _ in flashes] == ["alert-success"], flashes
+    saved = json.loads(fhir_server.requests[-1].body)
+    validate_resource(saved, "schema")
+    assert saved["generalPractitioner"][0]["reference"] == "Practitioner/gp-1"
+    assert saved["managingOrganization"]["reference"] == "Organization/org-1"
+    assert saved["link"][0]["other"]["reference"] == "Patient/p2"
+    assert saved["photo"][0]["url"] == "http://example.org/photo.png"
+
+
+
+def test_async_summary_uses_the_caches_off_the_event_loop(
+    client, versioned_patient, monkeypatch
+):
+    app_module.patient_cache.invalidate(versioned_patient["id"])
+    threads = []
+
+    def recording(method):
+        def call(*args, **kwargs):
+            threads.append((method.__name__, threading.current_thread().name))
+            return method(*args, **kwargs)
+
+        return call
+
+    for cache, name in [
+        (app_module.patient_cache, "lookup"),
+        (app_module.patient_cache, "store"),
+        (app_module.summary_fragment_cache, "get_fragment"),
+    ]:
+        monkeypatch.setattr(cache, name, recording(getattr(cache, name)))
+
+    response = client.get(f"/hl7/patient_summary/fhir/async/{versioned_patient['id']}")
+
+    assert response.status_code == 200
+    assert [name for name, _ in threads] == ["lookup", "store", "get_fragment"]
+    assert "fhir-async-loop" not in [thread for _, thread in threads]
@@ -0,0 +1,98 @@
+import socket
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import fhir_json
+from bulk_export import MANIFEST_FILE, STATUS_FILE, BulkExportError, main, run_export
+
+# large enough that the first, dropped download writes some blocks to disk
+NDJSON = b"".join(
+    fhir_json.dumps_bytes({"resourceType": "Patient", "id": f"p{i}"}) + b"\n"
+    for i in range(10000)
+)
+
+
+def export_handler(polls=2, drops=1, output_type="Patient"):
+    """A server that answers 202 polls times, then drops the first download"""
+    state = {"polls": 0, "drops": drops}
+
+    def handler(request):
+        path = urlsplit(request.path).path
+        if path == "/fhir/$export":
+            return 202, b"", {"Content-Location": "status/1"}
+        if path == "/fhir/status/1":
+            state["polls"] += 1
+            if state["polls"] <= polls:
+                return 202, b"", {"Retry-After": "0", "X-Progress": "busy"}
+            manifest = {
+                "transactionTime": "2024-01-01T00:00:00Z",
+                "requiresAccessToken": False,
+                "output": [{"type": output_type, "url": "/fhir/files/patients.ndjson"}],
+                "error": [],
+            }
+            return 200, manifest, {}
+        if path == "/fhir/files/patients.ndjson":
+            byte_range = request.headers.get("Range")
+            if byte_range:
+                offset = int(byte_range.removeprefix("bytes=").rstrip("-"))
+                content_range = f"bytes {offset}-{len(NDJSON) - 1}/{len(NDJSON)}"
+                return 206, NDJSON[offset:], {"Content-Range": content_range}
+            if state["drops"]:
+                state["drops"] -= 1
+                cut = NDJSON[: len(NDJSON) * 3 // 4]
+                return 200, cut, {"Content-Length": str(len(NDJSON))}
+            return 200, NDJSON, {}
+        return 404, {"resourceType": "OperationOutcome"}, {}
+
+    return handler
+
+
+def test_export_kicks_off_polls_and_resumes_a_dropped_download(fhir_server, tmp_path):
+    fhir_server.handler = export_handler()
+
+    manifest = run_export(fhir_server.url, tmp_path, ["Patient"])
+
+    assert (tmp_path / "Patient-1.ndjson").read_bytes() == NDJSON
+    assert not (tmp_path / "Patient-1.ndjson.part").exists()
+    status = fhir_json.loads((tmp_path / STATUS_FILE).read_bytes())
+    assert status == {"status_url": f"{fhir_server.url}/status/1"}
+    saved = fhir_json.loads((tmp_path / MANIFEST_FILE).read_bytes())
+    assert saved == manifest
+    assert manifest["output"][0]["url"] == f"{fhir_server.url}/files/patients.ndjson"
+
+    kick_off, *rest = fhir_server.requests
+    assert kick_off.headers["Prefer"] == "respond-async"
+    assert parse_qs(urlsplit(kick_off.path).query) == {"_type": ["Patient"]}
+    assert [urlsplit(r.path).path for r in rest].count("/fhir/status/1") == 3
+    downloads = [r for r in rest if r.path.endswith("patients.ndjson")]
+    assert len(downloads) == 2
+    assert "Range" not in downloads[0].headers
+    assert downloads[1].headers["Range"].startswith("bytes=")
+    assert downloads[1].headers["Range"] != "bytes=0-"
+
+
+def test_main_reports_an_unreachable_server(tmp_path, capsys):
+    with socket.socket() as sock:  # a port with nothing listening on it
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    code = main(["--server", f"http://127.0.0.1:{port}/fhir", "--out", str(tmp_path)])
+
+    assert code == 1
+    assert "run again to resume" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("output_type", ["../../escaped", "/tmp/escaped", "", None])
+def test_manifest_types_never_leave_the_output_directory(
+    fhir_server, tmp_path, output_type
+):
+    fhir_server.handler = export_handler(polls=0, output_type=output_type)
+    out_dir = tmp_path / "out" / "export"
+
+    with pytest.raises(BulkExportError, match="Invalid resource type"):
+        run_export(fhir_server.url, out_dir, ["Patient"])
+
+    assert sorted(path.name for path in out_dir.iterdir()) == [MANIFEST_FILE, STATUS_FILE]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["out"]
+    assert not any(r.path.endswith("patients.ndjson") for r in fhir_server.requests)
@@ -0,0 +1,117 @@
+import os
+from operator import itemgetter
+
+import pytest
+
+import fhir_json
+from bulk_import import BulkImportError, BulkImporter, validate_resource
+from fhir_pool import get_fhir_client
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "r4_export.ndjson")
+
+
+def batch_response(received):
+    """Handler answering every batch entry with 200 and keeping its resource"""
+
+    def handler(request):
+        bundle = fhir_json.loads(request.body)
+        received.extend(entry["resource"] for entry in bundle["entry"])
+        response = {
+            "resourceType": "Bundle",
+            "type": "batch-response",
+            "entry": [{"response": {"status": "200 OK"}} for _ in bundle["entry"]],
+        }
+        return 200, response, {}
+
+    return handler
+
+
+def read_fixture():
+    with open(FIXTURE, "rb") as file:
+        return [fhir_json.loads(line) for line in file if line.strip()]
+
+
+def test_r4_export_imports_with_default_validation(fhir_server, tmp_path):
+    received = []
+    fhir_server.handler = batch_response(received)
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    importer = BulkImporter(get_fhir_client(fhir_server.url), checkpoint, validators=1)
+    counts = importer.run([FIXTURE])
+
+    assert counts == {"lines": 5, "imported": 5, "rejected": 0}
+    assert received == read_fixture()
+    with open(checkpoint, "rb") as file:
+        assert fhir_json.loads(file.read()) == {os.path.abspath(FIXTURE): 6}
+
+
+@pytest.mark.parametrize("resource_type", ["MedicationStatement", "Procedure"])
+def test_full_validation_rejects_r4_only_fields(resource_type):
+    (resource,) = [r for r in read_fixture() if r["resourceType"] == resource_type]
+    validate_resource(resource)
+    with pytest.raises(ValueError):
+        validate_resource(resource, "full")
+
+
+def test_unreachable_server_stops_without_advancing_checkpoint(
+    fhir_server, tmp_path, monkeypatch
+):
+    monkeypatch.setattr("bulk_import.get_retry_delay", lambda attempt, retry_after: 0)
+    fhir_server.handler = lambda request: (503, b"", {})
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    importer = BulkImporter(
+        get_fhir_client(fhir_server.url), checkpoint, batch_size=2, validators=1
+    )
+    with pytest.raises(BulkImportError, match="HTTP 503"):
+        importer.run([FIXTURE])
+
+    assert not os.path.exists(checkpoint)
+    assert not os.path.exists(f"{checkpoint}.rejects.ndjson")
+    assert importer.counts == {"lines": 0, "imported": 0, "rejected": 0}
+
+    # once the server is back, a new run imports every line
+    received = []
+    fhir_server.handler = batch_response(received)
+    importer = BulkImporter(
+        get_fhir_client(fhir_server.url), checkpoint, batch_size=2, validators=1
+    )
+    assert importer.run([FIXTURE])["imported"] == 5
+    by_id = itemgetter("id")
+    assert sorted(received, key=by_id) == sorted(read_fixture(), key=by_id)
+
+
+@pytest.mark.parametrize("status", [401, 403, 404, 405])
+def test_wrong_endpoint_or_credentials_stop_without_advancing_checkpoint(
+    fhir_server, tmp_path, status
+):
+    outcome = {"resourceType": "OperationOutcome"}
+    fhir_server.handler = lambda request: (status, outcome, {})
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    importer = BulkImporter(
+        get_fhir_client(fhir_server.url), checkpoint, batch_size=2, validators=1
+    )
+    with pytest.raises(BulkImportError, match=f"HTTP {status}"):
+        importer.run([FIXTURE])
+
+    bodies = [request.body for request in fhir_server.requests]
+    assert len(bodies) == len(set(bodies))  # no chunk is retried
+    assert not os.path.exists(checkpoint)
+    assert not os.path.exists(f"{checkpoint}.rejects.ndjson")
+    assert importer.counts == {"lines": 0, "imported": 0, "rejected": 0}
+
+
+def test_rejected_bundle_content_is_recorded_and_checkpointed(fhir_server, tmp_path):
+    outcome = {"resourceType": "OperationOutcome"}
+    fhir_server.handler = lambda request: (422, outcome, {})
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    importer = BulkImporter(
+        get_fhir_client(fhir_server.url), checkpoint, batch_size=2, validators=1
+    )
+    counts = importer.run([FIXTURE])
+
+    assert counts == {"lines": 5, "imported": 0, "rejected": 5}
+    with open(checkpoint, "rb") as file:
+        assert fhir_json.loads(file.read()) == {FIXTURE: 6}
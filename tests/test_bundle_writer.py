@@ -0,0 +1,78 @@
+import copy
+import os
+
+import pytest
+
+import fhir_json
+from bundle_writer import build_bundle
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "sample.json")
+
+
+def sample_resources():
+    with open(SAMPLE, "rb") as file:
+        return [entry["resource"] for entry in fhir_json.loads(file.read())["entry"]]
+
+
+def test_post_rewrites_references_to_bundle_entries():
+    patient = {"resourceType": "Patient", "id": "p1"}
+    condition = {
+        "resourceType": "Condition",
+        "id": "c1",
+        "subject": {"reference": "Patient/p1"},
+        "recorder": {"reference": "Practitioner/elsewhere"},
+    }
+    resources = [patient, condition]
+    original = copy.deepcopy(resources)
+
+    bundle = build_bundle(resources, "transaction", "POST")
+
+    patient_entry, condition_entry = bundle["entry"]
+    assert patient_entry["fullUrl"].startswith("urn:uuid:")
+    assert "id" not in patient_entry["resource"]
+    assert condition_entry["resource"]["subject"]["reference"] == patient_entry["fullUrl"]
+    assert condition_entry["resource"]["recorder"]["reference"] == "Practitioner/elsewhere"
+    assert resources == original
+
+
+@pytest.mark.parametrize("method", ["POST", "PUT"])
+def test_sample_references_point_at_the_sample_patient(method):
+    bundle = build_bundle(sample_resources(), "transaction", method)
+
+    patient_entry = bundle["entry"][0]
+    assert patient_entry["resource"]["resourceType"] == "Patient"
+    subjects = [
+        reference["reference"]
+        for entry in bundle["entry"][1:]
+        for field in ("patient", "subject")
+        for reference in [entry["resource"].get(field)]
+        if reference
+    ]
+    assert len(subjects) == len(bundle["entry"]) - 1
+    assert set(subjects) == {patient_entry["fullUrl"]}
+    if method == "PUT":
+        assert patient_entry["fullUrl"] == "Patient/12345036089"
+
+
+def test_put_requires_an_id():
+    with pytest.raises(ValueError, match="Condition has no id"):
+        build_bundle([{"resourceType": "Condition"}], "batch", "PUT")
+
+
+@pytest.mark.parametrize("method", ["POST", "PUT"])
+def test_dash_references_resolve_only_exact_matches(method):
+    practitioner = {"resourceType": "Practitioner", "id": "1"}
+    patient = {"resourceType": "Patient", "id": "p1"}
+    condition = {
+        "resourceType": "Condition",
+        "id": "c1",
+        "subject": {"reference": "Patient-p1"},
+        "recorder": {"reference": "Practitioner-99"},
+    }
+
+    bundle = build_bundle([practitioner, patient, condition], "transaction", method)
+
+    _, patient_entry, condition_entry = bundle["entry"]
+    assert condition_entry["resource"]["subject"]["reference"] == patient_entry["fullUrl"]
+    # not the Bundle's only Practitioner, which is a different one
+    assert condition_entry["resource"]["recorder"]["reference"] == "Practitioner-99"
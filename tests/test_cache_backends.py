@@ -0,0 +1,92 @@
+import importlib
+import os
+import sqlite3
+import stat
+import sys
+
+import pytest
+
+import cache_backends
+from cache_backends import SQLiteCache, create_cache
+
+
+def test_sqlite_lookup_does_not_wait_for_writers(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = SQLiteCache(10, 60, path, flush_interval=3600)
+    cache.set("p1", {"id": "p1"})
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")  # another worker holds the write lock
+    try:
+        assert cache.get("p1") == ({"id": "p1"}, True)
+        assert cache.get("p2") == (None, False)
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_sqlite_eviction_sees_batched_lookups(tmp_path):
+    cache = SQLiteCache(2, 60, str(tmp_path / "cache.db"), flush_interval=3600)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # a is now the most recently used, though not yet written
+
+    cache.set("c", 3)
+
+    assert cache.get("a") == (1, True)
+    assert cache.get("b") == (None, False)
+    assert cache.get("c") == (3, True)
+
+
+def test_sqlite_counters_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = SQLiteCache(10, 60, path, flush_interval=0)
+    second = SQLiteCache(10, 60, path, flush_interval=0)
+    first.set("p1", {"id": "p1"})
+
+    first.get("p1")
+    second.get("p1")
+
+    assert second.stats()["hits"] == 2
+
+
+def test_default_sqlite_file_is_private(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_backends.tempfile, "gettempdir", lambda: str(tmp_path))
+
+    cache = create_cache("sqlite", 10, 60)
+
+    directory = tmp_path / f"fhir-cache-{os.getuid()}"
+    assert cache.path == str(directory / "fhir_patient_cache.db")
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(cache.path).st_mode) == 0o600
+
+
+def test_sqlite_file_in_shared_directory_is_refused(tmp_path):
+    directory = tmp_path / "shared"
+    directory.mkdir(mode=0o777)
+    directory.chmod(0o1777)
+
+    with pytest.raises(ValueError, match="mode 0700"):
+        SQLiteCache(10, 60, str(directory / "cache.db"))
+
+
+def test_sqlite_file_open_to_others_is_refused(tmp_path):
+    path = tmp_path / "cache.db"
+    path.touch(mode=0o644)
+    path.chmod(0o644)
+
+    with pytest.raises(ValueError, match="mode 0600"):
+        SQLiteCache(10, 60, str(path))
+
+
+def test_summary_cache_refuses_a_shared_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUMMARY_CACHE_BACKEND", "sqlite")
+    monkeypatch.setenv("SUMMARY_CACHE_PATH", str(tmp_path / "summary.db"))
+    (tmp_path / "summary.db").touch(mode=0o666)
+    (tmp_path / "summary.db").chmod(0o666)  # planted by another local user
+    monkeypatch.delitem(sys.modules, "summary_cache", raising=False)
+
+    with pytest.raises(ValueError, match="mode 0600"):
+        importlib.import_module("summary_cache")
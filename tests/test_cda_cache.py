@@ -0,0 +1,71 @@
+import random
+
+import cda_cache
+from cda_cache import DocumentCache, bundle_digest, iter_cached_cda
+from synthetic_bundles import generate_bundle
+
+
+def stream(bundle, cache):
+    return b"".join(iter_cached_cda(bundle, cache))
+
+
+def test_large_document_goes_to_disk_without_memory_copy(tmp_path):
+    bundle = generate_bundle(random.Random(0), conditions=50)
+    cache = DocumentCache(max_bytes=1024, disk_dir=tmp_path, disk_max_bytes=10**7)
+
+    document = stream(bundle, cache)
+
+    assert len(document) > cache.max_bytes
+    assert cache.stats()["documents"] == 0
+    key = bundle_digest(bundle)
+    assert [path.name for path in tmp_path.iterdir()] == [f"{key}.xml"]
+    assert stream(bundle, cache) == document
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_document_too_large_for_both_tiers_is_not_kept(tmp_path):
+    bundle = generate_bundle(random.Random(0), conditions=50)
+    cache = DocumentCache(max_bytes=1024, disk_dir=tmp_path, disk_max_bytes=2048)
+
+    stream(bundle, cache)
+
+    assert cache.stats()["documents"] == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_abandoned_stream_leaves_no_temporary_file(tmp_path):
+    bundle = generate_bundle(random.Random(0), conditions=50)
+    cache = DocumentCache(disk_dir=tmp_path)
+
+    chunks = iter_cached_cda(bundle, cache)
+    next(chunks)
+    chunks.close()
+
+    assert list(tmp_path.iterdir()) == []
+    assert cache.get(bundle_digest(bundle)) is None
+
+
+def test_new_converter_code_does_not_reuse_disk_documents(tmp_path, monkeypatch):
+    bundle = generate_bundle(random.Random(0))
+    stream(bundle, DocumentCache(disk_dir=tmp_path))
+
+    # a deploy changing the conversion code, then a restarted worker
+    monkeypatch.setattr(cda_cache, "_converter_version", "next-release")
+    cache = DocumentCache(disk_dir=tmp_path)
+    stream(bundle, cache)
+
+    assert cache.stats()["disk_hits"] == 0
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_disk_read_survives_concurrent_eviction(tmp_path, monkeypatch):
+    cache = DocumentCache(disk_dir=tmp_path)
+    cache.set("key", b"<ClinicalDocument/>")
+    restarted = DocumentCache(disk_dir=tmp_path)
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(cda_cache.os, "utime", evicted)
+
+    assert restarted.get("key") == b"<ClinicalDocument/>"
@@ -0,0 +1,73 @@
+import random
+
+import cda_sections
+from cda_sections import (
+    SectionCache,
+    build_structured_body,
+    get_code_text,
+    get_sections,
+    section_digest,
+)
+from convert_fhir_to_cda import index_bundle
+from synthetic_bundles import generate_bundle
+
+
+def section_titles(component):
+    assert component.tag == "component"
+    (structured_body,) = component
+    assert structured_body.tag == "structuredBody"
+    return [section.findtext("title") for section in structured_body.iter("section")]
+
+
+def test_structured_body_keeps_every_section(monkeypatch):
+    monkeypatch.setattr(cda_sections, "section_cache", SectionCache())
+    bundle_index = index_bundle(generate_bundle(random.Random(0)))
+
+    built = section_titles(build_structured_body(bundle_index))
+    # the second document's sections all come from the cache
+    cached = section_titles(build_structured_body(bundle_index))
+
+    assert len(built) == len(get_sections()) > 1
+    assert cached == built
+    assert cda_sections.section_cache.stats()["hits"] == len(built)
+
+
+def r4_medication_bundle(medication):
+    statement = {
+        "resourceType": "MedicationStatement",
+        "id": "statement",
+        "status": "active",
+        "subject": {"reference": "Patient/p1"},
+        **medication,
+    }
+    medication_resource = {
+        "resourceType": "Medication",
+        "id": "amoxicillin",
+        "code": {"coding": [{"code": "313782", "display": "Amoxicillin 500 MG"}]},
+    }
+    resources = [{"resourceType": "Patient", "id": "p1"}, statement, medication_resource]
+    return {"resourceType": "Bundle", "entry": [{"resource": r} for r in resources]}
+
+
+def test_r4_medication_codeable_concept_is_read():
+    bundle_index = index_bundle(
+        r4_medication_bundle(
+            {"medicationCodeableConcept": {"coding": [{"display": "Lisinopril 10 MG"}]}}
+        )
+    )
+    (statement,) = bundle_index.resources("MedicationStatement")
+
+    assert get_code_text(statement, bundle_index) == "Lisinopril 10 MG"
+
+
+def test_r4_medication_reference_is_resolved():
+    bundle_index = index_bundle(
+        r4_medication_bundle({"medicationReference": {"reference": "Medication/amoxicillin"}})
+    )
+    (statement,) = bundle_index.resources("MedicationStatement")
+
+    assert get_code_text(statement, bundle_index) == "Amoxicillin 500 MG"
+    # a change to the referenced Medication rebuilds the section
+    before = section_digest({}, "MedicationStatement", bundle_index)
+    bundle_index.resources("Medication")[0]["code"] = {"text": "Amoxicillin 250 MG"}
+    assert section_digest({}, "MedicationStatement", bundle_index) != before
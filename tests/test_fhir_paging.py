@@ -0,0 +1,49 @@
+import pytest
+
+from fhir_paging import PagePrefetcher, is_page_link
+
+BASE_URL = "https://hapi.fhir.org/baseR4"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        f"{BASE_URL}?_getpages=abc&_getpagesoffset=20&_count=20",
+        f"{BASE_URL}/Patient?_count=20&_page_token=abc",
+    ],
+)
+def test_page_links_on_the_server_are_followed(url):
+    assert is_page_link(url, BASE_URL)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        f"https://attacker.example/?next={BASE_URL}",
+        f"https://attacker.example{BASE_URL[len('https://hapi.fhir.org'):]}",
+        "https://hapi.fhir.org/baseR4evil?_getpages=abc",
+        "https://hapi.fhir.org/baseR4/../admin",
+        "https://hapi.fhir.org/baseR4/%2e%2e/admin",
+        "https://user@hapi.fhir.org/baseR4",
+        "http://hapi.fhir.org/baseR4",
+        "https://hapi.fhir.org:8443/baseR4",
+        "//hapi.fhir.org/baseR4",
+        "Patient?_count=20",
+        "file:///etc/passwd",
+        "",
+        None,
+    ],
+)
+def test_other_links_are_rejected(url):
+    assert not is_page_link(url, BASE_URL)
+
+
+def test_prefetcher_never_fetches_foreign_links():
+    fetched = []
+    prefetcher = PagePrefetcher(max_workers=1)
+
+    prefetcher.prefetch("https://attacker.example/", fetched.append, BASE_URL)
+    with pytest.raises(ValueError):
+        prefetcher.get("https://attacker.example/", fetched.append, BASE_URL)
+
+    assert fetched == []
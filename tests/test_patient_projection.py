@@ -0,0 +1,42 @@
+from patient_projection import PATIENT_DEFAULTS, project_patient
+
+
+def test_sparse_patient_gets_every_default():
+    patient_data = project_patient("p1", {"resourceType": "Patient", "id": "p1"})
+
+    assert patient_data == {**PATIENT_DEFAULTS, "id": "p1"}
+
+
+def test_shared_contact_path_fills_its_fields():
+    contact = {
+        "relationship": [{"coding": [{"display": "Next-of-Kin"}]}],
+        "name": {"family": "Doe", "given": ["John"]},
+        "telecom": [{"value": "555-555-0000", "use": "mobile"}],
+        "address": [{"line": ["1 Main St"], "city": "Springfield", "use": "home"}],
+    }
+    patient_data = project_patient(
+        "p2",
+        {
+            "resourceType": "Patient",
+            "maritalStatus": {"coding": [{"display": "Married"}]},
+            "contact": [contact],
+        },
+    )
+
+    assert patient_data["contact"] == "John Doe"
+    assert patient_data["contact_relationship"] == "Next-of-Kin"
+    assert patient_data["contact_address"] == "1 Main St, Springfield,   (home)"
+    assert patient_data["contact_phone"] == "555-555-0000 (mobile)"
+    # only one ContactPoint, so the email formatter fails and keeps its default
+    assert patient_data["contact_email"] == "N/A"
+    assert patient_data["marital_status"] == "Married"
+
+
+def test_malformed_path_keeps_the_default():
+    patient_data = project_patient(
+        "p3", {"resourceType": "Patient", "maritalStatus": {"coding": []}, "meta": []}
+    )
+
+    assert patient_data["marital_status"] == "N/A"
+    assert patient_data["source"] == "N/A"
+    assert patient_data["profile"] == ""
@@ -0,0 +1,60 @@
+from urllib.parse import parse_qs, urlsplit
+
+from fhir_async import get_async_fhir_client, run_coroutine
+from summary_loader import load_patient_summary
+
+
+def paged_conditions(base_url, pages, next_url=None):
+    """Handler serving the Patient and its Conditions over several pages"""
+
+    def handler(request):
+        url = urlsplit(request.path)
+        query = parse_qs(url.query)
+        resource_type = url.path.rsplit("/", 1)[1]
+        entries = []
+        links = []
+        if resource_type == "Patient":
+            entries = [{"resource": {"resourceType": "Patient", "id": "p1"}}]
+        elif resource_type == "Condition":
+            page = int(query.get("page", ["1"])[0])
+            entries = [
+                {"resource": {"resourceType": "Condition", "id": f"c{page}-{n}"}}
+                for n in range(2)
+            ]
+            if page < pages:
+                link = next_url or f"{base_url}/Condition?patient=p1&page={page + 1}"
+                links = [{"relation": "next", "url": link}]
+        bundle = {"resourceType": "Bundle", "type": "searchset", "entry": entries}
+        return 200, {**bundle, "link": links}, {}
+
+    return handler
+
+
+def load(server):
+    client = get_async_fhir_client(server.url)
+    return run_coroutine(load_patient_summary(client, "p1", use_everything=False))
+
+
+def test_summary_follows_next_links(fhir_server):
+    fhir_server.handler = paged_conditions(fhir_server.url, pages=3)
+
+    bundle = load(fhir_server)
+
+    conditions = [
+        entry["resource"]["id"]
+        for entry in bundle["entry"]
+        if entry["resource"]["resourceType"] == "Condition"
+    ]
+    assert conditions == ["c1-0", "c1-1", "c2-0", "c2-1", "c3-0", "c3-1"]
+    assert "incomplete" not in bundle
+
+
+def test_summary_never_follows_foreign_next_links(fhir_server, other_server):
+    fhir_server.handler = paged_conditions(
+        fhir_server.url, pages=2, next_url=f"{other_server.url}/Condition?page=2"
+    )
+
+    bundle = load(fhir_server)
+
+    assert bundle["incomplete"] == ["Condition"]
+    assert other_server.requests == []